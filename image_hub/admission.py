@@ -0,0 +1,83 @@
+import asyncio
+import math
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator
+
+from fastapi import HTTPException
+
+from image_hub.config import get_settings
+
+
+UPLOAD_ADMISSION = 'upload'
+AUTH_ADMISSION = 'auth'
+
+
+class AdmissionLimiter:
+    """
+    Bounds the number of concurrent requests of an endpoint class, and of requests waiting for a slot.
+
+    A request arriving when the wait queue is full, or waiting longer than `max_wait_seconds`,
+    is rejected with 503 and `Retry-After`, so CPU heavy endpoints can not starve the cheap ones.
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, max_wait_seconds: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    def _reject(self, reason: str) -> HTTPException:
+        self.rejected += 1
+        return HTTPException(
+            status_code=503,
+            detail=f'Server is busy with {self.name} requests, {reason}',
+            headers={'Retry-After': str(math.ceil(self.max_wait_seconds))}
+        )
+
+    @asynccontextmanager
+    async def admit(self) -> AsyncIterator[None]:
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            raise self._reject('the wait queue is full')
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.max_wait_seconds)
+        except TimeoutError:
+            raise self._reject(f'waited {self.max_wait_seconds} seconds')
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+
+@lru_cache
+def get_admission_limiter(name: str) -> AdmissionLimiter:
+    settings = get_settings()
+    return AdmissionLimiter(
+        name,
+        max_concurrency=getattr(settings, f'{name}_max_concurrency'),
+        max_queue=getattr(settings, f'{name}_max_queue'),
+        max_wait_seconds=getattr(settings, f'{name}_max_wait_seconds'),
+    )
+
+
+async def admit_upload():
+    async with get_admission_limiter(UPLOAD_ADMISSION).admit():
+        yield
+
+
+async def admit_auth():
+    async with get_admission_limiter(AUTH_ADMISSION).admit():
+        yield
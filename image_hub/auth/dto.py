@@ -14,3 +14,16 @@ class Token(BaseModel):
 class UserAuthDto(BaseModel):
     user_id: int
     is_admin: bool
+
+
+class UserStatsDto(BaseModel):
+    user_id: int
+    image_count: int
+    storage_bytes: int
+
+
+class UserStorageDto(BaseModel):
+    user_id: int
+    user_name: str
+    image_count: int
+    storage_bytes: int
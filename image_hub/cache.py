@@ -0,0 +1,65 @@
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class LRUBytesCache:
+    """
+    Least recently used cache bounded by the total byte size of its values.
+    Counts its hits, misses and evictions for the metrics endpoint.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        on_evict: Callable[[Hashable, Any], None] | None = None
+    ):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items: OrderedDict[Hashable, tuple[Any, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def get(self, key: Hashable) -> Any | None:
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._items.move_to_end(key)
+        return item[0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        if size > self.max_bytes:
+            return
+
+        self.pop(key)
+        self._items[key] = (value, size)
+        self.num_bytes += size
+
+        while self.num_bytes > self.max_bytes:
+            evicted_key, (evicted_value, evicted_size) = self._items.popitem(last=False)
+            self.num_bytes -= evicted_size
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(evicted_key, evicted_value)
+
+    def pop(self, key: Hashable) -> Any | None:
+        item = self._items.pop(key, None)
+        if item is None:
+            return None
+
+        self.num_bytes -= item[1]
+        return item[0]
+
+    def clear(self):
+        self._items.clear()
+        self.num_bytes = 0
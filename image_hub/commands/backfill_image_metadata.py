@@ -0,0 +1,70 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlmodel import Session, asc, create_engine, select, update
+from sqlalchemy.sql.operators import is_
+
+from image_hub.config import get_settings
+from image_hub.database.models import ImageInfo
+from image_hub.image.dto import ImageMetadataDto
+from image_hub.image.image_file import get_image_source, get_original_image_key
+from image_hub.image.processing import read_image_metadata
+
+
+def read_metadata(image_id: int, file_name: str) -> ImageMetadataDto | None:
+    try:
+        return read_image_metadata(*get_image_source(get_original_image_key(image_id, file_name)))
+    except (OSError, ValueError) as error:
+        print(f'image {image_id} is skipped: {error}')
+        return None
+
+
+def backfill_image_metadata(num_workers: int, batch_size: int):
+    engine = create_engine(get_settings().database_sync_url)
+
+    last_id = 0
+    num_updated = 0
+    with Session(engine) as session, ProcessPoolExecutor(num_workers) as executor:
+        while True:
+            result = session.exec(
+                select(ImageInfo.id, ImageInfo.file_name).where(
+                    ImageInfo.id > last_id,
+                    is_(ImageInfo.width, None)
+                ).order_by(
+                    asc(ImageInfo.id)
+                ).limit(batch_size)
+            )
+            rows = list(result)
+            if not rows:
+                break
+
+            image_ids = [image_id for image_id, _ in rows]
+            file_names = [file_name for _, file_name in rows]
+            metadata_list = executor.map(read_metadata, image_ids, file_names)
+
+            parameters = [
+                dict(id=image_id, **metadata.model_dump())
+                for image_id, metadata in zip(image_ids, metadata_list)
+                if metadata is not None
+            ]
+            if parameters:
+                session.exec(update(ImageInfo), params=parameters)
+                session.commit()
+
+            num_updated += len(parameters)
+            last_id = image_ids[-1]
+            print(f'metadata of {num_updated} images is stored, last image id {last_id}')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes')
+    parser.add_argument('--batch-size', type=int, default=500, help='number of images per DB batch')
+
+    args = parser.parse_args()
+    backfill_image_metadata(args.workers, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlmodel import Session, asc, create_engine, select, update
+from sqlalchemy.sql.operators import is_
+
+from image_hub.config import get_settings
+from image_hub.database.models import ImageInfo
+from image_hub.image.image_file import get_image_source, get_original_image_key
+from image_hub.image.perceptual_hash import compute_dhash, to_signed_64
+from image_hub.image.processing import open_image
+from image_hub.image.thumbnail import create_thumbnail
+
+
+def compute_perceptual_hash(image_id: int, file_name: str) -> int | None:
+    try:
+        source, _ = get_image_source(get_original_image_key(image_id, file_name))
+        with open_image(source) as img:
+            thumbnail = create_thumbnail(img, get_settings().thumbnail_size)
+    except (OSError, ValueError) as error:
+        print(f'image {image_id} is skipped: {error}')
+        return None
+
+    return to_signed_64(compute_dhash(thumbnail))
+
+
+def backfill_perceptual_hash(num_workers: int, batch_size: int):
+    engine = create_engine(get_settings().database_sync_url)
+
+    last_id = 0
+    num_updated = 0
+    with Session(engine) as session, ProcessPoolExecutor(num_workers) as executor:
+        while True:
+            result = session.exec(
+                select(ImageInfo.id, ImageInfo.file_name).where(
+                    ImageInfo.id > last_id,
+                    is_(ImageInfo.perceptual_hash, None)
+                ).order_by(
+                    asc(ImageInfo.id)
+                ).limit(batch_size)
+            )
+            rows = list(result)
+            if not rows:
+                break
+
+            image_ids = [image_id for image_id, _ in rows]
+            file_names = [file_name for _, file_name in rows]
+            hashes = executor.map(compute_perceptual_hash, image_ids, file_names)
+
+            parameters = [
+                dict(id=image_id, perceptual_hash=perceptual_hash)
+                for image_id, perceptual_hash in zip(image_ids, hashes)
+                if perceptual_hash is not None
+            ]
+            if parameters:
+                session.exec(update(ImageInfo), params=parameters)
+                session.commit()
+
+            num_updated += len(parameters)
+            last_id = image_ids[-1]
+            print(f'{num_updated} perceptual hashes are computed, last image id {last_id}')
+
+    print(
+        f'the similarity index of the server picks up the backfilled hashes '
+        f'within {get_settings().similarity_index_refresh_seconds} seconds'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes')
+    parser.add_argument('--batch-size', type=int, default=500, help='number of images per DB batch')
+
+    args = parser.parse_args()
+    backfill_perceptual_hash(args.workers, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,10 @@
+from image_hub.image.image_file import get_storage
+
+
+def compact_storage():
+    get_storage().compact()
+    print('image storage is compacted')
+
+
+if __name__ == '__main__':
+    compact_storage()
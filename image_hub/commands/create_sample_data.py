@@ -1,14 +1,15 @@
-import os
+from io import BytesIO
 from random import randint, sample
 
 from PIL import Image
 from sqlmodel import Session, create_engine
 
 from image_hub.auth.services import get_password_hash
+from image_hub.image.counters import reconcile_image_counts
 from image_hub.image.image_file import (
-    get_original_image_save_directory,
-    get_thumbnail_save_directory,
-    THUMBNAIL_FILE_NAME
+    get_original_image_key,
+    get_storage,
+    get_thumbnail_image_key
 )
 from image_hub.database.models import User, ImageCategory, ImageCategoryMapping, ImageInfo
 from image_hub.config import get_settings
@@ -94,21 +95,17 @@ def create_images_for_user(
 
     image_size = (256, 256)
     thumbnail_size = (128, 128)
+    storage = get_storage()
     for image_id, file_name in zip(image_ids, image_file_names):
-        save_directory = get_original_image_save_directory(image_id)
-        os.makedirs(save_directory, exist_ok=True)
-        file_path = os.path.join(save_directory, file_name)
-
         color = (randint(0, 255), randint(0, 255), randint(0, 255))
         image = Image.new('RGB', image_size, color)
-        image.save(file_path)
-
-        thumbnail_save_directory = get_thumbnail_save_directory(image_id)
-        os.makedirs(thumbnail_save_directory, exist_ok=True)
-        thumbnail_path = os.path.join(thumbnail_save_directory, THUMBNAIL_FILE_NAME)
+        image_bytes = BytesIO()
+        image.save(image_bytes, format='JPEG')
+        storage.put(get_original_image_key(image_id, file_name), image_bytes.getvalue())
 
-        image.resize(thumbnail_size)
-        image.save(thumbnail_path)
+        thumbnail_bytes = BytesIO()
+        image.resize(thumbnail_size).save(thumbnail_bytes, format='JPEG')
+        storage.put(get_thumbnail_image_key(image_id), thumbnail_bytes.getvalue())
 
 
 def create_sample_data():
@@ -125,6 +122,8 @@ def create_sample_data():
         for user_id in users:
             create_images_for_user(user_id, is_admin=False, category_ids=num_categories, session=session)
 
+        reconcile_image_counts(session)
+
 
 if __name__ == '__main__':
     create_sample_data()
@@ -0,0 +1,18 @@
+from sqlmodel import Session, create_engine
+
+from image_hub.config import get_settings
+from image_hub.image.counters import reconcile_image_counts, reconcile_storage_bytes
+
+
+def reconcile_counters():
+    engine = create_engine(get_settings().database_sync_url, echo=True)
+
+    with Session(engine) as session:
+        reconcile_image_counts(session)
+        reconcile_storage_bytes(session)
+
+    print('category and user image counters, and user storage bytes are recomputed')
+
+
+if __name__ == '__main__':
+    reconcile_counters()
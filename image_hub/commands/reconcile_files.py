@@ -0,0 +1,340 @@
+import argparse
+import heapq
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterator
+
+from sqlmodel import Session, asc, create_engine, delete, select
+from sqlalchemy.sql.operators import in_op
+
+from image_hub.config import get_settings
+from image_hub.database.models import ImageInfo
+from image_hub.image.changes import get_tombstone_insert
+from image_hub.image.counters import reconcile_image_counts, reconcile_storage_bytes
+from image_hub.image.image_file import (
+    get_image_key_prefix,
+    get_original_image_key,
+    get_storage,
+    get_thumbnail_image_key,
+    regenerate_thumbnail_file,
+)
+
+
+FILES_OK = 'ok'
+MISSING_ORIGINAL = 'missing_original'
+MISSING_THUMBNAIL = 'missing_thumbnail'
+
+# image id, and the file name of its row, None for files without a row
+MergedImage = tuple[int, str | None]
+
+
+class Checkpoint:
+    """
+    Progress of a run, saved after every batch so an interrupted run resumes after the last checked id.
+    Orphan candidates are appended to a file next to the checkpoint and checked again at the end.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.orphan_candidates_path = f'{path}.orphans'
+        self.last_id = 0
+        self.stats = dict.fromkeys(
+            ('checked', 'orphans', MISSING_ORIGINAL, MISSING_THUMBNAIL, 'repaired'),
+            0
+        )
+
+        if os.path.exists(path):
+            with open(path) as checkpoint_file:
+                saved = json.load(checkpoint_file)
+
+            self.last_id = saved['last_id']
+            self.stats.update(saved['stats'])
+            print(f'resuming after image id {self.last_id}')
+
+    def save(self):
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(dict(last_id=self.last_id, stats=self.stats), checkpoint_file)
+
+        os.replace(temp_path, self.path)
+
+    def add_orphan_candidates(self, image_ids: list[int]):
+        with open(self.orphan_candidates_path, 'a') as orphans_file:
+            orphans_file.writelines(f'{image_id}\n' for image_id in image_ids)
+
+    def iterate_orphan_candidates(self) -> Iterator[int]:
+        if not os.path.exists(self.orphan_candidates_path):
+            return
+
+        with open(self.orphan_candidates_path) as orphans_file:
+            for line in orphans_file:
+                yield int(line)
+
+    def remove(self):
+        for path in (self.path, self.orphan_candidates_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def chunked(items: Iterator, size: int) -> Iterator[list]:
+    while chunk := list(islice(items, size)):
+        yield chunk
+
+
+def write_run(image_ids: list[int], directory: str) -> str:
+    image_ids.sort()
+    with tempfile.NamedTemporaryFile('w', dir=directory, suffix='.run', delete=False) as run_file:
+        run_file.writelines(f'{image_id}\n' for image_id in image_ids)
+
+    return run_file.name
+
+
+def read_run(path: str) -> Iterator[int]:
+    with open(path) as run_file:
+        for line in run_file:
+            yield int(line)
+
+
+def iterate_stored_image_ids(after_id: int, run_size: int, directory: str) -> Iterator[int]:
+    """
+    Yield the image ids having files in the storage in ascending order, without duplicates.
+
+    The listing comes in directory order, so it is sorted externally: sorted runs of `run_size` ids
+    are written to `directory`, then merged, keeping the memory bounded on a huge tree.
+    """
+    run_paths = []
+    run = []
+    for directory_name in get_storage().iterate_directories():
+        if not directory_name.isdigit() or int(directory_name) <= after_id:
+            continue
+
+        run.append(int(directory_name))
+        if len(run) >= run_size:
+            run_paths.append(write_run(run, directory))
+            run = []
+
+    if run:
+        run_paths.append(write_run(run, directory))
+
+    previous_id = None
+    for image_id in heapq.merge(*(read_run(path) for path in run_paths)):
+        if image_id != previous_id:
+            yield image_id
+            previous_id = image_id
+
+
+def iterate_image_rows(session: Session, after_id: int, batch_size: int) -> Iterator[tuple[int, str]]:
+    last_id = after_id
+    while True:
+        rows = list(
+            session.exec(
+                select(ImageInfo.id, ImageInfo.file_name).where(
+                    ImageInfo.id > last_id
+                ).order_by(
+                    asc(ImageInfo.id)
+                ).limit(batch_size)
+            )
+        )
+        # do not hold a snapshot for the whole walk
+        session.commit()
+        if not rows:
+            return
+
+        yield from rows
+        last_id = rows[-1][0]
+
+
+def merge_image_ids(
+    stored_ids: Iterator[int],
+    image_rows: Iterator[tuple[int, str]]
+) -> Iterator[MergedImage]:
+    stored_id = next(stored_ids, None)
+    row = next(image_rows, None)
+    while stored_id is not None or row is not None:
+        if row is None or (stored_id is not None and stored_id < row[0]):
+            yield stored_id, None
+            stored_id = next(stored_ids, None)
+        elif stored_id is None or row[0] < stored_id:
+            yield row[0], row[1]
+            row = next(image_rows, None)
+        else:
+            yield row[0], row[1]
+            stored_id = next(stored_ids, None)
+            row = next(image_rows, None)
+
+
+def check_image_files(image_id: int, file_name: str) -> str:
+    storage = get_storage()
+    if not storage.exists(get_original_image_key(image_id, file_name)):
+        return MISSING_ORIGINAL
+
+    if not storage.exists(get_thumbnail_image_key(image_id)):
+        return MISSING_THUMBNAIL
+
+    return FILES_OK
+
+
+def repair_thumbnail(image_id: int, file_name: str) -> bool:
+    try:
+        regenerate_thumbnail_file(image_id, file_name)
+    except (OSError, ValueError) as error:
+        print(f'thumbnail of image {image_id} can not be regenerated: {error}')
+        return False
+
+    return True
+
+
+def delete_image_rows(session: Session, image_ids: list[int]):
+    session.exec(get_tombstone_insert(image_ids))
+    session.exec(delete(ImageInfo).where(in_op(ImageInfo.id, image_ids)))
+    session.commit()
+    for image_id in image_ids:
+        get_storage().delete_prefix(get_image_key_prefix(image_id))
+
+
+def check_batch(
+    session: Session,
+    executor: ThreadPoolExecutor,
+    batch: list[MergedImage],
+    checkpoint: Checkpoint,
+    repair: bool
+) -> bool:
+    """
+    Check the images of a batch, repairing them with `repair`. Returns whether image rows were deleted.
+    """
+    stats = checkpoint.stats
+    orphan_ids = [image_id for image_id, file_name in batch if file_name is None]
+    # rows are checked even when their id was not listed, the files may have been stored after the listing
+    checking_images = [(image_id, file_name) for image_id, file_name in batch if file_name is not None]
+    statuses = dict(
+        zip(
+            [image_id for image_id, _ in checking_images],
+            executor.map(lambda image: check_image_files(*image), checking_images)
+        )
+    )
+
+    missing_original_ids = sorted(
+        image_id for image_id, status in statuses.items() if status == MISSING_ORIGINAL
+    )
+    missing_thumbnails = [
+        (image_id, file_name) for image_id, file_name in checking_images
+        if statuses[image_id] == MISSING_THUMBNAIL
+    ]
+
+    stats['checked'] += len(batch)
+    stats[MISSING_ORIGINAL] += len(missing_original_ids)
+    stats[MISSING_THUMBNAIL] += len(missing_thumbnails)
+    for image_id in missing_original_ids:
+        print(f'image {image_id} has no original file')
+
+    for image_id, _ in missing_thumbnails:
+        print(f'image {image_id} has no thumbnail')
+
+    # orphan files may belong to an upload not committed yet, they are decided at the end of the run
+    checkpoint.add_orphan_candidates(orphan_ids)
+
+    if repair:
+        if missing_original_ids:
+            delete_image_rows(session, missing_original_ids)
+            stats['repaired'] += len(missing_original_ids)
+
+        repaired = executor.map(lambda image: repair_thumbnail(*image), missing_thumbnails)
+        stats['repaired'] += sum(repaired)
+
+    checkpoint.last_id = batch[-1][0]
+    checkpoint.save()
+    return repair and bool(missing_original_ids)
+
+
+def check_orphan_candidates(session: Session, checkpoint: Checkpoint, batch_size: int, repair: bool):
+    """
+    Report, or delete with `repair`, the files of the candidate ids that still have no image row.
+    """
+    for candidate_ids in chunked(checkpoint.iterate_orphan_candidates(), batch_size):
+        existing_ids = set(
+            session.exec(select(ImageInfo.id).where(in_op(ImageInfo.id, candidate_ids)))
+        )
+        session.commit()
+
+        for image_id in candidate_ids:
+            if image_id in existing_ids:
+                continue
+
+            checkpoint.stats['orphans'] += 1
+            print(f'files of image {image_id} have no image row')
+            if repair:
+                get_storage().delete_prefix(get_image_key_prefix(image_id))
+                checkpoint.stats['repaired'] += 1
+
+
+def reconcile_files(
+    repair: bool,
+    num_workers: int,
+    batch_size: int,
+    run_size: int,
+    checkpoint_path: str,
+    grace_seconds: float
+):
+    engine = create_engine(get_settings().database_sync_url)
+    checkpoint = Checkpoint(checkpoint_path)
+    started_at = time.monotonic()
+    rows_deleted = False
+
+    with (
+        tempfile.TemporaryDirectory() as run_directory,
+        Session(engine) as session,
+        ThreadPoolExecutor(num_workers) as executor,
+    ):
+        merged_images = merge_image_ids(
+            iterate_stored_image_ids(checkpoint.last_id, run_size, run_directory),
+            iterate_image_rows(session, checkpoint.last_id, batch_size)
+        )
+        for batch in chunked(merged_images, batch_size):
+            rows_deleted |= check_batch(session, executor, batch, checkpoint, repair)
+            print(f'{checkpoint.stats["checked"]} images are checked, last image id {checkpoint.last_id}')
+
+        # give the uploads in flight when their files were listed time to commit
+        remaining_seconds = grace_seconds - (time.monotonic() - started_at)
+        if remaining_seconds > 0:
+            time.sleep(remaining_seconds)
+
+        check_orphan_candidates(session, checkpoint, batch_size, repair)
+        if rows_deleted:
+            reconcile_image_counts(session)
+            reconcile_storage_bytes(session)
+
+    print(json.dumps(checkpoint.stats))
+    checkpoint.remove()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repair', action='store_true', help='fix the inconsistencies instead of only reporting them')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of threads checking files')
+    parser.add_argument('--batch-size', type=int, default=1000, help='number of images per DB batch')
+    parser.add_argument('--run-size', type=int, default=1_000_000, help='number of ids per external sort run')
+    parser.add_argument('--checkpoint', default='reconcile_files.checkpoint.json', help='path of the checkpoint file')
+    parser.add_argument(
+        '--grace-seconds',
+        type=float,
+        default=60,
+        help='minimum age of the listing before files without an image row are considered orphans'
+    )
+
+    args = parser.parse_args()
+    reconcile_files(
+        args.repair,
+        args.workers,
+        args.batch_size,
+        args.run_size,
+        args.checkpoint,
+        args.grace_seconds
+    )
+
+
+if __name__ == '__main__':
+    main()
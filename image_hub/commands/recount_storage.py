@@ -0,0 +1,71 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlmodel import Session, asc, create_engine, select, update
+
+from image_hub.config import get_settings
+from image_hub.database.models import ImageInfo
+from image_hub.image.counters import reconcile_storage_bytes
+from image_hub.image.image_file import get_original_image_key, get_storage, get_thumbnail_image_key
+
+
+def get_stored_size(key: str) -> int | None:
+    try:
+        return get_storage().size(key)
+    except FileNotFoundError:
+        return None
+
+
+def get_image_file_sizes(image_id: int, file_name: str) -> dict:
+    return dict(
+        id=image_id,
+        byte_size=get_stored_size(get_original_image_key(image_id, file_name)),
+        thumbnail_byte_size=get_stored_size(get_thumbnail_image_key(image_id)),
+    )
+
+
+def recount_storage(num_workers: int, batch_size: int):
+    engine = create_engine(get_settings().database_sync_url)
+
+    last_id = 0
+    num_images = 0
+    with Session(engine) as session, ThreadPoolExecutor(num_workers) as executor:
+        while True:
+            result = session.exec(
+                select(ImageInfo.id, ImageInfo.file_name).where(
+                    ImageInfo.id > last_id
+                ).order_by(
+                    asc(ImageInfo.id)
+                ).limit(batch_size)
+            )
+            rows = list(result)
+            if not rows:
+                break
+
+            image_ids = [image_id for image_id, _ in rows]
+            file_names = [file_name for _, file_name in rows]
+            parameters = list(executor.map(get_image_file_sizes, image_ids, file_names))
+            session.exec(update(ImageInfo), params=parameters)
+            session.commit()
+
+            num_images += len(rows)
+            last_id = image_ids[-1]
+            print(f'file sizes of {num_images} images are recounted, last image id {last_id}')
+
+        reconcile_storage_bytes(session)
+
+    print('storage bytes of the users are recomputed')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of threads reading file sizes')
+    parser.add_argument('--batch-size', type=int, default=1000, help='number of images per DB batch')
+
+    args = parser.parse_args()
+    recount_storage(args.workers, args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+from sqlmodel import Session, asc, create_engine, select, update
+
+from image_hub.config import get_settings
+from image_hub.database.models import ImageInfo
+from image_hub.image.counters import reconcile_storage_bytes
+from image_hub.image.image_file import regenerate_thumbnail_file
+
+
+class Checkpoint:
+    """
+    Last image id whose thumbnail is regenerated, saved after every batch so an interrupted run resumes after it.
+    A checkpoint of a run with other thumbnail settings is ignored, every thumbnail is regenerated again.
+    """
+
+    def __init__(self, path: str, thumbnail_settings: dict):
+        self.path = path
+        self.thumbnail_settings = thumbnail_settings
+        self.last_id = 0
+        self.stats = dict(regenerated=0, failed=0)
+
+        if not os.path.exists(path):
+            return
+
+        with open(path) as checkpoint_file:
+            saved = json.load(checkpoint_file)
+
+        if saved['thumbnail_settings'] != thumbnail_settings:
+            print(f'thumbnail settings changed since the checkpoint {saved["thumbnail_settings"]}, starting over')
+            return
+
+        self.last_id = saved['last_id']
+        self.stats.update(saved['stats'])
+        print(f'resuming after image id {self.last_id}')
+
+    def save(self):
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(
+                dict(last_id=self.last_id, stats=self.stats, thumbnail_settings=self.thumbnail_settings),
+                checkpoint_file
+            )
+
+        os.replace(temp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Throttle:
+    """
+    Spread the work over time so that it does not exceed `rate` units per second, without a limit when None.
+    """
+
+    def __init__(self, rate: float | None):
+        self.rate = rate
+        self.next_time = time.monotonic()
+
+    def wait(self, amount: float):
+        if not self.rate:
+            return
+
+        now = time.monotonic()
+        if self.next_time > now:
+            time.sleep(self.next_time - now)
+
+        self.next_time = max(self.next_time, now) + amount / self.rate
+
+
+def get_thumbnail_settings() -> dict:
+    settings = get_settings()
+    return dict(thumbnail_size=settings.thumbnail_size, thumbnail_quality=settings.thumbnail_quality)
+
+
+def iterate_image_batches(
+    session: Session,
+    after_id: int,
+    batch_size: int
+) -> Iterator[list[tuple[int, str, int | None]]]:
+    last_id = after_id
+    while True:
+        rows = list(
+            session.exec(
+                select(ImageInfo.id, ImageInfo.file_name, ImageInfo.byte_size).where(
+                    ImageInfo.id > last_id
+                ).order_by(
+                    asc(ImageInfo.id)
+                ).limit(batch_size)
+            )
+        )
+        # do not hold a snapshot for the whole run
+        session.commit()
+        if not rows:
+            return
+
+        yield rows
+        last_id = rows[-1][0]
+
+
+def regenerate_thumbnail(image_id: int, file_name: str) -> int | None:
+    try:
+        return regenerate_thumbnail_file(image_id, file_name)
+    except (OSError, ValueError) as error:
+        print(f'thumbnail of image {image_id} can not be regenerated: {error}')
+        return None
+
+
+def regenerate_thumbnails(
+    num_workers: int,
+    batch_size: int,
+    checkpoint_path: str,
+    max_images_per_second: float | None,
+    max_read_mb_per_second: float | None,
+    nice: int
+):
+    engine = create_engine(get_settings().database_sync_url)
+    checkpoint = Checkpoint(checkpoint_path, get_thumbnail_settings())
+    image_throttle = Throttle(max_images_per_second)
+    read_throttle = Throttle(max_read_mb_per_second * 1024 * 1024 if max_read_mb_per_second else None)
+
+    with (
+        Session(engine) as session,
+        # lower priority workers leave the CPU, and the disk on schedulers honoring it, to the live traffic
+        ProcessPoolExecutor(num_workers, initializer=os.nice, initargs=(nice,)) as executor,
+    ):
+        for rows in iterate_image_batches(session, checkpoint.last_id, batch_size):
+            futures = []
+            for image_id, file_name, byte_size in rows:
+                image_throttle.wait(1)
+                read_throttle.wait(byte_size or 0)
+                futures.append(executor.submit(regenerate_thumbnail, image_id, file_name))
+
+            parameters = []
+            for (image_id, _, _), future in zip(rows, futures):
+                thumbnail_byte_size = future.result()
+                if thumbnail_byte_size is not None:
+                    parameters.append(dict(id=image_id, thumbnail_byte_size=thumbnail_byte_size))
+
+            if parameters:
+                session.exec(update(ImageInfo), params=parameters)
+                session.commit()
+
+            checkpoint.stats['regenerated'] += len(parameters)
+            checkpoint.stats['failed'] += len(rows) - len(parameters)
+            checkpoint.last_id = rows[-1][0]
+            checkpoint.save()
+            print(f'{checkpoint.stats["regenerated"]} thumbnails are regenerated, last image id {checkpoint.last_id}')
+
+        # thumbnail sizes changed, the storage usage of the users follows
+        reconcile_storage_bytes(session)
+
+    print(json.dumps(checkpoint.stats))
+    checkpoint.remove()
+    print(
+        f'cached thumbnails and sprites of the old thumbnails expire '
+        f'within {get_settings().thumbnail_cache_ttl_seconds} seconds'
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='number of processes')
+    parser.add_argument('--batch-size', type=int, default=500, help='number of images per DB batch')
+    parser.add_argument(
+        '--checkpoint',
+        default='regenerate_thumbnails.checkpoint.json',
+        help='path of the checkpoint file'
+    )
+    parser.add_argument('--max-images-per-second', type=float, default=None, help='limit of images processed per second')
+    parser.add_argument(
+        '--max-read-mb-per-second',
+        type=float,
+        default=None,
+        help='limit of original file bytes read per second'
+    )
+    parser.add_argument('--nice', type=int, default=10, help='niceness added to the worker processes')
+
+    args = parser.parse_args()
+    regenerate_thumbnails(
+        args.workers,
+        args.batch_size,
+        args.checkpoint,
+        args.max_images_per_second,
+        args.max_read_mb_per_second,
+        args.nice
+    )
+
+
+if __name__ == '__main__':
+    main()
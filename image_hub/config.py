@@ -7,11 +7,55 @@ class Settings(BaseSettings):
 
     database_url: str
     database_sync_url: str
+    database_read_url: str | None = None
+    database_read_retry_seconds: float = 30
+    read_your_writes_seconds: float = 5
     auth_secret_key: str
     image_path: str
     max_num_categories_per_image: int = 5
     image_file_size_limit_mb: int = 16
+    image_max_pixels: int = 64_000_000
+    image_decode_workers: int = 4
+    image_decode_memory_limit_mb: int = 1024
+    resumable_upload_size_limit_mb: int = 256
+    user_storage_quota_mb: int | None = None
+    upload_session_ttl_seconds: float = 24 * 60 * 60
+    upload_session_cleanup_interval_seconds: float = 10 * 60
+    image_delete_retention_seconds: float = 7 * 24 * 60 * 60
+    image_purge_interval_seconds: float = 60
+    image_purge_batch_size: int = 100
+    image_purge_max_requests_in_flight: int = 4
     thumbnail_size: int = 128
+    thumbnail_quality: int = 85
+    thumbnail_cache_size_mb: int = 64
+    thumbnail_cache_ttl_seconds: float = 300
+    sprite_max_images: int = 256
+    sprite_cache_size_mb: int = 64
+    thumbnail_batch_max_images: int = 256
+    thumbnail_batch_concurrency: int = 16
+    upload_max_concurrency: int = 4
+    upload_max_queue: int = 32
+    upload_max_wait_seconds: float = 10
+    auth_max_concurrency: int = 4
+    auth_max_queue: int = 64
+    auth_max_wait_seconds: float = 5
+    response_compression_min_bytes: int = 4096
+    similarity_max_distance: int = 12
+    similarity_max_candidates: int = 10000
+    similarity_index_refresh_seconds: float = 30
+    category_index_refresh_seconds: float = 30
+    category_autocomplete_max_size: int = 50
+    storage_backend: str = 'filesystem'
+    packed_small_file_limit_kb: int = 256
+    packed_max_pack_size_mb: int = 1024
+    packed_compaction_dead_ratio: float = 0.5
+    packed_compaction_interval_seconds: float = 3600
+    serve_workers: int | None = None
+    shutdown_grace_seconds: float = 30
+    profile_directory: str | None = None
+    profile_sample_rate: float = 0
+    profile_top_n: int = 30
+    slow_query_threshold_ms: float | None = None
 
 
 @lru_cache
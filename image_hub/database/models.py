@@ -6,6 +6,10 @@ from sqlmodel import Field, SQLModel, Relationship
 from image_hub.utils import time_now
 
 
+# id of the transaction writing a row, the sort key of the change feed, see image_hub/image/changes.py
+CURRENT_TRANSACTION_ID = sa.literal_column('pg_current_xact_id()::text::bigint')
+
+
 class User(SQLModel, table=True):
     id: int | None = Field(default=None, primary_key=True)
     user_name: str = Field(index=True, max_length=31, unique=True)
@@ -13,6 +17,27 @@ class User(SQLModel, table=True):
     is_admin: bool = Field(default=False)
 
 
+class UserStats(SQLModel, table=True):
+    __tablename__ = 'user_stats'
+    __table_args__ = (
+        # top storage consumers, see the admin storage endpoint
+        sa.Index('ix_user_stats_storage_bytes', 'storage_bytes'),
+    )
+
+    user_id: int = Field(foreign_key='user.id', primary_key=True, ondelete='CASCADE')
+    image_count: int = Field(default=0, sa_column_kwargs=dict(server_default='0'))
+    # bytes of the originals and the derived files of the images of the user
+    storage_bytes: int = Field(default=0, sa_type=sa.BigInteger, sa_column_kwargs=dict(server_default='0'))
+
+
+class UserLastWrite(SQLModel, table=True):
+    __tablename__ = 'user_last_write'
+
+    # time of the last write of the user on the primary, read by every worker, see image_hub/database/session.py
+    user_id: int = Field(foreign_key='user.id', primary_key=True, ondelete='CASCADE')
+    written_at: datetime = Field(sa_column=sa.Column(sa.DateTime(timezone=True), nullable=False))
+
+
 class ImageCategoryMapping(SQLModel, table=True):
     __tablename__ = 'image_category_mapping'
 
@@ -25,6 +50,7 @@ class ImageCategory(SQLModel, table=True):
 
     id: int | None = Field(default=None, primary_key=True)
     name: str = Field(unique=True, max_length=63)
+    image_count: int = Field(default=0, sa_column_kwargs=dict(server_default='0'))
     created_at: datetime = Field(
         sa_column=sa.Column(
             sa.DateTime(timezone=True),
@@ -41,6 +67,44 @@ class ImageCategory(SQLModel, table=True):
 
 class ImageInfo(SQLModel, table=True):
     __tablename__ = 'image_info'
+    __table_args__ = (
+        # keyset pagination of the image listings, see image_hub/image/query.py,
+        # deleted images waiting for the purge are left out of the listing indexes
+        sa.Index(
+            'ix_image_info_uploader_id_id',
+            'uploader_id',
+            'id',
+            postgresql_where=sa.text('deleted_at IS NULL')
+        ),
+        sa.Index(
+            'ix_image_info_uploader_admin_id_id',
+            'uploader_admin_id',
+            'id',
+            postgresql_where=sa.text('deleted_at IS NULL')
+        ),
+        sa.Index(
+            'ix_image_info_user_uploaded_id',
+            'id',
+            postgresql_where=sa.text('uploader_admin_id IS NULL AND deleted_at IS NULL')
+        ),
+        # oldest deleted images first, see image_hub/image/deletion.py
+        sa.Index(
+            'ix_image_info_deleted_at',
+            'deleted_at',
+            postgresql_where=sa.text('deleted_at IS NOT NULL')
+        ),
+        # change feed, deleted images included, see image_hub/image/changes.py
+        sa.Index('ix_image_info_uploader_id_change_xid', 'uploader_id', 'change_xid', 'id'),
+        sa.Index('ix_image_info_uploader_admin_id_change_xid', 'uploader_admin_id', 'change_xid', 'id'),
+        sa.Index(
+            'ix_image_info_user_uploaded_change_xid',
+            'change_xid',
+            'id',
+            postgresql_where=sa.text('uploader_admin_id IS NULL')
+        ),
+        # changes of every image, see image_hub/image/similarity.py
+        sa.Index('ix_image_info_change_xid', 'change_xid', 'id'),
+    )
     id: int | None = Field(default=None, primary_key=True)
     file_name: str = Field(index=True, max_length=511)
     created_at: datetime = Field(
@@ -61,8 +125,87 @@ class ImageInfo(SQLModel, table=True):
     description: str | None = Field(max_length=511, nullable=True)
     uploader_id: int | None = Field(foreign_key='user.id', nullable=True)
     uploader_admin_id: int | None = Field(foreign_key='user.id', nullable=True)
+    # 64 bit dHash stored as a signed BIGINT, see image_hub/image/perceptual_hash.py
+    perceptual_hash: int | None = Field(default=None, sa_type=sa.BigInteger, nullable=True)
+    # read from the original at upload, so the file does not need to be opened again
+    width: int | None = Field(default=None, nullable=True)
+    height: int | None = Field(default=None, nullable=True)
+    image_format: str | None = Field(default=None, max_length=15, nullable=True)
+    mime_type: str | None = Field(default=None, max_length=63, nullable=True)
+    byte_size: int | None = Field(default=None, sa_type=sa.BigInteger, nullable=True)
+    thumbnail_byte_size: int | None = Field(default=None, sa_type=sa.BigInteger, nullable=True)
+    taken_at: datetime | None = Field(
+        default=None,
+        sa_type=sa.DateTime(timezone=True),
+        nullable=True
+    )
+    # set by a delete, the row and the files are kept for the undo window then purged
+    deleted_at: datetime | None = Field(
+        default=None,
+        sa_type=sa.DateTime(timezone=True),
+        nullable=True
+    )
+    # transaction of the last change of the row
+    change_xid: int = Field(
+        sa_column=sa.Column(
+            sa.BigInteger,
+            nullable=False,
+            default=CURRENT_TRANSACTION_ID,
+            onupdate=CURRENT_TRANSACTION_ID
+        )
+    )
 
     categories: list['ImageCategory'] = Relationship(
         back_populates='images',
         link_model=ImageCategoryMapping
     )
+
+
+class ImageTombstone(SQLModel, table=True):
+    """
+    Purged image, kept so the change feed can still report its delete.
+    """
+    __tablename__ = 'image_tombstone'
+    __table_args__ = (
+        sa.Index('ix_image_tombstone_uploader_id_change_xid', 'uploader_id', 'change_xid', 'image_id'),
+        sa.Index('ix_image_tombstone_uploader_admin_id_change_xid', 'uploader_admin_id', 'change_xid', 'image_id'),
+        sa.Index(
+            'ix_image_tombstone_user_uploaded_change_xid',
+            'change_xid',
+            'image_id',
+            postgresql_where=sa.text('uploader_admin_id IS NULL')
+        ),
+    )
+
+    image_id: int = Field(primary_key=True, sa_column_kwargs=dict(autoincrement=False))
+    uploader_id: int | None = Field(default=None, nullable=True)
+    uploader_admin_id: int | None = Field(default=None, nullable=True)
+    # transaction of the delete
+    change_xid: int = Field(sa_type=sa.BigInteger)
+
+
+class UploadSession(SQLModel, table=True):
+    __tablename__ = 'upload_session'
+
+    id: str = Field(primary_key=True, max_length=32)
+    user_id: int = Field(foreign_key='user.id', index=True, ondelete='CASCADE')
+    file_name: str = Field(max_length=511)
+    description: str | None = Field(max_length=511, nullable=True)
+    category_ids: list[int] = Field(default_factory=list, sa_type=sa.ARRAY(sa.Integer))
+    size: int = Field(sa_type=sa.BigInteger)
+    # bytes appended to the upload file so far, the offset of the next chunk
+    received_size: int = Field(default=0, sa_type=sa.BigInteger)
+    created_at: datetime = Field(
+        sa_column=sa.Column(
+            sa.DateTime(timezone=True),
+            nullable=False,
+            default=time_now
+        )
+    )
+    expires_at: datetime = Field(
+        sa_column=sa.Column(
+            sa.DateTime(timezone=True),
+            nullable=False,
+            index=True
+        )
+    )
@@ -1,18 +1,132 @@
+import logging
+import time
+from datetime import timedelta
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from sqlmodel import func, select
 from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
 
 from image_hub.config import get_settings
+from image_hub.database.models import UserLastWrite
+from image_hub.database.slow_query import install_slow_query_log
+
+
+logger = logging.getLogger(__name__)
+
+_read_engine_unavailable_until = 0.0
+
+
+def create_engine(database_url: str, **kwargs) -> AsyncEngine:
+    engine = create_async_engine(database_url, echo=True, future=True, **kwargs)
+    slow_query_threshold_ms = get_settings().slow_query_threshold_ms
+    if slow_query_threshold_ms is not None:
+        install_slow_query_log(engine.sync_engine, slow_query_threshold_ms)
+
+    return engine
 
 
 def get_engine() -> AsyncEngine:
     if not hasattr(get_engine, 'engine'):
-        get_engine.engine = create_async_engine(get_settings().database_url, echo=True, future=True)
+        get_engine.engine = create_engine(get_settings().database_url)
 
     return get_engine.engine
 
 
+def get_read_engine() -> AsyncEngine | None:
+    if not hasattr(get_read_engine, 'engine'):
+        database_read_url = get_settings().database_read_url
+        if database_read_url:
+            get_read_engine.engine = create_engine(database_read_url, pool_pre_ping=True)
+        else:
+            get_read_engine.engine = None
+
+    return get_read_engine.engine
+
+
+async def dispose_engines():
+    await get_engine().dispose()
+    read_engine = get_read_engine()
+    if read_engine is not None:
+        await read_engine.dispose()
+
 
 async def get_session() -> AsyncSession:
     engine = get_engine()
     async with AsyncSession(engine) as session:
         yield session
+
+
+async def mark_user_write(user_id: int):
+    """
+    Route the reads of the user to the primary for the `read_your_writes_seconds` setting,
+    so the user does not miss their own write on a lagging replica.
+
+    The time is recorded on the primary, so every worker and server routes the next requests of the user,
+    from any client, the same way. Nothing is recorded without a replica, every read goes to the primary then.
+    """
+    if get_read_engine() is None:
+        return
+
+    now = func.clock_timestamp()
+    async with AsyncSession(get_engine()) as session:
+        await session.exec(
+            insert(UserLastWrite).values(user_id=user_id, written_at=now).on_conflict_do_update(
+                index_elements=[UserLastWrite.user_id],
+                set_=dict(written_at=now)
+            )
+        )
+        await session.commit()
+
+
+async def is_in_read_your_writes_window(user_id: int) -> bool:
+    """
+    Whether the user wrote within the `read_your_writes_seconds` setting, a primary key lookup on the primary.
+    """
+    window = timedelta(seconds=get_settings().read_your_writes_seconds)
+    async with AsyncSession(get_engine()) as session:
+        result = await session.exec(
+            select(UserLastWrite.written_at > func.now() - window).where(
+                UserLastWrite.user_id == user_id
+            )
+        )
+        return bool(result.first())
+
+
+@asynccontextmanager
+async def open_read_session(user_id: int | None = None) -> AsyncIterator[AsyncSession]:
+    """
+    Open a session for read only queries on the read replica.
+
+    Falls back to the primary when no replica is configured, when the user wrote recently,
+    or when the replica can not be connected. After a failed connection the replica is skipped
+    for the `database_read_retry_seconds` setting.
+    """
+    global _read_engine_unavailable_until
+
+    read_engine = get_read_engine()
+    use_replica = (
+        read_engine is not None
+        and time.monotonic() >= _read_engine_unavailable_until
+    )
+    if use_replica and user_id is not None:
+        use_replica = not await is_in_read_your_writes_window(user_id)
+
+    if use_replica:
+        async with AsyncSession(read_engine) as session:
+            try:
+                await session.connection()
+            except (DBAPIError, OSError, TimeoutError) as error:
+                logger.warning('read replica is unavailable, falling back to the primary: %s', error)
+                _read_engine_unavailable_until = (
+                    time.monotonic() + get_settings().database_read_retry_seconds
+                )
+            else:
+                yield session
+                return
+
+    async with AsyncSession(get_engine()) as session:
+        yield session
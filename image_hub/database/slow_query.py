@@ -0,0 +1,65 @@
+import logging
+import time
+from typing import Any
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from image_hub.profiling import get_current_route
+
+
+logger = logging.getLogger(__name__)
+
+QUERY_STARTED_AT_KEY = 'query_started_at'
+MAX_LOGGED_STATEMENT_LENGTH = 2000
+
+
+def get_parameters_shape(parameters: Any, executemany: bool) -> str:
+    """
+    Describe the parameters of a statement by their names and types only,
+    so the log shows how a query was called without leaking the values.
+    """
+    if executemany:
+        parameters = list(parameters)
+        first = get_parameters_shape(parameters[0], False) if parameters else '()'
+        return f'{len(parameters)} x {first}'
+
+    if isinstance(parameters, dict):
+        return '{' + ', '.join(f'{key}: {type(value).__name__}' for key, value in parameters.items()) + '}'
+
+    if parameters is None:
+        return '()'
+
+    return '(' + ', '.join(type(value).__name__ for value in parameters) + ')'
+
+
+def install_slow_query_log(engine: Engine, threshold_ms: float):
+    """
+    Log the statements of `engine` taking at least `threshold_ms`,
+    with the shape of their parameters and the route that ran them.
+    """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault(QUERY_STARTED_AT_KEY, []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info[QUERY_STARTED_AT_KEY].pop()) * 1000
+        if elapsed_ms < threshold_ms:
+            return
+
+        logger.warning(
+            'slow query took %.1fms in %s, parameters %s: %s',
+            elapsed_ms,
+            get_current_route() or 'a background task',
+            get_parameters_shape(parameters, executemany),
+            statement[:MAX_LOGGED_STATEMENT_LENGTH]
+        )
+
+    @event.listens_for(engine, 'handle_error')
+    def handle_error(exception_context):
+        # a failed statement never reaches `after_cursor_execute`
+        connection = exception_context.connection
+        if connection is not None and connection.info.get(QUERY_STARTED_AT_KEY):
+            connection.info[QUERY_STARTED_AT_KEY].pop()
@@ -0,0 +1,11 @@
+from pydantic import BaseModel
+
+
+class AdmissionMetricsDto(BaseModel):
+    name: str
+    max_concurrency: int
+    in_flight: int
+    max_queue: int
+    waiting: int
+    admitted: int
+    rejected: int
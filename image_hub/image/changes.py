@@ -0,0 +1,172 @@
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql.operators import in_op, is_
+from sqlmodel import asc, select, tuple_, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from image_hub.auth.dto import UserAuthDto
+from image_hub.database.models import (
+    CURRENT_TRANSACTION_ID,
+    ImageCategory,
+    ImageCategoryMapping,
+    ImageInfo,
+    ImageTombstone
+)
+from image_hub.image.cursor import encode_cursor
+from image_hub.image.query import decode_next_key, get_category_ids_column, get_image_list_columns, get_image_list_item
+
+
+CHANGES_CURSOR_KIND = 'image_changes'
+
+# transactions older than the oldest one still running have all ended, so no row written by them can appear later
+FINISHED_TRANSACTION_HORIZON = sa.literal_column('pg_snapshot_xmin(pg_current_snapshot())::text::bigint')
+
+
+async def touch_images(session: AsyncSession, image_ids: list[int] | set[int]):
+    """
+    Record a change of the images not made on their row, e.g. to their categories, for the change feed.
+    """
+    if not image_ids:
+        return
+
+    await session.exec(
+        update(ImageInfo).where(
+            in_op(ImageInfo.id, list(image_ids))
+        ).values(
+            change_xid=CURRENT_TRANSACTION_ID
+        ).execution_options(synchronize_session=False)
+    )
+
+
+async def touch_category_images(session: AsyncSession, category_condition):
+    """
+    Record a change of the images of the categories matching `category_condition`, before the categories are deleted
+    and their mappings with them, in the same transaction.
+    """
+    result = await session.exec(
+        select(ImageCategoryMapping.image_info_id).join(
+            ImageCategory,
+            ImageCategory.id == ImageCategoryMapping.category_id
+        ).where(
+            category_condition
+        ).with_for_update(
+            # the lock held until the deletion keeps other transactions from mapping more images to the categories
+            of=ImageCategory
+        )
+    )
+    await touch_images(session, result.all())
+
+
+def get_tombstone_insert(image_ids: list[int], change_xid=CURRENT_TRANSACTION_ID):
+    """
+    INSERT of the tombstones of images about to be removed, keeping their deletion in the change feed.
+    An image soft deleted before passes its `ImageInfo.change_xid`, so its change keeps its place in the feed.
+    """
+    return insert(ImageTombstone).from_select(
+        ['image_id', 'uploader_id', 'uploader_admin_id', 'change_xid'],
+        select(
+            ImageInfo.id,
+            ImageInfo.uploader_id,
+            ImageInfo.uploader_admin_id,
+            change_xid
+        ).where(
+            in_op(ImageInfo.id, image_ids)
+        )
+    )
+
+
+def get_owner_conditions(user_auth: UserAuthDto, model) -> list:
+    """
+    One condition per index range of the images of the user, admins see their own images and those of normal users.
+    """
+    if user_auth.is_admin:
+        return [
+            model.uploader_admin_id == user_auth.user_id,
+            is_(model.uploader_admin_id, None)
+        ]
+
+    return [model.uploader_id == user_auth.user_id]
+
+
+def get_changed_image_query(owner_condition, size: int, after: tuple[int, int] | None):
+    query = select(
+        ImageInfo.change_xid,
+        ImageInfo.deleted_at,
+        *get_image_list_columns(),
+        get_category_ids_column()
+    ).where(
+        owner_condition,
+        ImageInfo.change_xid < FINISHED_TRANSACTION_HORIZON
+    )
+    if after is not None:
+        query = query.where(tuple_(ImageInfo.change_xid, ImageInfo.id) > after)
+
+    return query.order_by(asc(ImageInfo.change_xid), asc(ImageInfo.id)).limit(size)
+
+
+def get_tombstone_query(owner_condition, size: int, after: tuple[int, int] | None):
+    query = select(ImageTombstone.change_xid, ImageTombstone.image_id).where(
+        owner_condition,
+        ImageTombstone.change_xid < FINISHED_TRANSACTION_HORIZON
+    )
+    if after is not None:
+        query = query.where(tuple_(ImageTombstone.change_xid, ImageTombstone.image_id) > after)
+
+    return query.order_by(asc(ImageTombstone.change_xid), asc(ImageTombstone.image_id)).limit(size)
+
+
+def get_change_item(image_row) -> dict:
+    if image_row.deleted_at is not None:
+        return dict(id=image_row.id, deleted=True, image=None, category_ids=[])
+
+    return dict(
+        id=image_row.id,
+        deleted=False,
+        image=get_image_list_item(image_row),
+        category_ids=image_row.category_ids or []
+    )
+
+
+async def get_image_changes(
+    session: AsyncSession,
+    user_auth: UserAuthDto,
+    size: int,
+    next_key: str | None = None
+) -> dict:
+    """
+    Return the images of the user changed since `next_key`, oldest change first, and the key of the next call.
+
+    Created and updated images come with their current fields, deleted images, soft deleted or purged,
+    as tombstones. An image appears once, at its last change. Changes are ordered by the id of the transaction
+    making them, and only the changes of finished transactions older than every running one are returned,
+    so a change committed later can never sort before a returned key. Every range is read through its own index,
+    the cost follows the number of changes, not the number of images.
+
+    A transaction that holds a transaction id, i.e. has written, keeps the horizon, and the feed of every user,
+    from moving past it until it ends. Writes are kept in short transactions for this,
+    a long one, e.g. a backfill command not committing per batch, delays the changes made meanwhile.
+    """
+    after = decode_next_key(next_key, CHANGES_CURSOR_KIND, 2) if next_key else None
+
+    changes = []
+    for owner_condition in get_owner_conditions(user_auth, ImageInfo):
+        result = await session.exec(get_changed_image_query(owner_condition, size, after))
+        changes.extend(((row.change_xid, row.id), get_change_item(row)) for row in result)
+
+    for owner_condition in get_owner_conditions(user_auth, ImageTombstone):
+        result = await session.exec(get_tombstone_query(owner_condition, size, after))
+        changes.extend(
+            ((change_xid, image_id), dict(id=image_id, deleted=True, image=None, category_ids=[]))
+            for change_xid, image_id in result
+        )
+
+    changes.sort(key=lambda change: change[0])
+    changes = changes[:size]
+    if changes:
+        next_key = encode_cursor(CHANGES_CURSOR_KIND, changes[-1][0])
+
+    return dict(
+        changes=[item for _, item in changes],
+        next_key=next_key,
+        has_more=len(changes) == size
+    )
@@ -0,0 +1,153 @@
+from fastapi import HTTPException
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql.operators import in_op, is_
+from sqlmodel import Session, func, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from image_hub.auth.dto import UserAuthDto
+from image_hub.config import get_settings
+from image_hub.database.models import ImageCategory, ImageCategoryMapping, ImageInfo, UserStats
+
+
+async def add_user_stats(
+    session: AsyncSession,
+    user_id: int,
+    image_count_delta: int,
+    storage_bytes_delta: int
+):
+    statement = insert(UserStats).values(
+        user_id=user_id,
+        image_count=max(image_count_delta, 0),
+        storage_bytes=max(storage_bytes_delta, 0)
+    )
+    await session.exec(
+        statement.on_conflict_do_update(
+            index_elements=[UserStats.user_id],
+            set_=dict(
+                image_count=UserStats.image_count + image_count_delta,
+                storage_bytes=UserStats.storage_bytes + storage_bytes_delta
+            )
+        )
+    )
+
+
+async def check_storage_quota(session: AsyncSession, user_auth: UserAuthDto, incoming_bytes: int):
+    """
+    Raise 413 when storing `incoming_bytes` more would exceed the `user_storage_quota_mb` setting.
+    The stats row of the user stays locked until the transaction ends,
+    so concurrent uploads of a user can not pass the check together.
+    """
+    quota_mb = get_settings().user_storage_quota_mb
+    if quota_mb is None or user_auth.is_admin:
+        return
+
+    # the first uploads of a user have no row to lock yet, create it so they can not pass the check together
+    await session.exec(
+        insert(UserStats).values(user_id=user_auth.user_id).on_conflict_do_nothing(
+            index_elements=[UserStats.user_id]
+        )
+    )
+    result = await session.exec(
+        select(UserStats.storage_bytes).where(
+            UserStats.user_id == user_auth.user_id
+        ).with_for_update()
+    )
+    storage_bytes = result.one()
+    if storage_bytes + incoming_bytes > quota_mb * 1024 * 1024:
+        raise HTTPException(
+            status_code=413,
+            detail=f'Image exceeds the storage quota of {quota_mb}MB, {storage_bytes} bytes are used'
+        )
+
+
+def get_image_storage_bytes(byte_size: int | None, thumbnail_byte_size: int | None) -> int:
+    return (byte_size or 0) + (thumbnail_byte_size or 0)
+
+
+async def add_category_image_counts(
+    session: AsyncSession,
+    category_ids: list[int] | set[int],
+    delta: int
+):
+    if not category_ids or not delta:
+        return
+
+    await session.exec(
+        update(ImageCategory).where(
+            in_op(ImageCategory.id, list(category_ids))
+        ).values(
+            image_count=ImageCategory.image_count + delta
+        )
+    )
+
+
+def reconcile_image_counts(session: Session):
+    """
+    Recompute every category and user image counter from the mapping and image tables,
+    leaving out the deleted images.
+    """
+    category_counts = select(
+        ImageCategoryMapping.category_id,
+        func.count().label('image_count')
+    ).join(
+        ImageInfo,
+        ImageInfo.id == ImageCategoryMapping.image_info_id
+    ).where(
+        is_(ImageInfo.deleted_at, None)
+    ).group_by(
+        ImageCategoryMapping.category_id
+    ).subquery()
+
+    session.exec(
+        update(ImageCategory).values(
+            image_count=func.coalesce(
+                select(category_counts.c.image_count).where(
+                    category_counts.c.category_id == ImageCategory.id
+                ).scalar_subquery(),
+                0
+            )
+        )
+    )
+
+    owner_id = func.coalesce(ImageInfo.uploader_id, ImageInfo.uploader_admin_id)
+    user_counts = select(
+        owner_id.label('user_id'),
+        func.count().label('image_count')
+    ).where(
+        is_(ImageInfo.deleted_at, None)
+    ).group_by(owner_id)
+
+    session.exec(update(UserStats).values(image_count=0))
+    statement = insert(UserStats).from_select(['user_id', 'image_count'], user_counts)
+    session.exec(
+        statement.on_conflict_do_update(
+            index_elements=[UserStats.user_id],
+            set_=dict(image_count=statement.excluded.image_count)
+        )
+    )
+    session.commit()
+
+
+def reconcile_storage_bytes(session: Session):
+    """
+    Recompute the storage bytes of every user from the byte sizes recorded on the live image rows.
+    """
+    owner_id = func.coalesce(ImageInfo.uploader_id, ImageInfo.uploader_admin_id)
+    user_bytes = select(
+        owner_id.label('user_id'),
+        func.sum(
+            func.coalesce(ImageInfo.byte_size, 0) + func.coalesce(ImageInfo.thumbnail_byte_size, 0)
+        ).label('storage_bytes')
+    ).where(
+        is_(ImageInfo.deleted_at, None)
+    ).group_by(owner_id)
+
+    session.exec(update(UserStats).values(storage_bytes=0))
+    statement = insert(UserStats).from_select(['user_id', 'storage_bytes'], user_bytes)
+    session.exec(
+        statement.on_conflict_do_update(
+            index_elements=[UserStats.user_id],
+            set_=dict(storage_bytes=statement.excluded.storage_bytes)
+        )
+    )
+    session.commit()
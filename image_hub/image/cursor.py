@@ -0,0 +1,58 @@
+import base64
+import hashlib
+import hmac
+import json
+
+from image_hub.config import get_settings
+from image_hub.image.errors import InvalidCursor
+
+
+CURSOR_VERSION = 1
+SIGNATURE_SIZE = 16
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def _sign(payload: bytes) -> bytes:
+    secret_key = get_settings().auth_secret_key.encode('utf-8')
+    return hmac.new(secret_key, payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+
+def encode_cursor(kind: str, sort_key: tuple) -> str:
+    """
+    Encode the sort tuple of the last returned row into an opaque, signed paging cursor.
+    `kind` names the listing the cursor belongs to, so it can not be replayed on another listing.
+    """
+    payload = json.dumps([CURSOR_VERSION, kind, *sort_key], separators=(',', ':')).encode('utf-8')
+    return f'{_b64encode(payload)}.{_b64encode(_sign(payload))}'
+
+
+def decode_cursor(cursor: str, kind: str, key_length: int) -> tuple:
+    try:
+        encoded_payload, encoded_signature = cursor.split('.')
+        payload = _b64decode(encoded_payload)
+        signature = _b64decode(encoded_signature)
+    except ValueError as error:
+        raise InvalidCursor(cursor) from error
+
+    if not hmac.compare_digest(signature, _sign(payload)):
+        raise InvalidCursor(cursor)
+
+    try:
+        version, cursor_kind, *sort_key = json.loads(payload)
+    except (ValueError, TypeError) as error:
+        raise InvalidCursor(cursor) from error
+
+    if version != CURSOR_VERSION or cursor_kind != kind or len(sort_key) != key_length:
+        raise InvalidCursor(cursor)
+
+    if not all(isinstance(value, int) for value in sort_key):
+        raise InvalidCursor(cursor)
+
+    return tuple(sort_key)
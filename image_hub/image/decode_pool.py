@@ -0,0 +1,132 @@
+import asyncio
+import multiprocessing
+import os
+import resource
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+from PIL import Image
+
+from image_hub.config import get_settings
+from image_hub.image.dto import ProcessedImageDto
+from image_hub.image.errors import InvalidImage
+from image_hub.image.processing import process_image_file
+
+
+# a worker is replaced after this many images, giving back the memory fragmented by large decodes
+DECODE_WORKER_MAX_TASKS = 100
+WARM_UP_IMAGE_FORMATS = ('JPEG', 'PNG')
+
+_decode_pool: ProcessPoolExecutor | None = None
+
+
+def warm_up_image_codecs():
+    """
+    Load the PIL plugin registry and run the upload processing once per common format,
+    so the first uploads do not pay for the plugin imports and the codec setup.
+    """
+    Image.init()
+    for image_format in WARM_UP_IMAGE_FORMATS:
+        source = BytesIO()
+        Image.new('RGB', (64, 64)).save(source, format=image_format)
+        source.seek(0)
+        process_image_file(source, len(source.getvalue()))
+
+
+def init_decode_worker(memory_limit: int, max_pixels: int):
+    # allocations past the limit raise MemoryError in the worker instead of growing the server
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    warm_up_image_codecs()
+
+
+def get_decode_worker_count() -> int:
+    """
+    Number of decode processes of this server worker. Every server worker has its own pool, the
+    `image_decode_workers` setting is shared by the `serve_workers` of the server.
+    """
+    settings = get_settings()
+    return max(1, settings.image_decode_workers // (settings.serve_workers or 1))
+
+
+def process_image_source(source: bytes | str) -> ProcessedImageDto:
+    # a missing upload file is an error of the server, not of the image
+    byte_size = os.path.getsize(source) if isinstance(source, str) else len(source)
+    try:
+        return process_image_file(source if isinstance(source, str) else BytesIO(source), byte_size)
+    except InvalidImage:
+        raise
+    except MemoryError as error:
+        raise InvalidImage('Image needs more memory to decode than allowed') from error
+    except (OSError, ValueError) as error:
+        # e.g. a truncated file or corrupted image data
+        raise InvalidImage(f'Image can not be decoded: {error}') from error
+
+
+def get_decode_pool() -> ProcessPoolExecutor:
+    global _decode_pool
+
+    if _decode_pool is None:
+        settings = get_settings()
+        _decode_pool = ProcessPoolExecutor(
+            get_decode_worker_count(),
+            # forking a process running the event loop and its threads is not safe
+            mp_context=multiprocessing.get_context('forkserver'),
+            initializer=init_decode_worker,
+            initargs=(settings.image_decode_memory_limit_mb * 1024 * 1024, settings.image_max_pixels),
+            max_tasks_per_child=DECODE_WORKER_MAX_TASKS,
+        )
+
+    return _decode_pool
+
+
+async def start_decode_pool():
+    """
+    Start every decode worker now, so the first uploads do not wait for the processes and their codec warm-up.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_decode_pool()
+    await asyncio.gather(
+        *(loop.run_in_executor(pool, Image.init) for _ in range(get_decode_worker_count()))
+    )
+
+
+def shutdown_decode_pool():
+    global _decode_pool
+
+    if _decode_pool is not None:
+        _decode_pool.shutdown(wait=False, cancel_futures=True)
+        _decode_pool = None
+
+
+def replace_broken_pool(pool: ProcessPoolExecutor):
+    # concurrent failures of the same pool replace it only once
+    if _decode_pool is pool:
+        shutdown_decode_pool()
+
+
+async def process_image(source: bytes | str) -> ProcessedImageDto:
+    """
+    Decode the image, given as its content or as the path of its file, and create its thumbnail in a worker process
+    limited by the `image_decode_memory_limit_mb` setting, raising `InvalidImage` for files that can not be decoded
+    safely. A path is opened by the worker, large files are not copied to it.
+
+    A worker killed by a file, e.g. by a crash in a codec, breaks the pool. The pool is replaced,
+    and the images decoded by the other workers at that time fail with the same error.
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_decode_pool()
+    try:
+        future = loop.run_in_executor(pool, process_image_source, source)
+    except BrokenProcessPool:
+        # broken by an earlier file, the submission fails at once
+        replace_broken_pool(pool)
+        pool = get_decode_pool()
+        future = loop.run_in_executor(pool, process_image_source, source)
+
+    try:
+        return await future
+    except BrokenProcessPool as error:
+        replace_broken_pool(pool)
+        raise InvalidImage('Image crashed its decoding worker') from error
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+from datetime import timedelta
+
+from fastapi import HTTPException
+from sqlalchemy.sql.operators import in_op, is_
+from sqlmodel import asc, delete, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from image_hub.auth.dto import UserAuthDto
+from image_hub.config import get_settings
+from image_hub.database.models import ImageCategoryMapping, ImageInfo
+from image_hub.database.session import get_engine
+from image_hub.image.changes import get_tombstone_insert
+from image_hub.image.counters import (
+    add_category_image_counts,
+    add_user_stats,
+    check_storage_quota,
+    get_image_storage_bytes,
+)
+from image_hub.image.image_file import delete_image_files
+from image_hub.image.query import check_image_access, get_accessible_image_query
+from image_hub.image.similarity import get_similarity_index
+from image_hub.image.sprite import invalidate_image_sprites
+from image_hub.image.thumbnail_cache import invalidate_thumbnail
+from image_hub.profiling import get_requests_in_flight
+from image_hub.utils import time_now
+
+
+logger = logging.getLogger(__name__)
+
+
+async def get_image_category_ids(session: AsyncSession, image_id: int) -> list[int]:
+    result = await session.exec(
+        select(ImageCategoryMapping.category_id).where(
+            ImageCategoryMapping.image_info_id == image_id
+        )
+    )
+    return list(result)
+
+
+async def soft_delete_image(session: AsyncSession, user_auth: UserAuthDto, image_id: int):
+    """
+    Hide the image from every query and take it out of the counters.
+    The row, its category mappings and its files are kept until the purge, so the delete can be undone.
+    """
+    await check_image_access(image_id, user_auth, session)
+
+    image_result = await session.exec(
+        update(ImageInfo).where(
+            ImageInfo.id == image_id,
+            is_(ImageInfo.deleted_at, None)
+        ).values(
+            deleted_at=time_now()
+        ).returning(
+            ImageInfo.uploader_id,
+            ImageInfo.uploader_admin_id,
+            ImageInfo.byte_size,
+            ImageInfo.thumbnail_byte_size
+        )
+    )
+    # a concurrent delete of the same image already updated the counters
+    deleted_image = image_result.one_or_none()
+    if deleted_image:
+        uploader_id, uploader_admin_id, byte_size, thumbnail_byte_size = deleted_image
+        await add_user_stats(
+            session,
+            uploader_id or uploader_admin_id,
+            -1,
+            -get_image_storage_bytes(byte_size, thumbnail_byte_size)
+        )
+        await add_category_image_counts(session, await get_image_category_ids(session, image_id), -1)
+
+    await session.commit()
+
+    invalidate_image_sprites(image_id)
+    invalidate_thumbnail(image_id)
+    get_similarity_index().remove(image_id)
+
+
+async def restore_image(session: AsyncSession, user_auth: UserAuthDto, image_id: int):
+    """
+    Undo the delete of an image that is not purged yet, counting it against the storage quota of its uploader again.
+    """
+    result = await session.exec(
+        get_accessible_image_query(
+            user_auth,
+            ImageInfo.uploader_id,
+            ImageInfo.uploader_admin_id,
+            ImageInfo.byte_size,
+            ImageInfo.thumbnail_byte_size,
+            ImageInfo.perceptual_hash,
+            deleted=True
+        ).where(
+            ImageInfo.id == image_id
+        ).with_for_update()
+    )
+    deleted_image = result.one_or_none()
+    if not deleted_image:
+        raise HTTPException(
+            status_code=404,
+            detail=f'Image {image_id} is not deleted, is already purged, or you do not have access to it.'
+        )
+
+    uploader_id, uploader_admin_id, byte_size, thumbnail_byte_size, perceptual_hash = deleted_image
+    storage_bytes = get_image_storage_bytes(byte_size, thumbnail_byte_size)
+    # the bytes count against the uploader, an admin restoring the image of a user does not bypass their quota
+    uploader_auth = UserAuthDto(user_id=uploader_id or uploader_admin_id, is_admin=uploader_id is None)
+    await check_storage_quota(session, uploader_auth, storage_bytes)
+
+    await session.exec(
+        update(ImageInfo).where(ImageInfo.id == image_id).values(deleted_at=None)
+    )
+    await add_user_stats(session, uploader_id or uploader_admin_id, 1, storage_bytes)
+    await add_category_image_counts(session, await get_image_category_ids(session, image_id), 1)
+    await session.commit()
+
+    if perceptual_hash is not None:
+        get_similarity_index().add(image_id, perceptual_hash)
+
+
+async def purge_deleted_images(batch_size: int) -> int:
+    """
+    Remove up to `batch_size` images deleted before the `image_delete_retention_seconds` setting,
+    with their category mappings and files, leaving a tombstone for the change feed.
+    Returns the number of purged images.
+
+    Rows locked by another worker purging at the same time are skipped.
+    Files are removed after the rows are committed, a crash in between leaves orphan files
+    that `image_hub.commands.reconcile_files` finds.
+    """
+    purge_before = time_now() - timedelta(seconds=get_settings().image_delete_retention_seconds)
+    async with AsyncSession(get_engine()) as session:
+        result = await session.exec(
+            select(ImageInfo.id).where(
+                ImageInfo.deleted_at < purge_before
+            ).order_by(
+                asc(ImageInfo.deleted_at)
+            ).limit(batch_size).with_for_update(skip_locked=True)
+        )
+        image_ids = list(result)
+        if not image_ids:
+            return 0
+
+        await session.exec(get_tombstone_insert(image_ids, ImageInfo.change_xid))
+        await session.exec(
+            delete(ImageCategoryMapping).where(in_op(ImageCategoryMapping.image_info_id, image_ids))
+        )
+        await session.exec(delete(ImageInfo).where(in_op(ImageInfo.id, image_ids)))
+        await session.commit()
+
+    for image_id in image_ids:
+        await delete_image_files(image_id)
+
+    return len(image_ids)
+
+
+async def purge_deleted_images_periodically():
+    """
+    Purge the expired deleted images batch by batch, while this worker is quiet.
+    A batch is only started when fewer requests than the `image_purge_max_requests_in_flight` setting
+    are in flight, the rest is left to the next round.
+    """
+    settings = get_settings()
+    while True:
+        await asyncio.sleep(settings.image_purge_interval_seconds)
+        num_purged = 0
+        try:
+            while get_requests_in_flight() < settings.image_purge_max_requests_in_flight:
+                num_batch_purged = await purge_deleted_images(settings.image_purge_batch_size)
+                num_purged += num_batch_purged
+                if num_batch_purged < settings.image_purge_batch_size:
+                    break
+        except Exception:
+            logger.exception('failed to purge the deleted images')
+
+        if num_purged:
+            logger.info('%s deleted images are purged', num_purged)
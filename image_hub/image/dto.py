@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from fastapi import UploadFile
 from pydantic import BaseModel, conlist, Field
 
@@ -36,6 +38,12 @@ class ImageInfoDto(BaseModel):
     description: str | None
     uploader_id: int
     created_at: str
+    width: int | None
+    height: int | None
+    image_format: str | None
+    mime_type: str | None
+    byte_size: int | None
+    taken_at: str | None
 
 
 class ImageInfoListDto(BaseModel):
@@ -43,10 +51,75 @@ class ImageInfoListDto(BaseModel):
     next_key: str | None
 
 
+class ImageChangeDto(BaseModel):
+    id: int
+    deleted: bool
+    image: ImageInfoDto | None
+    category_ids: list[int]
+
+
+class ImageChangeListDto(BaseModel):
+    changes: list[ImageChangeDto]
+    next_key: str | None
+    has_more: bool
+
+
 class ImageDetailDto(ImageInfoDto):
     categories: list[CategoryInfoDto]
 
 
+class SpriteTileDto(BaseModel):
+    id: int
+    x: int
+    y: int
+    width: int
+    height: int
+
+
+class SpriteDto(BaseModel):
+    sprite_url: str | None
+    width: int
+    height: int
+    tiles: list[SpriteTileDto]
+    next_key: str | None
+
+
+class ThumbnailBatchDto(BaseModel):
+    image_ids: list[int] = Field(min_length=1)
+
+
+class SimilarImageDto(BaseModel):
+    id: int
+    distance: int
+    thumbnail_url: str
+
+
+class CacheMetricsDto(BaseModel):
+    name: str
+    entries: int
+    bytes: int
+    max_bytes: int
+    hits: int
+    misses: int
+    hit_rate: float | None
+    evictions: int
+
+
+class ImageMetadataDto(BaseModel):
+    width: int
+    height: int
+    image_format: str | None
+    mime_type: str | None
+    byte_size: int
+    taken_at: datetime | None
+
+
+class ProcessedImageDto(BaseModel):
+    thumbnail: bytes
+    perceptual_hash: int
+    metadata: ImageMetadataDto
+
+
 class ImageUpdateDto(BaseModel):
     description: str | None =  Field(None, max_length=511)
     deleting_categories: list[int] | None = None
@@ -0,0 +1,7 @@
+class InvalidCursor(Exception):
+    def __init__(self, cursor: str):
+        super().__init__(f'next_key={cursor} not valid')
+
+
+class InvalidImage(ValueError):
+    pass
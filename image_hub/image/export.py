@@ -0,0 +1,160 @@
+import io
+import json
+import os
+import zipfile
+from typing import AsyncIterator
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import selectinload
+
+from image_hub.auth.dto import UserAuthDto
+from image_hub.database.models import ImageInfo
+from image_hub.image.image_file import get_original_image_key, get_storage
+from image_hub.image.query import (
+    get_category_ids_column,
+    get_image_list_columns,
+    get_image_list_item,
+    iterate_image_batches,
+)
+from image_hub.responses import dumps_json
+
+
+EXPORT_READ_CHUNK_SIZE = 1024 * 1024
+MANIFEST_FILE_NAME = 'manifest.jsonl'
+NDJSON_EXPORT_BATCH_SIZE = 1000
+
+
+class ZipStreamSink(io.RawIOBase):
+    """
+    Write only, non seekable file object collecting the bytes written by `zipfile.ZipFile`,
+    so they can be handed to a streaming response as they are produced.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: list[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def get_zip_entry_name(image_info: ImageInfo) -> str:
+    return f'{image_info.id}/{os.path.basename(image_info.file_name)}'
+
+
+def get_manifest_line(image_info: ImageInfo, is_exported: bool) -> bytes:
+    manifest = dict(
+        id=image_info.id,
+        # images whose file is missing are not in the archive
+        path=get_zip_entry_name(image_info) if is_exported else None,
+        file_name=image_info.file_name,
+        description=image_info.description,
+        created_at=image_info.created_at.isoformat(),
+        categories=[category.name for category in image_info.categories],
+    )
+    return json.dumps(manifest, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+async def stream_image_zip(
+    user_auth: UserAuthDto,
+    include_manifest: bool = False
+) -> AsyncIterator[bytes]:
+    """
+    Generate a ZIP archive of every original image accessible to the user, chunk by chunk.
+
+    Images are already compressed, so they are stored as is.
+    The optional manifest is written as the last entry with a second keyset pass over the DB,
+    so neither the image bytes nor the metadata are kept in memory.
+    """
+    storage = get_storage()
+    sink = ZipStreamSink()
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        async for image_infos in iterate_image_batches(user_auth):
+            for image_info in image_infos:
+                key = get_original_image_key(image_info.id, image_info.file_name)
+                try:
+                    file_size = await run_in_threadpool(storage.size, key)
+                    chunks = await run_in_threadpool(storage.stream, key, EXPORT_READ_CHUNK_SIZE)
+                except FileNotFoundError:
+                    continue
+
+                entry_info = zipfile.ZipInfo(
+                    get_zip_entry_name(image_info),
+                    date_time=image_info.created_at.timetuple()[:6]
+                )
+                entry_info.compress_type = zipfile.ZIP_STORED
+                entry_info.file_size = file_size
+
+                with archive.open(entry_info, mode='w') as entry:
+                    while (chunk := await run_in_threadpool(next, chunks, None)) is not None:
+                        entry.write(chunk)
+                        yield sink.drain()
+
+                yield sink.drain()
+
+        if include_manifest:
+            manifest_info = zipfile.ZipInfo(MANIFEST_FILE_NAME)
+            manifest_info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(manifest_info, mode='w', force_zip64=True) as entry:
+                async for image_infos in iterate_image_batches(
+                    user_auth,
+                    query_options=(selectinload(ImageInfo.categories),)
+                ):
+                    keys = [
+                        get_original_image_key(image_info.id, image_info.file_name)
+                        for image_info in image_infos
+                    ]
+                    exported = await run_in_threadpool(lambda: [storage.exists(key) for key in keys])
+                    for image_info, is_exported in zip(image_infos, exported):
+                        entry.write(get_manifest_line(image_info, is_exported))
+
+                    yield sink.drain()
+
+            yield sink.drain()
+
+    yield sink.drain()
+
+
+async def stream_image_ndjson(
+    user_auth: UserAuthDto,
+    include_categories: bool = False,
+    after_id: int | None = None
+) -> AsyncIterator[bytes]:
+    """
+    Generate one JSON line per image accessible to the user, with the fields of the image listing,
+    in ascending id order after `after_id`. Only listing columns are selected, in keyset batches,
+    and each batch is written as one chunk.
+    """
+    columns = get_image_list_columns()
+    if include_categories:
+        columns.append(get_category_ids_column())
+
+    async for image_rows in iterate_image_batches(
+        user_auth,
+        batch_size=NDJSON_EXPORT_BATCH_SIZE,
+        last_id=after_id,
+        columns=tuple(columns)
+    ):
+        lines = []
+        for image_row in image_rows:
+            item = get_image_list_item(image_row)
+            if include_categories:
+                item['categories'] = sorted(image_row.category_ids or ())
+
+            lines.append(dumps_json(item))
+
+        yield b'\n'.join(lines) + b'\n'
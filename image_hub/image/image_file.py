@@ -1,97 +1,143 @@
-import os
-from io import BytesIO
-
-import aiofiles
-from fastapi import UploadFile
-from PIL import Image
-
-from image_hub.config import get_settings
-from image_hub.utils import delete_directory
-
-
-THUMBNAIL_FILE_NAME = 'thumbnail.jpg'
-
-
-def get_original_image_save_directory(image_id: int):
-    return os.path.join(
-        get_settings().image_path,
-        str(image_id),
-    )
-
-def get_thumbnail_save_directory(image_id: int):
-    return os.path.join(
-        get_original_image_save_directory(image_id),
-        'thumbnail'
-    )
-
-
-async def upload_file(file: UploadFile, save_path: str) -> str:
-    os.makedirs(save_path, exist_ok=True)
-    file_path = os.path.join(save_path, file.filename)
-    async with aiofiles.open(file_path, mode='wb') as save_file:
-        await  save_file.write(await file.read())
-
-    return file_path
-
-
-async def save_image_async(
-    image: Image.Image,
-    save_path: str,
-    file_name: str,
-    image_format: str = 'JPEG'
-):
-    os.makedirs(save_path, exist_ok=True)
-    file_path = os.path.join(save_path, file_name)
-
-    img_bytes = BytesIO()
-    image.save(img_bytes, format=image_format)
-    img_bytes.seek(0)
-
-    async with aiofiles.open(file_path, 'wb') as out_file:
-        await out_file.write(img_bytes.getvalue())
-
-
-def delete_image_files(image_id: int):
-    image_file_directory = get_original_image_save_directory(image_id)
-    delete_directory(image_file_directory)
-
-
-async def upload_image_files(image_id:int, image_file: UploadFile):
-    file_path = await upload_file(
-        image_file,
-        get_original_image_save_directory(image_id)
-    )
-
-    thumbnail_directory = get_thumbnail_save_directory(image_id)
-
-    with Image.open(file_path) as img:
-        settings = get_settings()
-        img = img.convert('RGB')
-        img.thumbnail((settings.thumbnail_size, settings.thumbnail_size))
-        await save_image_async(
-            img,
-            thumbnail_directory,
-            THUMBNAIL_FILE_NAME,
-        )
-
-
-def get_original_image_file_url(image_id: int, image_file_name: str) -> str:
-    return f'/image/{image_id}/file/{image_file_name}'
-
-
-def get_thumbnail_image_file_url(image_id: int) -> str:
-    return f'/image/{image_id}/thumbnail/{THUMBNAIL_FILE_NAME}'
-
-
-def get_original_image_file_path(image_id: int, image_file_name: str) -> str:
-    return os.path.join(
-        get_original_image_save_directory(image_id),
-        image_file_name
-    )
-
-
-def get_thumbnail_image_file_path(image_id: int) -> str:
-    return os.path.join(
-        get_thumbnail_save_directory(image_id),
-        THUMBNAIL_FILE_NAME
-    )
\ No newline at end of file
+import asyncio
+import logging
+import os
+from functools import lru_cache
+from io import BytesIO
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, Response
+
+from image_hub.config import get_settings
+from image_hub.image.decode_pool import process_image
+from image_hub.image.dto import ProcessedImageDto
+from image_hub.image.processing import open_image
+from image_hub.image.thumbnail import create_thumbnail, encode_thumbnail
+from image_hub.storage.base import StorageBackend
+from image_hub.storage.filesystem import FileSystemStorage
+from image_hub.storage.packed import PackedStorage
+
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_FILE_NAME = 'thumbnail.jpg'
+
+
+@lru_cache
+def get_storage() -> StorageBackend:
+    settings = get_settings()
+    if settings.storage_backend == 'packed':
+        return PackedStorage(
+            settings.image_path,
+            small_file_limit=settings.packed_small_file_limit_kb * 1024,
+            max_pack_size=settings.packed_max_pack_size_mb * 1024 * 1024,
+            compaction_dead_ratio=settings.packed_compaction_dead_ratio,
+        )
+
+    return FileSystemStorage(settings.image_path)
+
+
+async def compact_storage_periodically():
+    """
+    Reclaim the space of deleted files. Only the packed backend has anything to compact,
+    and concurrent compactions from several workers serialize on its write lock.
+    """
+    while True:
+        await asyncio.sleep(get_settings().packed_compaction_interval_seconds)
+        try:
+            await run_in_threadpool(get_storage().compact)
+        except Exception:
+            logger.exception('failed to compact the image storage')
+
+
+def get_image_key_prefix(image_id: int) -> str:
+    return f'{image_id}/'
+
+
+def get_original_image_key(image_id: int, image_file_name: str) -> str:
+    return f'{image_id}/{image_file_name}'
+
+
+def get_thumbnail_image_key(image_id: int) -> str:
+    return f'{image_id}/thumbnail/{THUMBNAIL_FILE_NAME}'
+
+
+def get_image_source(key: str) -> tuple[str | BytesIO, int]:
+    """
+    Return something `PIL.Image.open` accepts for the stored file, and its byte size.
+    Raises `FileNotFoundError` when the file does not exist.
+    """
+    storage = get_storage()
+    local_path = storage.local_path(key)
+    if local_path is not None:
+        return local_path, os.path.getsize(local_path)
+
+    content = storage.get(key)
+    return BytesIO(content), len(content)
+
+
+def regenerate_thumbnail_file(image_id: int, file_name: str) -> int:
+    """
+    Recreate the thumbnail from the stored original, replacing the current one atomically,
+    and return its byte size. Raises `FileNotFoundError` when the original is missing.
+    """
+    source, _ = get_image_source(get_original_image_key(image_id, file_name))
+    with open_image(source) as img:
+        thumbnail = create_thumbnail(img, get_settings().thumbnail_size)
+
+    content = encode_thumbnail(thumbnail)
+    get_storage().put(get_thumbnail_image_key(image_id), content)
+    return len(content)
+
+
+async def delete_image_files(image_id: int):
+    await run_in_threadpool(get_storage().delete_prefix, get_image_key_prefix(image_id))
+
+
+async def upload_image_files(image_id: int, file_name: str, source: bytes | str) -> ProcessedImageDto:
+    """
+    Process and store the original, given as its content or as the path of a file which is left in place,
+    and its thumbnail. A file is stored without being read into memory.
+    """
+    # decoding and resampling are CPU bound and can blow up on crafted files, keep them in a guarded worker
+    processed_image = await process_image(source)
+
+    storage = get_storage()
+    original_key = get_original_image_key(image_id, file_name)
+    if isinstance(source, str):
+        await run_in_threadpool(storage.put_file, original_key, source)
+    else:
+        await run_in_threadpool(storage.put, original_key, source)
+
+    await run_in_threadpool(
+        storage.put,
+        get_thumbnail_image_key(image_id),
+        processed_image.thumbnail
+    )
+
+    return processed_image
+
+
+async def get_stored_file_response(key: str, media_type: str) -> Response:
+    storage = get_storage()
+    local_path = storage.local_path(key)
+    if local_path is not None:
+        if not os.path.exists(local_path):
+            raise HTTPException(status_code=404, detail="File not found")
+
+        return FileResponse(local_path, media_type=media_type)
+
+    try:
+        content = await run_in_threadpool(storage.get, key)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    return Response(content, media_type=media_type)
+
+
+def get_original_image_file_url(image_id: int, image_file_name: str) -> str:
+    return f'/image/{image_id}/file/{image_file_name}'
+
+
+def get_thumbnail_image_file_url(image_id: int) -> str:
+    return f'/image/{image_id}/thumbnail/{THUMBNAIL_FILE_NAME}'
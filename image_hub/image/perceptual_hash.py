@@ -0,0 +1,34 @@
+from PIL import Image
+
+
+DHASH_SIZE = 8
+
+
+def compute_dhash(img: Image.Image) -> int:
+    """
+    64 bit difference hash: each bit tells whether a pixel of the 9x8 grayscale image
+    is brighter than its right neighbor. Resized or re-encoded copies get hashes
+    within a small Hamming distance of each other.
+    """
+    small = img.convert('L').resize(
+        (DHASH_SIZE + 1, DHASH_SIZE),
+        Image.Resampling.LANCZOS
+    )
+    pixels = small.tobytes()
+
+    dhash = 0
+    for row in range(DHASH_SIZE):
+        offset = row * (DHASH_SIZE + 1)
+        for column in range(DHASH_SIZE):
+            dhash = (dhash << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+
+    return dhash
+
+
+def to_signed_64(value: int) -> int:
+    # postgres BIGINT is signed
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned_64(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
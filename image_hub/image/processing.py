@@ -0,0 +1,89 @@
+from datetime import datetime, timezone
+from typing import BinaryIO
+
+from PIL import Image, ExifTags, UnidentifiedImageError
+
+from image_hub.config import get_settings
+from image_hub.image.dto import ImageMetadataDto, ProcessedImageDto
+from image_hub.image.errors import InvalidImage
+from image_hub.image.perceptual_hash import compute_dhash
+from image_hub.image.thumbnail import create_thumbnail, encode_thumbnail
+
+
+EXIF_DATETIME_FORMAT = '%Y:%m:%d %H:%M:%S'
+
+
+def get_taken_at(img: Image.Image) -> datetime | None:
+    try:
+        exif = img.getexif()
+        exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+        taken_at = exif_ifd.get(ExifTags.Base.DateTimeOriginal) or exif.get(ExifTags.Base.DateTime)
+        if not taken_at:
+            return None
+
+        taken_at = datetime.strptime(taken_at.strip('\x00 '), EXIF_DATETIME_FORMAT)
+        offset = exif_ifd.get(ExifTags.Base.OffsetTimeOriginal)
+        if offset:
+            return taken_at.replace(tzinfo=datetime.strptime(offset.strip('\x00 '), '%z').tzinfo)
+    except Exception:
+        return None
+
+    # EXIF has no timezone without the offset tag
+    return taken_at.replace(tzinfo=timezone.utc)
+
+
+def extract_metadata(img: Image.Image, byte_size: int) -> ImageMetadataDto:
+    """
+    Read the metadata of an opened image from its header only, before it is decoded or reduced.
+    """
+    return ImageMetadataDto(
+        width=img.width,
+        height=img.height,
+        image_format=img.format,
+        mime_type=Image.MIME.get(img.format) if img.format else None,
+        byte_size=byte_size,
+        taken_at=get_taken_at(img),
+    )
+
+
+def open_image(source: str | BinaryIO) -> Image.Image:
+    """
+    Open an image to decode it, raising `InvalidImage` before any pixel is decoded
+    when its declared dimensions exceed the `image_max_pixels` setting.
+
+    Multi-frame images, animations and multi-page documents, are only decoded from the first frame
+    `Image.open` stands on, without counting or seeking the frames. It is the poster frame of an animation
+    and the main page of a document, and the later frames of a GIF can only be reached by decoding
+    all the frames before them.
+    """
+    try:
+        img = Image.open(source)
+    except UnidentifiedImageError as error:
+        raise InvalidImage('File is not an image of a supported format') from error
+    except Image.DecompressionBombError as error:
+        raise InvalidImage(str(error)) from error
+
+    max_pixels = get_settings().image_max_pixels
+    if img.width * img.height > max_pixels:
+        img.close()
+        raise InvalidImage(f'Image of {img.width}x{img.height} pixels exceeds the limit of {max_pixels} pixels')
+
+    return img
+
+
+def read_image_metadata(source: str | BinaryIO, byte_size: int) -> ImageMetadataDto:
+    with Image.open(source) as img:
+        return extract_metadata(img, byte_size)
+
+
+def process_image_file(source: str | BinaryIO, byte_size: int) -> ProcessedImageDto:
+    with open_image(source) as img:
+        metadata = extract_metadata(img, byte_size)
+        thumbnail = create_thumbnail(img, get_settings().thumbnail_size)
+
+    return ProcessedImageDto(
+        thumbnail=encode_thumbnail(thumbnail),
+        # the hash only needs a 9x8 image, the thumbnail is a cheap source for it
+        perceptual_hash=compute_dhash(thumbnail),
+        metadata=metadata,
+    )
@@ -1,13 +1,20 @@
 
+from typing import AsyncIterator
+
 from fastapi import HTTPException, status
 
-from sqlmodel import select, and_, or_, asc, desc
+from sqlmodel import select, or_, asc, desc, func
 from sqlmodel.ext.asyncio.session import AsyncSession
-from sqlalchemy.sql.operators import is_
+from sqlalchemy import literal, union_all
+from sqlalchemy.sql.operators import is_, is_not, in_op
 
 
 from image_hub.auth.dto import UserAuthDto
-from image_hub.database.models import ImageInfo
+from image_hub.database.models import ImageCategoryMapping, ImageInfo
+from image_hub.database.session import open_read_session
+from image_hub.image.cursor import decode_cursor, encode_cursor
+from image_hub.image.errors import InvalidCursor
+from image_hub.image.image_file import get_original_image_file_url, get_thumbnail_image_file_url
 
 
 
@@ -19,7 +26,8 @@ async def check_image_access(
 
     if user_auth.is_admin:
         query = select(ImageInfo.id).where(
-            ImageInfo.id == image_id
+            ImageInfo.id == image_id,
+            is_(ImageInfo.deleted_at, None)
         ).where(
             or_(
                 ImageInfo.uploader_admin_id == user_auth.user_id,
@@ -28,7 +36,8 @@ async def check_image_access(
         )
     else:
         query = select(ImageInfo.id).where(
-            ImageInfo.id == image_id
+            ImageInfo.id == image_id,
+            is_(ImageInfo.deleted_at, None)
         ).where(
             ImageInfo.uploader_id == user_auth.user_id
         )
@@ -43,69 +52,286 @@ async def check_image_access(
         )
 
 
+async def get_accessible_image_ids(
+    image_ids: list[int],
+    user_auth: UserAuthDto,
+    session: AsyncSession
+) -> set[int]:
+    if not image_ids:
+        return set()
+
+    query = select(ImageInfo.id).where(
+        in_op(ImageInfo.id, image_ids),
+        is_(ImageInfo.deleted_at, None)
+    )
+    if user_auth.is_admin:
+        query = query.where(
+            or_(
+                ImageInfo.uploader_admin_id == user_auth.user_id,
+                is_(ImageInfo.uploader_admin_id, None)
+            )
+        )
+    else:
+        query = query.where(
+            ImageInfo.uploader_id == user_auth.user_id
+        )
+
+    result = await session.exec(query)
+    return set(result)
+
+
+ADMIN_CURSOR_KIND = 'admin_images'
+USER_CURSOR_KIND = 'user_images'
+
+# admins see their own images first, then the images uploaded by normal users
+ADMIN_OWN_IMAGES_SEGMENT = 0
+ADMIN_USER_IMAGES_SEGMENT = 1
+
+
+# only the columns needed by the listings are selected, rows are returned instead of ORM instances
+IMAGE_LIST_COLUMN_NAMES = (
+    'id',
+    'file_name',
+    'description',
+    'uploader_id',
+    'uploader_admin_id',
+    'created_at',
+    'width',
+    'height',
+    'image_format',
+    'mime_type',
+    'byte_size',
+    'taken_at',
+)
+
+
+def get_image_list_columns() -> list:
+    return [getattr(ImageInfo, column_name) for column_name in IMAGE_LIST_COLUMN_NAMES]
+
+
+def get_category_ids_column():
+    """
+    Category ids of the image as a correlated array subquery, NULL when the image has none.
+    """
+    return select(
+        func.array_agg(ImageCategoryMapping.category_id)
+    ).where(
+        ImageCategoryMapping.image_info_id == ImageInfo.id
+    ).scalar_subquery().label('category_ids')
+
+
+def get_image_list_item(image_row) -> dict:
+    """
+    JSON ready dict of a row selected with `get_image_list_columns`.
+    """
+    return dict(
+        id=image_row.id,
+        file_name=image_row.file_name,
+        image_url=get_original_image_file_url(image_row.id, image_row.file_name),
+        thumbnail_url=get_thumbnail_image_file_url(image_row.id),
+        description=image_row.description,
+        uploader_id=image_row.uploader_id or image_row.uploader_admin_id,
+        created_at=image_row.created_at.isoformat(),
+        width=image_row.width,
+        height=image_row.height,
+        image_format=image_row.image_format,
+        mime_type=image_row.mime_type,
+        byte_size=image_row.byte_size,
+        taken_at=image_row.taken_at.isoformat() if image_row.taken_at else None
+    )
+
+
+def decode_next_key(next_key: str, kind: str, key_length: int) -> tuple:
+    try:
+        return decode_cursor(next_key, kind, key_length)
+    except InvalidCursor as error:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(error)
+        )
+
+
 def get_admin_base_image_query(
     admin_id: int,
+    size: int,
     next_key: str | None = None,
 ):
+    """
+    Listing of admin images as the UNION ALL of two streams, each served in order
+    by its own index range scan: the admin's own images, then the images without an admin uploader.
+    """
     if next_key:
-        try:
-            is_fetch_owning_image, image_id_str = next_key.split('-')
-            image_id = int(image_id_str)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f'next_key={next_key} not valid'
-            )
+        segment, image_id = decode_next_key(next_key, ADMIN_CURSOR_KIND, 2)
+    else:
+        segment, image_id = ADMIN_OWN_IMAGES_SEGMENT, None
 
-        if is_fetch_owning_image:
-            query = select(ImageInfo).where(
-                or_(
-                    and_(
-                        ImageInfo.uploader_admin_id == admin_id,
-                        ImageInfo.id < image_id
-                    ),
-                    is_(ImageInfo.uploader_admin_id, None)
-                )
-            )
-        else:
-            query = select(ImageInfo).where(
-                is_(ImageInfo.uploader_admin_id, None),
-                ImageInfo.id < image_id
+    own_images_query = select(
+        *get_image_list_columns(),
+        literal(ADMIN_OWN_IMAGES_SEGMENT).label('segment')
+    ).where(
+        ImageInfo.uploader_admin_id == admin_id,
+        is_(ImageInfo.deleted_at, None)
+    )
+    user_images_query = select(
+        *get_image_list_columns(),
+        literal(ADMIN_USER_IMAGES_SEGMENT).label('segment')
+    ).where(
+        is_(ImageInfo.uploader_admin_id, None),
+        is_(ImageInfo.deleted_at, None)
+    )
 
-            )
+    if image_id is not None and segment == ADMIN_OWN_IMAGES_SEGMENT:
+        own_images_query = own_images_query.where(ImageInfo.id < image_id)
+    elif image_id is not None:
+        user_images_query = user_images_query.where(ImageInfo.id < image_id)
+
+    streams = [
+        user_images_query.order_by(desc(ImageInfo.id)).limit(size)
+    ]
+    if segment == ADMIN_OWN_IMAGES_SEGMENT:
+        streams.insert(0, own_images_query.order_by(desc(ImageInfo.id)).limit(size))
+
+    merged_images = union_all(*streams).subquery()
+
+    return select(
+        *[merged_images.c[column_name] for column_name in IMAGE_LIST_COLUMN_NAMES]
+    ).order_by(
+        asc(merged_images.c.segment),
+        desc(merged_images.c.id)
+    ).limit(size)
+
+
+def get_user_base_image_query(
+    user_id: int,
+    size: int,
+    next_key: str | None = None
+):
+    query = select(*get_image_list_columns()).where(
+        ImageInfo.uploader_id == user_id,
+        is_(ImageInfo.deleted_at, None)
+    )
+
+    if next_key:
+        image_id, = decode_next_key(next_key, USER_CURSOR_KIND, 1)
+        query = query.where(ImageInfo.id < image_id)
+
+    return query.order_by(
+        desc(ImageInfo.id)
+    ).limit(size)
+
+
+def get_base_image_query(
+    user_auth: UserAuthDto,
+    size: int,
+    next_key: str | None = None
+):
+    if user_auth.is_admin:
+        return get_admin_base_image_query(user_auth.user_id, size, next_key)
+
+    return get_user_base_image_query(user_auth.user_id, size, next_key)
+
+
+def get_next_key(
+    user_auth: UserAuthDto,
+    image_infos: list,
+    size: int
+) -> str | None:
+    if len(image_infos) < size:
+        return None
+
+    last_image = image_infos[-1]
+    if not user_auth.is_admin:
+        return encode_cursor(USER_CURSOR_KIND, (last_image.id,))
+
+    if last_image.uploader_admin_id == user_auth.user_id:
+        segment = ADMIN_OWN_IMAGES_SEGMENT
+    else:
+        segment = ADMIN_USER_IMAGES_SEGMENT
+
+    return encode_cursor(ADMIN_CURSOR_KIND, (segment, last_image.id))
+
+
+async def get_image_mime_type(
+    image_id: int,
+    user_auth: UserAuthDto,
+    session: AsyncSession
+) -> str | None:
+    """
+    Same access check as `check_image_access`, returning the stored MIME type of the image.
+    """
+    query = get_accessible_image_query(user_auth, ImageInfo.id, ImageInfo.mime_type).where(
+        ImageInfo.id == image_id
+    )
+
+    result = await session.exec(query)
+    row = result.one_or_none()
+    if not row:
+        raise HTTPException(
+            status_code=404,
+            detail=f'You do not have access to image {image_id}, or the image does not exist.'
+        )
+
+    return row.mime_type
+
+
+def get_accessible_image_query(user_auth: UserAuthDto, *columns, deleted: bool = False):
+    """
+    Select the live images accessible to the user, or with `deleted` their deleted images not purged yet.
+    """
+    query = select(*columns) if columns else select(ImageInfo)
+    if deleted:
+        query = query.where(is_not(ImageInfo.deleted_at, None))
     else:
-        query = select(ImageInfo).where(
+        query = query.where(is_(ImageInfo.deleted_at, None))
+
+    if user_auth.is_admin:
+        return query.where(
             or_(
-                ImageInfo.uploader_admin_id == admin_id,
+                ImageInfo.uploader_admin_id == user_auth.user_id,
                 is_(ImageInfo.uploader_admin_id, None)
             )
         )
 
-    return query.order_by(
-        asc(ImageInfo.uploader_admin_id),
-        desc(ImageInfo.id)
+    return query.where(
+        ImageInfo.uploader_id == user_auth.user_id
     )
 
 
-def get_user_base_image_query(user_id: int, next_key: str | None = None):
-    if next_key:
-        try:
-            image_id = int(next_key)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f'next_key={next_key} not valid'
+async def iterate_image_batches(
+    user_auth: UserAuthDto,
+    batch_size: int = 500,
+    last_id: int | None = None,
+    query_options: tuple = (),
+    columns: tuple = (),
+) -> AsyncIterator[list]:
+    """
+    Yield every image accessible to the user in ascending id order, one keyset page at a time.
+    Pages hold `ImageInfo` instances, or rows of `columns` when given, which must include the id.
+
+    A dedicated read session is used so that the iterator can outlive the request dependencies,
+    e.g. inside a streaming response, and loaded rows are detached after every page
+    to keep the memory usage constant.
+    """
+    async with open_read_session(user_auth.user_id) as session:
+        while True:
+            query = get_accessible_image_query(user_auth, *columns)
+            if last_id is not None:
+                query = query.where(ImageInfo.id > last_id)
+
+            result = await session.exec(
+                query.options(*query_options).order_by(asc(ImageInfo.id)).limit(batch_size)
             )
+            image_infos = list(result)
+            session.expunge_all()
+            # end the read transaction between pages, so a long export does not hold a snapshot
+            await session.commit()
 
-        query = select(ImageInfo).where(
-            ImageInfo.uploader_id == user_id,
-            ImageInfo.id < image_id
-        )
-    else:
-        query = select(ImageInfo).where(
-            ImageInfo.uploader_id == user_id
-        )
+            if not image_infos:
+                return
 
-    return query.order_by(
-        desc(ImageInfo.id)
-    )
+            yield image_infos
+
+            if len(image_infos) < batch_size:
+                return
+
+            last_id = image_infos[-1].id
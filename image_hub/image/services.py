@@ -0,0 +1,116 @@
+import os
+
+from fastapi import HTTPException
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.exc import IntegrityError
+
+from image_hub.auth.dto import UserAuthDto
+from image_hub.database.models import ImageCategoryMapping, ImageInfo
+from image_hub.database.session import mark_user_write
+from image_hub.image.counters import (
+    add_category_image_counts,
+    add_user_stats,
+    check_storage_quota,
+    get_image_storage_bytes
+)
+from image_hub.image.dto import ImageCreationResultDto
+from image_hub.image.errors import InvalidImage
+from image_hub.image.image_file import (
+    delete_image_files,
+    get_original_image_file_url,
+    get_thumbnail_image_file_url,
+    upload_image_files,
+)
+from image_hub.image.perceptual_hash import to_signed_64
+from image_hub.image.similarity import get_similarity_index
+
+
+async def create_image(
+    session: AsyncSession,
+    user_auth: UserAuthDto,
+    file_name: str,
+    source: bytes | str,
+    category_ids: list[int],
+    description: str | None
+) -> ImageCreationResultDto:
+    """
+    Store the image row, its category mappings and its files, and update the counters.
+    Shared by the multipart upload, passing the content, and the finalization of a resumable upload,
+    passing the path of the received file. The storage quota is checked before anything is written.
+    """
+    byte_size = os.path.getsize(source) if isinstance(source, str) else len(source)
+    await check_storage_quota(session, user_auth, byte_size)
+
+    if user_auth.is_admin:
+        uploader_id = None
+        uploader_admin_id = user_auth.user_id
+    else:
+        uploader_id = user_auth.user_id
+        uploader_admin_id = None
+
+    image_info = ImageInfo(
+        file_name=file_name,
+        description=description,
+        uploader_id=uploader_id,
+        uploader_admin_id=uploader_admin_id
+    )
+    session.add(image_info)
+
+    await session.flush()
+
+    image_id = image_info.id
+    for category_id in category_ids:
+        session.add(
+            ImageCategoryMapping(
+                category_id=category_id,
+                image_info_id=image_info.id
+            )
+        )
+
+    try:
+        processed_image = await upload_image_files(image_id, file_name, source)
+    except InvalidImage as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    except Exception as error:
+        raise HTTPException(status_code=500, detail=str(error))
+
+    image_info.perceptual_hash = to_signed_64(processed_image.perceptual_hash)
+    image_info.width = processed_image.metadata.width
+    image_info.height = processed_image.metadata.height
+    image_info.image_format = processed_image.metadata.image_format
+    image_info.mime_type = processed_image.metadata.mime_type
+    image_info.byte_size = processed_image.metadata.byte_size
+    image_info.thumbnail_byte_size = len(processed_image.thumbnail)
+    image_info.taken_at = processed_image.metadata.taken_at
+
+    # the counter rows stay locked until the commit, they are taken after the decode and the storage writes
+    # so that uploads to a popular category do not wait on each other's files
+    await add_category_image_counts(session, category_ids, 1)
+    await add_user_stats(
+        session,
+        user_auth.user_id,
+        1,
+        get_image_storage_bytes(image_info.byte_size, image_info.thumbnail_byte_size)
+    )
+
+    try:
+        await session.commit()
+    except IntegrityError as error:
+        await delete_image_files(image_id)
+        if 'is not present in table "image_category"' in str(error):
+            raise HTTPException(
+                status_code=400,
+                detail=f'Some of the input category ids({category_ids}) do not exist!'
+            )
+
+    await mark_user_write(user_auth.user_id)
+    get_similarity_index().add(image_id, processed_image.perceptual_hash)
+
+    return ImageCreationResultDto(
+        id=image_id,
+        file_name=file_name,
+        description=description,
+        image_url=get_original_image_file_url(image_id, file_name),
+        thumbnail_url=get_thumbnail_image_file_url(image_id),
+        categories=category_ids,
+    )
@@ -0,0 +1,166 @@
+import asyncio
+import logging
+from functools import lru_cache
+from itertools import combinations
+
+from sqlmodel import asc, select, tuple_
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from image_hub.config import get_settings
+from image_hub.database.models import ImageInfo
+from image_hub.database.session import get_engine
+from image_hub.image.changes import FINISHED_TRANSACTION_HORIZON
+from image_hub.image.perceptual_hash import to_unsigned_64
+
+
+logger = logging.getLogger(__name__)
+
+NUM_HASH_CHUNKS = 4
+HASH_CHUNK_BITS = 64 // NUM_HASH_CHUNKS
+HASH_CHUNK_MASK = (1 << HASH_CHUNK_BITS) - 1
+INDEX_LOAD_BATCH_SIZE = 10000
+
+
+@lru_cache
+def get_chunk_flip_masks(max_bits: int) -> list[int]:
+    masks = []
+    for num_bits in range(max_bits + 1):
+        for bits in combinations(range(HASH_CHUNK_BITS), num_bits):
+            masks.append(sum(1 << bit for bit in bits))
+
+    return masks
+
+
+class MultiIndexHashTable:
+    """
+    In-memory index of 64 bit perceptual hashes answering Hamming radius queries.
+
+    The hash is split into 4 chunks of 16 bits, each with its own exact match table.
+    Two hashes within distance r have at least one chunk within distance r // 4,
+    so a query only probes the chunk values within that smaller radius
+    and verifies the candidates with the full distance.
+    """
+
+    def __init__(self):
+        self.hashes: dict[int, int] = {}
+        self._tables: list[dict[int, set[int]]] = [dict() for _ in range(NUM_HASH_CHUNKS)]
+
+    def __len__(self) -> int:
+        return len(self.hashes)
+
+    @staticmethod
+    def _chunks(image_hash: int) -> list[int]:
+        return [
+            (image_hash >> (index * HASH_CHUNK_BITS)) & HASH_CHUNK_MASK
+            for index in range(NUM_HASH_CHUNKS)
+        ]
+
+    def add(self, image_id: int, image_hash: int):
+        image_hash = to_unsigned_64(image_hash)
+        self.remove(image_id)
+        self.hashes[image_id] = image_hash
+        for table, chunk in zip(self._tables, self._chunks(image_hash)):
+            table.setdefault(chunk, set()).add(image_id)
+
+    def remove(self, image_id: int):
+        image_hash = self.hashes.pop(image_id, None)
+        if image_hash is None:
+            return
+
+        for table, chunk in zip(self._tables, self._chunks(image_hash)):
+            image_ids = table.get(chunk)
+            if image_ids is None:
+                continue
+
+            image_ids.discard(image_id)
+            if not image_ids:
+                del table[chunk]
+
+    def search(self, image_hash: int, max_distance: int) -> list[tuple[int, int]]:
+        """
+        Return (image id, distance) pairs within `max_distance` of `image_hash`, closest first.
+        """
+        image_hash = to_unsigned_64(image_hash)
+        flip_masks = get_chunk_flip_masks(max_distance // NUM_HASH_CHUNKS)
+
+        candidates = set()
+        for table, chunk in zip(self._tables, self._chunks(image_hash)):
+            for flip_mask in flip_masks:
+                image_ids = table.get(chunk ^ flip_mask)
+                if image_ids:
+                    candidates.update(image_ids)
+
+        matches = []
+        for image_id in candidates:
+            distance = (self.hashes[image_id] ^ image_hash).bit_count()
+            if distance <= max_distance:
+                matches.append((image_id, distance))
+
+        matches.sort(key=lambda match: (match[1], match[0]))
+        return matches
+
+
+@lru_cache
+def get_similarity_index() -> MultiIndexHashTable:
+    return MultiIndexHashTable()
+
+
+# (change_xid, id) of the last image row loaded into the index of this process
+_last_loaded_key: tuple[int, int] | None = None
+
+
+async def load_similarity_index():
+    """
+    Apply the images changed since the last call, in keyset batches over the transaction id of their last change,
+    see image_hub/image/changes.py. Changed images are added again, deleted ones and those without a hash removed.
+
+    Only the changes of transactions finished before every running one are read, so an upload committing
+    after a later one is still found. Images removed without a soft delete, by
+    `image_hub.commands.reconcile_files`, stay in the index and are dropped by the access check of the search.
+    """
+    global _last_loaded_key
+
+    index = get_similarity_index()
+    async with AsyncSession(get_engine()) as session:
+        while True:
+            query = select(
+                ImageInfo.change_xid,
+                ImageInfo.id,
+                ImageInfo.perceptual_hash,
+                ImageInfo.deleted_at
+            ).where(
+                ImageInfo.change_xid < FINISHED_TRANSACTION_HORIZON
+            )
+            if _last_loaded_key is not None:
+                query = query.where(tuple_(ImageInfo.change_xid, ImageInfo.id) > _last_loaded_key)
+
+            result = await session.exec(
+                query.order_by(
+                    asc(ImageInfo.change_xid),
+                    asc(ImageInfo.id)
+                ).limit(INDEX_LOAD_BATCH_SIZE)
+            )
+            rows = list(result)
+            await session.commit()
+            if not rows:
+                return
+
+            for _, image_id, perceptual_hash, deleted_at in rows:
+                if perceptual_hash is None or deleted_at is not None:
+                    index.remove(image_id)
+                else:
+                    index.add(image_id, perceptual_hash)
+
+            _last_loaded_key = tuple(rows[-1][:2])
+
+
+async def refresh_similarity_index_periodically():
+    """
+    Pick up the images uploaded, deleted and restored through other worker processes.
+    """
+    while True:
+        await asyncio.sleep(get_settings().similarity_index_refresh_seconds)
+        try:
+            await load_similarity_index()
+        except Exception:
+            logger.exception('failed to refresh the similarity index')
@@ -0,0 +1,119 @@
+import math
+import time
+from functools import lru_cache
+from io import BytesIO
+
+from fastapi.concurrency import run_in_threadpool
+from PIL import Image
+
+from image_hub.cache import LRUBytesCache
+from image_hub.config import get_settings
+from image_hub.image.dto import SpriteTileDto
+from image_hub.image.image_file import get_storage, get_thumbnail_image_key
+
+
+SPRITE_COLUMNS = 10
+
+SpriteKey = tuple[int, ...]
+Sprite = tuple[bytes, int, int, list[SpriteTileDto]]
+
+# image id -> keys of the cached sprites containing the image
+_sprite_keys_by_image_id: dict[int, set[SpriteKey]] = {}
+
+
+def _forget_sprite(key: SpriteKey, _entry: tuple[Sprite, float] | None = None):
+    for image_id in key:
+        sprite_keys = _sprite_keys_by_image_id.get(image_id)
+        if sprite_keys is None:
+            continue
+
+        sprite_keys.discard(key)
+        if not sprite_keys:
+            del _sprite_keys_by_image_id[image_id]
+
+
+@lru_cache
+def get_sprite_cache() -> LRUBytesCache:
+    return LRUBytesCache(
+        get_settings().sprite_cache_size_mb * 1024 * 1024,
+        on_evict=_forget_sprite
+    )
+
+
+def get_sprite_url(image_ids: list[int]) -> str:
+    return f'/images/sprite.jpg?ids={",".join(str(image_id) for image_id in image_ids)}'
+
+
+def build_sprite(image_ids: list[int]) -> Sprite:
+    settings = get_settings()
+    cell_size = settings.thumbnail_size
+    num_columns = min(SPRITE_COLUMNS, len(image_ids))
+    num_rows = math.ceil(len(image_ids) / num_columns)
+    width = num_columns * cell_size
+    height = num_rows * cell_size
+
+    storage = get_storage()
+    sheet = Image.new('RGB', (width, height), (255, 255, 255))
+    tiles = []
+    for index, image_id in enumerate(image_ids):
+        try:
+            thumbnail = Image.open(BytesIO(storage.get(get_thumbnail_image_key(image_id))))
+        except FileNotFoundError:
+            continue
+
+        with thumbnail:
+            if thumbnail.width > cell_size or thumbnail.height > cell_size:
+                thumbnail.thumbnail((cell_size, cell_size))
+
+            x = (index % num_columns) * cell_size
+            y = (index // num_columns) * cell_size
+            sheet.paste(thumbnail.convert('RGB'), (x, y))
+            tiles.append(
+                SpriteTileDto(
+                    id=image_id,
+                    x=x,
+                    y=y,
+                    width=thumbnail.width,
+                    height=thumbnail.height
+                )
+            )
+
+    content = BytesIO()
+    sheet.save(content, format='JPEG', quality=settings.thumbnail_quality, optimize=True)
+    return content.getvalue(), width, height, tiles
+
+
+async def get_sprite(image_ids: list[int]) -> Sprite:
+    """
+    Return the sprite sheet of the thumbnails of `image_ids`, building it if it is not cached.
+    Access to the images must be checked by the caller.
+
+    Sprites expire after the `thumbnail_cache_ttl_seconds` setting, as the thumbnails do, which bounds how long
+    a thumbnail deleted or regenerated through another process is served in a sprite.
+    """
+    key = tuple(image_ids)
+    cache = get_sprite_cache()
+    entry = cache.get(key)
+    if entry is not None:
+        sprite, expires_at = entry
+        if expires_at > time.monotonic():
+            return sprite
+
+        cache.pop(key)
+        _forget_sprite(key)
+
+    sprite = await run_in_threadpool(build_sprite, image_ids)
+    expires_at = time.monotonic() + get_settings().thumbnail_cache_ttl_seconds
+    cache.put(key, (sprite, expires_at), len(sprite[0]))
+    if key in cache:
+        for image_id in key:
+            _sprite_keys_by_image_id.setdefault(image_id, set()).add(key)
+
+    return sprite
+
+
+def invalidate_image_sprites(image_id: int):
+    cache = get_sprite_cache()
+    for key in list(_sprite_keys_by_image_id.get(image_id, ())):
+        cache.pop(key)
+        _forget_sprite(key)
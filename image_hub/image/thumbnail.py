@@ -0,0 +1,86 @@
+from io import BytesIO
+
+from PIL import Image, ExifTags
+
+from image_hub.config import get_settings
+
+
+# same mapping as PIL.ImageOps.exif_transpose
+_ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+# decoding at least this many times the target size before the final resample keeps
+# the quality of a plain full resolution resize while skipping most of the pixels
+THUMBNAIL_REDUCING_GAP = 2.0
+# modes reduced and resampled as they are
+THUMBNAIL_MODES = ('L', 'LA', 'RGB', 'RGBA', 'CMYK', 'YCbCr')
+
+
+def get_exif_orientation(img: Image.Image) -> int | None:
+    try:
+        return img.getexif().get(ExifTags.Base.Orientation)
+    except Exception:
+        return None
+
+
+def to_rgb(img: Image.Image) -> Image.Image:
+    if img.mode == 'RGB':
+        return img
+
+    if img.mode in ('RGBA', 'LA', 'PA') or 'transparency' in img.info:
+        img = img.convert('RGBA')
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+
+    return img.convert('RGB')
+
+
+def create_thumbnail(img: Image.Image, size: int) -> Image.Image:
+    """
+    Reduce an opened, not yet decoded image to a RGB thumbnail that fits in `size` x `size`.
+
+    JPEG images are decoded directly at a reduced scale with `Image.draft`,
+    so the full resolution pixels are never materialized.
+    Color conversion and EXIF orientation are applied after the reduction, on the small image.
+    """
+    orientation = get_exif_orientation(img)
+    gap_size = int(size * THUMBNAIL_REDUCING_GAP)
+
+    img.draft('RGB', (gap_size, gap_size))
+
+    # palette images can only be resized with the nearest neighbor filter, and `Image.reduce`
+    # rejects the 16 bit grayscale modes among others, these are converted at full size first
+    if img.mode not in THUMBNAIL_MODES:
+        has_alpha = img.mode in ('PA', 'RGBa') or 'transparency' in img.info
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+
+    img.thumbnail((size, size), reducing_gap=THUMBNAIL_REDUCING_GAP)
+    # images already smaller than the thumbnail are not resized, hence not decoded yet,
+    # and the result must not depend on the source file staying open
+    img.load()
+    img = to_rgb(img)
+
+    if orientation in _ORIENTATION_TRANSPOSE:
+        img = img.transpose(_ORIENTATION_TRANSPOSE[orientation])
+
+    return img
+
+
+def encode_thumbnail(img: Image.Image) -> bytes:
+    settings = get_settings()
+    img_bytes = BytesIO()
+    img.save(
+        img_bytes,
+        format='JPEG',
+        quality=settings.thumbnail_quality,
+        optimize=True,
+    )
+    return img_bytes.getvalue()
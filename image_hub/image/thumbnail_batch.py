@@ -0,0 +1,103 @@
+import asyncio
+import json
+import logging
+import secrets
+from typing import AsyncIterator
+
+from image_hub.config import get_settings
+from image_hub.image.thumbnail_cache import get_cached_thumbnail
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_boundary() -> str:
+    return f'thumbnail-batch-{secrets.token_hex(16)}'
+
+
+def get_batch_media_type(boundary: str) -> str:
+    return f'multipart/mixed; boundary={boundary}'
+
+
+def encode_part(
+    boundary: str,
+    image_id: int,
+    status_code: int,
+    content_type: str,
+    content: bytes
+) -> bytes:
+    headers = (
+        f'--{boundary}\r\n'
+        f'Content-Type: {content_type}\r\n'
+        f'Content-ID: <{image_id}>\r\n'
+        f'Content-Length: {len(content)}\r\n'
+        f'X-Status: {status_code}\r\n'
+        '\r\n'
+    )
+    return headers.encode('ascii') + content + b'\r\n'
+
+
+def encode_error_part(boundary: str, image_id: int, status_code: int, detail: str) -> bytes:
+    return encode_part(
+        boundary,
+        image_id,
+        status_code,
+        'application/json',
+        json.dumps(dict(id=image_id, detail=detail)).encode('utf-8')
+    )
+
+
+async def read_thumbnail_file(image_id: int, semaphore: asyncio.Semaphore) -> bytes | None:
+    async with semaphore:
+        thumbnail = await get_cached_thumbnail(image_id)
+
+    return thumbnail.content if thumbnail is not None else None
+
+
+async def stream_thumbnails(
+    boundary: str,
+    image_ids: list[int],
+    accessible_ids: set[int]
+) -> AsyncIterator[bytes]:
+    """
+    Yield a multipart/mixed body with one part per id of `image_ids`, in the requested order.
+    Thumbnails are read concurrently, bounded by the `thumbnail_batch_concurrency` setting.
+    Ids that are not in `accessible_ids`, have no thumbnail file, or whose thumbnail can not be read,
+    produce an error part.
+    """
+    semaphore = asyncio.Semaphore(get_settings().thumbnail_batch_concurrency)
+    read_tasks = {
+        image_id: asyncio.create_task(read_thumbnail_file(image_id, semaphore))
+        for image_id in image_ids
+        if image_id in accessible_ids
+    }
+
+    try:
+        for image_id in image_ids:
+            if image_id not in read_tasks:
+                yield encode_error_part(
+                    boundary,
+                    image_id,
+                    404,
+                    f'You do not have access to image {image_id}, or the image does not exist.'
+                )
+                continue
+
+            try:
+                content = await read_tasks[image_id]
+            except Exception:
+                # one unreadable thumbnail must not cut the stream of the others
+                logger.exception('failed to read the thumbnail of image %s', image_id)
+                yield encode_error_part(boundary, image_id, 500, 'Thumbnail can not be read')
+                continue
+
+            if content is None:
+                yield encode_error_part(boundary, image_id, 404, 'File not found')
+                continue
+
+            yield encode_part(boundary, image_id, 200, 'image/jpeg', content)
+
+        yield f'--{boundary}--\r\n'.encode('ascii')
+    finally:
+        for task in read_tasks.values():
+            task.cancel()
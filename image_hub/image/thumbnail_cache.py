@@ -0,0 +1,80 @@
+import asyncio
+import hashlib
+import time
+from functools import lru_cache
+
+from fastapi.concurrency import run_in_threadpool
+
+from image_hub.cache import LRUBytesCache
+from image_hub.config import get_settings
+from image_hub.image.image_file import get_storage, get_thumbnail_image_key
+
+
+class CachedThumbnail:
+    __slots__ = ('content', 'etag', 'headers', 'expires_at')
+
+    def __init__(self, content: bytes, expires_at: float):
+        self.content = content
+        self.etag = f'"{hashlib.blake2b(content, digest_size=16).hexdigest()}"'
+        self.headers = {'ETag': self.etag, 'Content-Length': str(len(content))}
+        self.expires_at = expires_at
+
+
+# image id -> read of the thumbnail in progress, shared by concurrent misses
+_pending_reads: dict[int, asyncio.Task] = {}
+
+
+@lru_cache
+def get_thumbnail_cache() -> LRUBytesCache:
+    return LRUBytesCache(get_settings().thumbnail_cache_size_mb * 1024 * 1024)
+
+
+async def _read_thumbnail(image_id: int) -> CachedThumbnail | None:
+    try:
+        content = await run_in_threadpool(get_storage().get, get_thumbnail_image_key(image_id))
+    except FileNotFoundError:
+        return None
+
+    return CachedThumbnail(content, time.monotonic() + get_settings().thumbnail_cache_ttl_seconds)
+
+
+async def get_cached_thumbnail(image_id: int) -> CachedThumbnail | None:
+    """
+    Return the thumbnail of `image_id` from memory, reading it from the storage on a miss.
+    Access to the image must be checked by the caller.
+
+    Entries expire after the `thumbnail_cache_ttl_seconds` setting, which bounds how long
+    a thumbnail deleted or regenerated through another process is served.
+    """
+    cache = get_thumbnail_cache()
+    thumbnail = cache.get(image_id)
+    if thumbnail is not None:
+        if thumbnail.expires_at > time.monotonic():
+            return thumbnail
+
+        cache.pop(image_id)
+
+    read_task = _pending_reads.get(image_id)
+    if read_task is None:
+        read_task = asyncio.create_task(_read_thumbnail(image_id))
+        _pending_reads[image_id] = read_task
+
+    try:
+        thumbnail = await asyncio.shield(read_task)
+    finally:
+        # a failed read is not kept, the next request reads the storage again, a read still running
+        # for other requests is kept when this one is cancelled.
+        # An invalidation during the read drops the pending read, its result must not be cached
+        is_current_read = _pending_reads.get(image_id) is read_task
+        if is_current_read and read_task.done():
+            del _pending_reads[image_id]
+
+    if is_current_read and thumbnail is not None:
+        cache.put(image_id, thumbnail, len(thumbnail.content))
+
+    return thumbnail
+
+
+def invalidate_thumbnail(image_id: int):
+    get_thumbnail_cache().pop(image_id)
+    _pending_reads.pop(image_id, None)
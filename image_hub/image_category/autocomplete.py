@@ -0,0 +1,106 @@
+import asyncio
+import heapq
+import logging
+from bisect import bisect_left
+from operator import itemgetter
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from image_hub.config import get_settings
+from image_hub.database.models import ImageCategory
+from image_hub.database.session import get_engine
+
+
+logger = logging.getLogger(__name__)
+
+# sorts after any character that can follow a prefix, closing the range of the names starting with it
+MAX_CHARACTER = '\U0010ffff'
+
+
+class CategoryIndex:
+    """
+    Immutable snapshot of the categories sorted by name, the names starting with a prefix
+    are found by binary search.
+    """
+
+    def __init__(self, categories: list[tuple[int, str, int]]):
+        categories = sorted(categories, key=itemgetter(1))
+        self.names = [name for _, name, _ in categories]
+        self.categories = [
+            dict(id=category_id, name=name, image_count=image_count)
+            for category_id, name, image_count in categories
+        ]
+        # positions in `categories`, most images first
+        self.ranked_positions = sorted(
+            range(len(categories)),
+            key=lambda position: categories[position][2],
+            reverse=True
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def get_prefix_range(self, prefix: str) -> tuple[int, int]:
+        start = bisect_left(self.names, prefix)
+        end = bisect_left(self.names, prefix + MAX_CHARACTER, lo=start)
+        return start, end
+
+    def search(self, prefix: str, size: int, order_by_image_count: bool = False) -> list[dict]:
+        """
+        Return up to `size` categories whose names start with `prefix`, in name order,
+        or with `order_by_image_count` the ones with the most images first.
+        """
+        if size < 1:
+            return []
+
+        start, end = self.get_prefix_range(prefix)
+        num_matches = end - start
+        if not order_by_image_count or num_matches <= 1:
+            return self.categories[start:min(end, start + size)]
+
+        # a short prefix matches a large range, scanning all categories by rank finds `size` of them
+        # after about `size * len(self) / num_matches` entries, fewer than the range itself
+        if num_matches * num_matches <= size * len(self):
+            return heapq.nlargest(size, self.categories[start:end], key=itemgetter('image_count'))
+
+        ranked = []
+        for position in self.ranked_positions:
+            if start <= position < end:
+                ranked.append(self.categories[position])
+                if len(ranked) == size:
+                    break
+
+        return ranked
+
+
+_category_index = CategoryIndex([])
+
+
+def get_category_index() -> CategoryIndex:
+    return _category_index
+
+
+async def load_category_index():
+    """
+    Replace the index with a snapshot of the category table. Searches running meanwhile keep the previous one.
+    """
+    global _category_index
+
+    async with AsyncSession(get_engine()) as session:
+        result = await session.exec(
+            select(ImageCategory.id, ImageCategory.name, ImageCategory.image_count)
+        )
+        _category_index = CategoryIndex(list(result))
+
+
+async def refresh_category_index_periodically():
+    """
+    Pick up the categories changed through other worker processes, and the image counts used for the ranking.
+    """
+    while True:
+        await asyncio.sleep(get_settings().category_index_refresh_seconds)
+        try:
+            await load_category_index()
+        except Exception:
+            logger.exception('failed to refresh the category index')
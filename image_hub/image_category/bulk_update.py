@@ -0,0 +1,257 @@
+from collections import Counter
+
+from fastapi import HTTPException
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql.operators import in_op, is_, not_in_op
+from sqlmodel import asc, delete, func, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from image_hub.auth.dto import UserAuthDto
+from image_hub.config import get_settings
+from image_hub.database.models import ImageCategory, ImageCategoryMapping, ImageInfo
+from image_hub.image.changes import touch_images
+from image_hub.image.counters import add_category_image_counts
+from image_hub.image.query import get_accessible_image_ids, get_accessible_image_query
+from image_hub.image_category.dto import BulkCategoryUpdateDto, BulkCategoryUpdateResultDto
+
+
+BULK_UPDATE_BATCH_SIZE = 1000
+MAX_REPORTED_IMAGE_IDS = 20
+
+
+def get_target_image_query(user_auth: UserAuthDto, update_dto: BulkCategoryUpdateDto):
+    query = get_accessible_image_query(user_auth, ImageInfo.id)
+    if update_dto.image_ids is not None:
+        return query.where(in_op(ImageInfo.id, update_dto.image_ids))
+
+    image_filter = update_dto.filter
+    if image_filter.category_id is not None:
+        query = query.where(
+            in_op(
+                ImageInfo.id,
+                select(ImageCategoryMapping.image_info_id).where(
+                    ImageCategoryMapping.category_id == image_filter.category_id
+                )
+            )
+        )
+
+    if image_filter.created_after is not None:
+        query = query.where(ImageInfo.created_at >= image_filter.created_after)
+
+    if image_filter.created_before is not None:
+        query = query.where(ImageInfo.created_at < image_filter.created_before)
+
+    return query
+
+
+async def check_image_ids(session: AsyncSession, user_auth: UserAuthDto, image_ids: list[int]):
+    accessible_ids = await get_accessible_image_ids(image_ids, user_auth, session)
+    missing_ids = sorted(set(image_ids) - accessible_ids)
+    if missing_ids:
+        raise HTTPException(
+            status_code=404,
+            detail=f'You do not have access to images {missing_ids[:MAX_REPORTED_IMAGE_IDS]}, '
+                   f'or the images do not exist.'
+        )
+
+
+async def check_category_ids(session: AsyncSession, category_ids: set[int]):
+    if not category_ids:
+        return
+
+    result = await session.exec(
+        select(ImageCategory.id).where(in_op(ImageCategory.id, list(category_ids)))
+    )
+    missing_ids = sorted(category_ids - set(result))
+    if missing_ids:
+        raise HTTPException(
+            status_code=400,
+            detail=f'Some of the adding category ids({missing_ids}) do not exist!'
+        )
+
+
+async def check_category_limit(
+    session: AsyncSession,
+    target_query,
+    adding_ids: set[int],
+    deleting_ids: set[int]
+):
+    """
+    Find the target images that would exceed `max_num_categories_per_image`, with a single aggregate
+    over their kept categories. Kept categories are the current ones, minus the deleted and the re-added ones.
+    """
+    max_num_categories = get_settings().max_num_categories_per_image
+    if len(adding_ids) > max_num_categories:
+        raise HTTPException(
+            status_code=400,
+            detail=f'Adding {len(adding_ids)} categories exceeds the limit {max_num_categories}'
+        )
+
+    if not adding_ids:
+        return
+
+    result = await session.exec(
+        select(ImageCategoryMapping.image_info_id).where(
+            in_op(ImageCategoryMapping.image_info_id, target_query),
+            not_in_op(ImageCategoryMapping.category_id, list(adding_ids | deleting_ids))
+        ).group_by(
+            ImageCategoryMapping.image_info_id
+        ).having(
+            func.count() + len(adding_ids) > max_num_categories
+        ).order_by(
+            asc(ImageCategoryMapping.image_info_id)
+        ).limit(MAX_REPORTED_IMAGE_IDS)
+    )
+    exceeding_ids = list(result)
+    if exceeding_ids:
+        raise HTTPException(
+            status_code=400,
+            detail=f'Images {exceeding_ids} will have more categories than the limit {max_num_categories}'
+        )
+
+
+async def update_batch_categories(
+    session: AsyncSession,
+    image_ids: list[int],
+    adding_ids: set[int],
+    deleting_ids: set[int]
+) -> tuple[Counter, Counter]:
+    """
+    Apply the category changes to a batch of images with one INSERT and one DELETE,
+    and report the images whose categories changed to the change feed.
+    Images soft deleted since the batch was read are skipped.
+    Returns the number of added and of deleted mappings per category.
+    """
+    added_counts = Counter()
+    deleted_counts = Counter()
+    changed_image_ids = set()
+
+    # a soft delete of an image waits for this transaction, or the image is left out once it committed,
+    # so the counters it takes the image out of never move for its mappings again
+    result = await session.exec(
+        select(ImageInfo.id).where(
+            in_op(ImageInfo.id, image_ids),
+            is_(ImageInfo.deleted_at, None)
+        ).order_by(
+            asc(ImageInfo.id)
+        ).with_for_update(read=True)
+    )
+    image_ids = list(result)
+    if not image_ids:
+        return added_counts, deleted_counts
+
+    if adding_ids:
+        result = await session.exec(
+            insert(ImageCategoryMapping).from_select(
+                ['image_info_id', 'category_id'],
+                select(ImageInfo.id, ImageCategory.id).where(
+                    in_op(ImageInfo.id, image_ids),
+                    in_op(ImageCategory.id, list(adding_ids))
+                )
+            ).on_conflict_do_nothing().returning(
+                ImageCategoryMapping.image_info_id,
+                ImageCategoryMapping.category_id
+            )
+        )
+        for image_id, category_id in result:
+            changed_image_ids.add(image_id)
+            added_counts[category_id] += 1
+
+    if deleting_ids:
+        result = await session.exec(
+            delete(ImageCategoryMapping).where(
+                in_op(ImageCategoryMapping.image_info_id, image_ids),
+                in_op(ImageCategoryMapping.category_id, list(deleting_ids))
+            ).returning(
+                ImageCategoryMapping.image_info_id,
+                ImageCategoryMapping.category_id
+            ).execution_options(synchronize_session=False)
+        )
+        for image_id, category_id in result:
+            changed_image_ids.add(image_id)
+            deleted_counts[category_id] += 1
+
+    await touch_images(session, changed_image_ids)
+
+    return added_counts, deleted_counts
+
+
+async def add_category_image_count_deltas(session: AsyncSession, count_deltas: dict[int, int]):
+    category_ids_by_delta: dict[int, list[int]] = {}
+    for category_id, delta in count_deltas.items():
+        category_ids_by_delta.setdefault(delta, []).append(category_id)
+
+    for delta, category_ids in category_ids_by_delta.items():
+        await add_category_image_counts(session, category_ids, delta)
+
+
+async def update_image_categories(
+    session: AsyncSession,
+    user_auth: UserAuthDto,
+    update_dto: BulkCategoryUpdateDto
+) -> BulkCategoryUpdateResultDto:
+    """
+    Add and delete categories of many images. The request is validated as a whole first,
+    then applied in keyset batches of `BULK_UPDATE_BATCH_SIZE` images, one transaction each.
+    """
+    deleting_ids = set(update_dto.deleting_categories)
+    adding_ids = set(update_dto.adding_categories)
+
+    # ignore the ids both added and deleted, as the single image update does
+    intersecting_ids = deleting_ids & adding_ids
+    deleting_ids = deleting_ids - intersecting_ids
+    adding_ids = adding_ids - intersecting_ids
+    if not adding_ids and not deleting_ids:
+        raise HTTPException(status_code=400, detail='No categories to add or delete')
+
+    if update_dto.image_ids is not None:
+        await check_image_ids(session, user_auth, update_dto.image_ids)
+
+    await check_category_ids(session, adding_ids)
+
+    target_query = get_target_image_query(user_auth, update_dto)
+    await check_category_limit(session, target_query, adding_ids, deleting_ids)
+
+    num_images = 0
+    num_added = 0
+    num_deleted = 0
+    last_id = None
+    while True:
+        query = target_query
+        if last_id is not None:
+            query = query.where(ImageInfo.id > last_id)
+
+        result = await session.exec(
+            query.order_by(asc(ImageInfo.id)).limit(BULK_UPDATE_BATCH_SIZE)
+        )
+        image_ids = list(result)
+        if not image_ids:
+            break
+
+        added_counts, deleted_counts = await update_batch_categories(
+            session,
+            image_ids,
+            adding_ids,
+            deleting_ids
+        )
+        # adding and deleting ids are disjoint, so are the categories of the two counters
+        count_deltas = dict(added_counts)
+        count_deltas.update(
+            (category_id, -count) for category_id, count in deleted_counts.items()
+        )
+        await add_category_image_count_deltas(session, count_deltas)
+        await session.commit()
+
+        num_images += len(image_ids)
+        num_added += added_counts.total()
+        num_deleted += deleted_counts.total()
+        if len(image_ids) < BULK_UPDATE_BATCH_SIZE:
+            break
+
+        last_id = image_ids[-1]
+
+    return BulkCategoryUpdateResultDto(
+        num_images=num_images,
+        num_added=num_added,
+        num_deleted=num_deleted
+    )
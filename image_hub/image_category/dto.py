@@ -1,4 +1,6 @@
-from pydantic import BaseModel, Field
+from datetime import datetime
+
+from pydantic import BaseModel, Field, model_validator
 
 
 class CategoryUpdateDto(BaseModel):
@@ -8,7 +10,34 @@ class CategoryUpdateDto(BaseModel):
 class CategoryInfoDto(BaseModel):
     id: int
     name: str
+    image_count: int
 
 class CategoryListDto(BaseModel):
     next_search_key: str | None
     categories: list[CategoryInfoDto]
+
+
+class ImageFilterDto(BaseModel):
+    category_id: int | None = None
+    created_after: datetime | None = None
+    created_before: datetime | None = None
+
+
+class BulkCategoryUpdateDto(BaseModel):
+    image_ids: list[int] | None = Field(None, min_length=1, max_length=10000)
+    filter: ImageFilterDto | None = None
+    adding_categories: list[int] = Field(default_factory=list)
+    deleting_categories: list[int] = Field(default_factory=list)
+
+    @model_validator(mode='after')
+    def check_target(self):
+        if (self.image_ids is None) == (self.filter is None):
+            raise ValueError('exactly one of image_ids and filter must be given')
+
+        return self
+
+
+class BulkCategoryUpdateResultDto(BaseModel):
+    num_images: int
+    num_added: int
+    num_deleted: int
@@ -1,4 +1,7 @@
-import os
+import asyncio
+import mimetypes
+import time
+from contextlib import asynccontextmanager
 from typing import Annotated
 
 from fastapi import (
@@ -6,19 +9,29 @@ from fastapi import (
     HTTPException,
     FastAPI,
     Form,
+    Header,
+    Request,
     Response,
     status,
     UploadFile
 )
-from fastapi.responses import FileResponse
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlmodel import asc, desc, select, delete, or_
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.sql.operators import is_, in_op
 from sqlalchemy.orm import selectinload
 
+from image_hub.admission import (
+    AUTH_ADMISSION,
+    UPLOAD_ADMISSION,
+    admit_auth,
+    admit_upload,
+    get_admission_limiter
+)
 from image_hub.auth.auth_scheme import TokenAuthScheme
-from image_hub.auth.dto import Token, UserAuthDto, UserDto
+from image_hub.auth.dto import Token, UserAuthDto, UserDto, UserStatsDto, UserStorageDto
 from image_hub.auth.errors import AuthTokenError
 from image_hub.auth.services import (
     get_token,
@@ -27,40 +40,128 @@ from image_hub.auth.services import (
     verify_password
 )
 from image_hub.config import get_settings
-from image_hub.database.models import ImageCategory, ImageCategoryMapping, ImageInfo, User
-from image_hub.database.session import get_session
+from image_hub.dto import AdmissionMetricsDto
+from image_hub.database.models import (
+    ImageCategory,
+    ImageCategoryMapping,
+    ImageInfo,
+    UploadSession,
+    User,
+    UserStats
+)
+from image_hub.database.session import dispose_engines, get_session, mark_user_write, open_read_session
 from image_hub.image.dto import (
+    CacheMetricsDto,
     ImageDetailDto,
     ImageCreationResultDto,
-    ImageInfoDto,
+    ImageChangeListDto,
     ImageInfoListDto,
-    ImageUpdateDto
+    ImageUpdateDto,
+    SimilarImageDto,
+    SpriteDto,
+    ThumbnailBatchDto
+)
+from image_hub.image_category.autocomplete import (
+    get_category_index,
+    load_category_index,
+    refresh_category_index_periodically
+)
+from image_hub.image_category.bulk_update import update_image_categories
+from image_hub.image_category.dto import (
+    BulkCategoryUpdateDto,
+    BulkCategoryUpdateResultDto,
+    CategoryUpdateDto,
+    CategoryInfoDto,
+    CategoryListDto
 )
-from image_hub.image_category.dto import CategoryUpdateDto, CategoryInfoDto, CategoryListDto
 from image_hub.image.image_file import (
-    upload_image_files,
-    delete_image_files,
-    get_original_image_file_path,
+    compact_storage_periodically,
     get_original_image_file_url,
-    get_thumbnail_image_file_path,
+    get_original_image_key,
+    get_stored_file_response,
     get_thumbnail_image_file_url,
 )
 from image_hub.image.query import (
     check_image_access,
-    get_admin_base_image_query,
-    get_user_base_image_query
+    get_accessible_image_ids,
+    get_base_image_query,
+    get_image_list_item,
+    get_image_mime_type,
+    get_next_key
+)
+from image_hub.image.changes import get_image_changes, touch_category_images, touch_images
+from image_hub.image.counters import add_category_image_counts, check_storage_quota
+from image_hub.image.decode_pool import shutdown_decode_pool
+from image_hub.image.deletion import purge_deleted_images_periodically, restore_image, soft_delete_image
+from image_hub.image.export import stream_image_ndjson, stream_image_zip
+from image_hub.image.similarity import (
+    get_similarity_index,
+    load_similarity_index,
+    refresh_similarity_index_periodically
+)
+from image_hub.image.sprite import get_sprite, get_sprite_cache, get_sprite_url
+from image_hub.image.thumbnail_cache import get_cached_thumbnail, get_thumbnail_cache
+from image_hub.image.thumbnail_batch import create_boundary, get_batch_media_type, stream_thumbnails
+from image_hub.image.services import create_image
+from image_hub.profiling import RequestProfilingMiddleware
+from image_hub.responses import is_etag_matched, json_response
+from image_hub.upload.dto import UploadSessionCreationDto, UploadSessionDto
+from image_hub.upload.services import (
+    create_upload_id,
+    get_upload_expiry,
+    get_upload_session,
+    get_upload_session_dto,
+    purge_expired_upload_sessions_periodically
+)
+from image_hub.upload.upload_file import (
+    append_upload_chunks,
+    create_upload_file,
+    delete_upload_file,
+    get_upload_file_path,
+    lock_upload_file
 )
+from image_hub.utils import is_safe_file_name
+from image_hub.warmup import report_startup_time, warm_up
 
 
 oauth2_scheme = TokenAuthScheme()
 
 tags_metadata = [
     dict(name='auth'),
+    dict(name='user'),
     dict(name='category'),
     dict(name='image_info'),
+    dict(name='upload'),
+    dict(name='admin'),
 ]
 
-app = FastAPI(openapi_tags=tags_metadata)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started_at = time.perf_counter()
+    await warm_up()
+    await load_similarity_index()
+    await load_category_index()
+    background_tasks = [
+        asyncio.create_task(refresh_similarity_index_periodically()),
+        asyncio.create_task(refresh_category_index_periodically()),
+        asyncio.create_task(purge_expired_upload_sessions_periodically()),
+        asyncio.create_task(purge_deleted_images_periodically()),
+    ]
+    if get_settings().storage_backend == 'packed':
+        background_tasks.append(asyncio.create_task(compact_storage_periodically()))
+
+    report_startup_time(started_at)
+
+    yield
+    for task in background_tasks:
+        task.cancel()
+
+    shutdown_decode_pool()
+    await dispose_engines()
+
+
+app = FastAPI(openapi_tags=tags_metadata, lifespan=lifespan)
+app.add_middleware(RequestProfilingMiddleware)
 
 
 def get_user_auth(
@@ -88,13 +189,26 @@ def get_admin_user_id(
     return user_id
 
 
-@app.post('/signup', status_code=status.HTTP_201_CREATED, tags=['auth'])
+async def get_read_session(
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+) -> AsyncSession:
+    async with open_read_session(user_auth.user_id) as session:
+        yield session
+
+
+@app.post(
+    '/signup',
+    status_code=status.HTTP_201_CREATED,
+    tags=['auth'],
+    dependencies=[Depends(admit_auth)]
+)
 async def signup(
     user_info:UserDto,
     response: Response,
     session: AsyncSession = Depends(get_session)
 ) -> dict:
-    user = get_user_instance(user_info)
+    # bcrypt is CPU bound, keep it off the event loop
+    user = await run_in_threadpool(get_user_instance, user_info)
     session.add(user)
     try:
         await session.commit()
@@ -105,7 +219,7 @@ async def signup(
     return dict(message=f'user {user_info.user_name} is created')
 
 
-@app.post('/login', tags=['auth'])
+@app.post('/login', tags=['auth'], dependencies=[Depends(admit_auth)])
 async def login(
     user_info:UserDto,
     session: AsyncSession = Depends(get_session)
@@ -117,30 +231,149 @@ async def login(
     if not user:
         raise HTTPException(status_code=400, detail='user does not exist')
 
-    if not verify_password(user_info.password, user.password):
+    if not await run_in_threadpool(verify_password, user_info.password, user.password):
         raise HTTPException(status_code=400, detail='wrong password')
 
     return get_token(user.id, is_admin=user.is_admin)
 
 
+@app.get('/users/me/stats', tags=['user'])
+async def get_my_stats(
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_read_session)
+) -> UserStatsDto:
+    result = await session.exec(
+        select(UserStats).where(UserStats.user_id == user_auth.user_id)
+    )
+    user_stats = result.first()
+
+    return UserStatsDto(
+        user_id=user_auth.user_id,
+        image_count=user_stats.image_count if user_stats else 0,
+        storage_bytes=user_stats.storage_bytes if user_stats else 0
+    )
+
+
+@app.get('/admin/cache-metrics', tags=['admin'])
+async def get_cache_metrics(
+    admin_id: Annotated[int, Depends(get_admin_user_id)],
+) -> list[CacheMetricsDto]:
+    """
+    Metrics of the in-memory caches of the worker process serving the request.
+    """
+    caches = dict(thumbnail=get_thumbnail_cache(), sprite=get_sprite_cache())
+
+    return [
+        CacheMetricsDto(
+            name=name,
+            entries=len(cache),
+            bytes=cache.num_bytes,
+            max_bytes=cache.max_bytes,
+            hits=cache.hits,
+            misses=cache.misses,
+            hit_rate=cache.hits / (cache.hits + cache.misses) if cache.hits + cache.misses else None,
+            evictions=cache.evictions
+        )
+        for name, cache in caches.items()
+    ]
+
+
+@app.get('/admin/admission-metrics', tags=['admin'])
+async def get_admission_metrics(
+    admin_id: Annotated[int, Depends(get_admin_user_id)],
+) -> list[AdmissionMetricsDto]:
+    """
+    Concurrency and queue depth of the admission limited endpoint classes of the worker process.
+    """
+    limiters = [get_admission_limiter(name) for name in (UPLOAD_ADMISSION, AUTH_ADMISSION)]
+
+    return [
+        AdmissionMetricsDto(
+            name=limiter.name,
+            max_concurrency=limiter.max_concurrency,
+            in_flight=limiter.in_flight,
+            max_queue=limiter.max_queue,
+            waiting=limiter.waiting,
+            admitted=limiter.admitted,
+            rejected=limiter.rejected
+        )
+        for limiter in limiters
+    ]
+
+
+@app.get('/admin/storage/top-users', tags=['admin'])
+async def list_top_storage_users(
+    admin_id: Annotated[int, Depends(get_admin_user_id)],
+    session: AsyncSession = Depends(get_session),
+    size: int = 20,
+) -> list[UserStorageDto]:
+    result = await session.exec(
+        select(User.id, User.user_name, UserStats.image_count, UserStats.storage_bytes).select_from(
+            UserStats
+        ).join(
+            User, User.id == UserStats.user_id
+        ).order_by(
+            desc(UserStats.storage_bytes)
+        ).limit(size)
+    )
+
+    return [
+        UserStorageDto(
+            user_id=user_id,
+            user_name=user_name,
+            image_count=image_count,
+            storage_bytes=storage_bytes
+        )
+        for user_id, user_name, image_count, storage_bytes in result
+    ]
+
+
 @app.delete('/categories/{category_id}', tags=['category'])
 async def delete_category_by_id(
     category_id: int,
     admin_id: Annotated[int, Depends(get_admin_user_id)],
     session: AsyncSession = Depends(get_session)
 ) -> dict:
+    await touch_category_images(session, ImageCategory.id == category_id)
     await session.exec(
         delete(ImageCategory).where(ImageCategory.id == category_id)
     )
     await session.commit()
+    await mark_user_write(admin_id)
+    await load_category_index()
     return dict(message=f'Category with id {category_id} is deleted')
 
 
+@app.get('/categories/autocomplete', tags=['category'], response_model=list[CategoryInfoDto])
+async def autocomplete_category(
+    request: Request,
+    prefix: str,
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    size: int = 10,
+    order_by_image_count: bool = False,
+) -> Response:
+    """
+    Categories whose names start with `prefix`, in name order or with the most images first.
+    Served from the in-memory category index, the image counts may lag by the `category_index_refresh_seconds` setting.
+    """
+    if size < 1:
+        raise HTTPException(status_code=400, detail=f'size {size} is less than 1')
+
+    max_size = get_settings().category_autocomplete_max_size
+    if size > max_size:
+        raise HTTPException(status_code=400, detail=f'size {size} exceeds {max_size}')
+
+    return json_response(
+        request,
+        get_category_index().search(prefix.upper(), size, order_by_image_count)
+    )
+
+
 @app.get('/categories/{category_id}', tags=['category'])
 async def get_category_by_id(
     category_id: int,
     user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_read_session)
 ) -> CategoryInfoDto:
     result = await session.exec(
         select(ImageCategory).where(
@@ -153,7 +386,8 @@ async def get_category_by_id(
 
     return CategoryInfoDto(
         name=category.name,
-        id=category.id
+        id=category.id,
+        image_count=category.image_count
     )
 
 @app.delete('/categories/', tags=['category'])
@@ -163,10 +397,13 @@ async def delete_category_by_name(
     session: AsyncSession = Depends(get_session)
 ) -> dict:
     name = category.name.upper()
+    await touch_category_images(session, ImageCategory.name == name)
     await session.exec(
         delete(ImageCategory).where(ImageCategory.name == name)
     )
     await session.commit()
+    await mark_user_write(admin_id)
+    await load_category_index()
     return dict(message=f'Category {name} is deleted')
 
 
@@ -185,17 +422,21 @@ async def create_category(
         response.status_code = status.HTTP_400_BAD_REQUEST
         return dict(message=f'Category {name} already exists')
 
+    await mark_user_write(user_auth.user_id)
+    await load_category_index()
+
     return dict(message=f'Category {name} is created')
 
 
-@app.get('/categories/', tags=['category'])
+@app.get('/categories/', tags=['category'], response_model=CategoryListDto)
 async def list_category(
+    request: Request,
     user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     is_ascending: bool = True,
     search_key: str | None = None,
     size: int = 100,
-) -> CategoryListDto:
+) -> Response:
     if size > 1000:
         raise HTTPException(status_code=400, detail=f'size {size} exceeds 1000')
 
@@ -204,7 +445,7 @@ async def list_category(
     else:
         order = desc(ImageCategory.name)
 
-    query = select(ImageCategory)
+    query = select(ImageCategory.id, ImageCategory.name, ImageCategory.image_count)
 
     if search_key and is_ascending:
         query = query.where(
@@ -220,18 +461,177 @@ async def list_category(
     )
 
     categories = [
-        CategoryInfoDto(
-            name=category.name,
-            id=category.id
-        ) for category in result
+        dict(
+            name=name,
+            id=category_id,
+            image_count=image_count
+        ) for category_id, name, image_count in result
     ]
 
     if len(categories) < size:
         next_search_key = None
     else:
-        next_search_key = categories[-1].name
+        next_search_key = categories[-1]['name']
+
+    return json_response(
+        request,
+        dict(next_search_key=next_search_key, categories=categories)
+    )
+
+
+@app.get('/images/sprite', tags=['image_info'])
+async def get_image_sprite(
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_read_session),
+    next_key: str | None = None,
+    size: int = 100,
+) -> SpriteDto:
+    settings = get_settings()
+    if size > settings.sprite_max_images:
+        raise HTTPException(
+            status_code=400,
+            detail=f'size {size} exceeds {settings.sprite_max_images}'
+        )
+
+    result = await session.exec(
+        get_base_image_query(user_auth, size, next_key)
+    )
+    image_infos = list(result)
+    next_key = get_next_key(user_auth, image_infos, size)
+
+    if not image_infos:
+        return SpriteDto(sprite_url=None, width=0, height=0, tiles=[], next_key=next_key)
+
+    image_ids = [image_info.id for image_info in image_infos]
+    _, width, height, tiles = await get_sprite(image_ids)
+
+    return SpriteDto(
+        sprite_url=get_sprite_url(image_ids),
+        width=width,
+        height=height,
+        tiles=tiles,
+        next_key=next_key
+    )
+
+
+@app.get('/images/sprite.jpg', tags=['image_info'])
+async def get_image_sprite_file(
+    ids: str,
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_read_session)
+) -> Response:
+    try:
+        image_ids = [int(item) for item in ids.split(',')]
+    except ValueError:
+        raise HTTPException(
+            status_code=400,
+            detail=f'ids must be comma separated integer strings, but the received input is "{ids}"'
+        )
+
+    settings = get_settings()
+    if len(image_ids) > settings.sprite_max_images:
+        raise HTTPException(
+            status_code=400,
+            detail=f'number of ids {len(image_ids)} exceeds {settings.sprite_max_images}'
+        )
+
+    accessible_ids = await get_accessible_image_ids(image_ids, user_auth, session)
+    if len(accessible_ids) != len(set(image_ids)):
+        raise HTTPException(
+            status_code=404,
+            detail='You do not have access to some of the images, or some of the images do not exist.'
+        )
+
+    content, *_ = await get_sprite(image_ids)
+    return Response(content, media_type='image/jpeg')
+
+
+@app.post('/images/thumbnails:batch', tags=['image_info'])
+async def get_thumbnail_batch(
+    batch_dto: ThumbnailBatchDto,
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_read_session)
+) -> StreamingResponse:
+    settings = get_settings()
+    # drop duplicates, keeping the requested order
+    image_ids = list(dict.fromkeys(batch_dto.image_ids))
+    if len(image_ids) > settings.thumbnail_batch_max_images:
+        raise HTTPException(
+            status_code=400,
+            detail=f'number of image ids {len(image_ids)} exceeds {settings.thumbnail_batch_max_images}'
+        )
+
+    accessible_ids = await get_accessible_image_ids(image_ids, user_auth, session)
+
+    boundary = create_boundary()
+    return StreamingResponse(
+        stream_thumbnails(boundary, image_ids, accessible_ids),
+        media_type=get_batch_media_type(boundary)
+    )
+
+
+@app.post('/images/categories:bulk', tags=['image_info'])
+async def update_images_categories(
+    update_dto: BulkCategoryUpdateDto,
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_session)
+) -> BulkCategoryUpdateResultDto:
+    result = await update_image_categories(session, user_auth, update_dto)
+    await mark_user_write(user_auth.user_id)
+    return result
+
+
+@app.get('/images/export.zip', tags=['image_info'])
+async def export_images(
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    include_manifest: bool = False,
+) -> StreamingResponse:
+    return StreamingResponse(
+        stream_image_zip(user_auth, include_manifest),
+        media_type='application/zip',
+        headers={'Content-Disposition': 'attachment; filename="images.zip"'}
+    )
 
-    return CategoryListDto(next_search_key=next_search_key, categories=categories)
+
+@app.get('/images/export.ndjson', tags=['image_info'])
+async def export_image_infos(
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    include_categories: bool = False,
+    after_id: int | None = None,
+) -> StreamingResponse:
+    """
+    Stream every accessible image as one JSON object per line, in ascending id order.
+    An interrupted export resumes with `after_id` set to the id of the last received line.
+    """
+    return StreamingResponse(
+        stream_image_ndjson(user_auth, include_categories, after_id),
+        media_type='application/x-ndjson'
+    )
+
+
+@app.get('/images/changes', tags=['image_info'], response_model=ImageChangeListDto)
+async def list_image_changes(
+    request: Request,
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_read_session),
+    next_key: str | None = None,
+    size: int = 100,
+) -> Response:
+    """
+    Images created, updated or deleted since `next_key`, for clients keeping a local copy of the library.
+    Start without `next_key`, then call again with the returned one, while `has_more` is true
+    and later on to pick up new changes.
+    """
+    if size < 1:
+        raise HTTPException(status_code=400, detail=f'size {size} is less than 1')
+
+    if size > 1000:
+        raise HTTPException(status_code=400, detail=f'size {size} exceeds 1000')
+
+    return json_response(
+        request,
+        await get_image_changes(session, user_auth, size, next_key)
+    )
 
 
 @app.get('/images/{image_id}/file/{file_name}', tags=['image_info'])
@@ -239,30 +639,86 @@ async def get_image_file(
     image_id: int,
     file_name: str,
     user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
-    session: AsyncSession = Depends(get_session)
-) -> FileResponse:
-    await check_image_access(image_id, user_auth, session)
-
-    file_path = get_original_image_file_path(image_id, file_name)
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
+    session: AsyncSession = Depends(get_read_session)
+) -> Response:
+    mime_type = await get_image_mime_type(image_id, user_auth, session)
 
-    return FileResponse(file_path, media_type='image/png')
+    return await get_stored_file_response(
+        get_original_image_key(image_id, file_name),
+        media_type=mime_type or mimetypes.guess_type(file_name)[0] or 'application/octet-stream'
+    )
 
 
 @app.get('/images/{image_id}/thumbnail/thumbnail.jpg', tags=['image_info'])
 async def get_thumbnail_image_file(
     image_id: int,
+    request: Request,
     user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
-    session: AsyncSession = Depends(get_session)
-) -> FileResponse:
+    session: AsyncSession = Depends(get_read_session)
+) -> Response:
     await check_image_access(image_id, user_auth, session)
 
-    file_path = get_thumbnail_image_file_path(image_id)
-    if not os.path.exists(file_path):
+    thumbnail = await get_cached_thumbnail(image_id)
+    if thumbnail is None:
         raise HTTPException(status_code=404, detail="File not found")
 
-    return FileResponse(file_path, media_type='image/png')
+    if is_etag_matched(request, thumbnail.etag):
+        return Response(status_code=304, headers={'ETag': thumbnail.etag})
+
+    return Response(thumbnail.content, media_type='image/jpeg', headers=thumbnail.headers)
+
+
+@app.get('/images/{image_id}/similar', tags=['image_info'])
+async def list_similar_images(
+    image_id: int,
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_read_session),
+    max_distance: int = 8,
+    size: int = 20,
+) -> list[SimilarImageDto]:
+    settings = get_settings()
+    if max_distance > settings.similarity_max_distance:
+        raise HTTPException(
+            status_code=400,
+            detail=f'max_distance {max_distance} exceeds {settings.similarity_max_distance}'
+        )
+
+    await check_image_access(image_id, user_auth, session)
+
+    index = get_similarity_index()
+    image_hash = index.hashes.get(image_id)
+    if image_hash is None:
+        result = await session.exec(
+            select(ImageInfo.perceptual_hash).where(ImageInfo.id == image_id)
+        )
+        image_hash = result.one_or_none()
+
+    if image_hash is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f'Perceptual hash of image {image_id} is not computed yet'
+        )
+
+    matches = [
+        (match_id, distance)
+        for match_id, distance in index.search(image_hash, max_distance)
+        if match_id != image_id
+    ][:settings.similarity_max_candidates]
+    accessible_ids = await get_accessible_image_ids(
+        [match_id for match_id, _ in matches],
+        user_auth,
+        session
+    )
+
+    return [
+        SimilarImageDto(
+            id=match_id,
+            distance=distance,
+            thumbnail_url=get_thumbnail_image_file_url(match_id)
+        )
+        for match_id, distance in matches
+        if match_id in accessible_ids
+    ][:size]
 
 
 @app.delete('/images/{image_id}', tags=['image_info'])
@@ -271,25 +727,35 @@ async def delete_image(
     user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
     session: AsyncSession = Depends(get_session)
 ) -> dict[str, str]:
-    await check_image_access(image_id, user_auth, session)
-
-    delete_image_files(image_id)
-    await session.exec(
-        delete(ImageInfo).where(ImageInfo.id == image_id)
-    )
-    await session.commit()
+    await soft_delete_image(session, user_auth, image_id)
+    await mark_user_write(user_auth.user_id)
     return dict(message=f'Image id {image_id} is deleted')
 
 
+@app.post('/images/{image_id}/restore', tags=['image_info'])
+async def restore_deleted_image(
+    image_id: int,
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_session)
+) -> dict[str, str]:
+    """
+    Undo the delete of an image, until it is purged after the `image_delete_retention_seconds` setting.
+    """
+    await restore_image(session, user_auth, image_id)
+    await mark_user_write(user_auth.user_id)
+    return dict(message=f'Image id {image_id} is restored')
+
+
 @app.get('/images/{image_id}', tags=['image_info'])
 async def get_image_info(
     image_id: int,
     user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
-    session: AsyncSession = Depends(get_session)
+    session: AsyncSession = Depends(get_read_session)
 ) -> ImageDetailDto:
     if user_auth.is_admin:
         query = select(ImageInfo).options(selectinload(ImageInfo.categories)).where(
-            ImageInfo.id == image_id
+            ImageInfo.id == image_id,
+            is_(ImageInfo.deleted_at, None)
         ).where(
             or_(
                 ImageInfo.uploader_admin_id == user_auth.user_id,
@@ -298,7 +764,8 @@ async def get_image_info(
         ).options(selectinload(ImageInfo.categories))
     else:
         query = select(ImageInfo).options(selectinload(ImageInfo.categories)).where(
-            ImageInfo.id == image_id
+            ImageInfo.id == image_id,
+            is_(ImageInfo.deleted_at, None)
         ).where(
             ImageInfo.uploader_id == user_auth.user_id
         )
@@ -320,10 +787,17 @@ async def get_image_info(
         description=image_info.description,
         uploader_id=image_info.uploader_id or image_info.uploader_admin_id,
         created_at=image_info.created_at.isoformat(),
+        width=image_info.width,
+        height=image_info.height,
+        image_format=image_info.image_format,
+        mime_type=image_info.mime_type,
+        byte_size=image_info.byte_size,
+        taken_at=image_info.taken_at.isoformat() if image_info.taken_at else None,
         categories=[
             CategoryInfoDto(
                 name=category.name,
-                id=category.id
+                id=category.id,
+                image_count=category.image_count
             ) for category in image_info.categories
         ]
     )
@@ -338,7 +812,8 @@ async def update_image_info(
 ) -> dict[str, str]:
     if user_auth.is_admin:
         query = select(ImageInfo).options(selectinload(ImageInfo.categories)).where(
-            ImageInfo.id == image_id
+            ImageInfo.id == image_id,
+            is_(ImageInfo.deleted_at, None)
         ).where(
             or_(
                 ImageInfo.uploader_admin_id == user_auth.user_id,
@@ -347,7 +822,8 @@ async def update_image_info(
         ).options(selectinload(ImageInfo.categories))
     else:
         query = select(ImageInfo).options(selectinload(ImageInfo.categories)).where(
-            ImageInfo.id == image_id
+            ImageInfo.id == image_id,
+            is_(ImageInfo.deleted_at, None)
         ).where(
             ImageInfo.uploader_id == user_auth.user_id
         )
@@ -408,6 +884,11 @@ async def update_image_info(
             )
         )
 
+    await add_category_image_counts(session, deleting_ids, -1)
+    await add_category_image_counts(session, adding_ids, 1)
+    if deleting_ids or adding_ids:
+        await touch_images(session, [image_info.id])
+
     try:
         await session.commit()
     except IntegrityError as error:
@@ -418,57 +899,36 @@ async def update_image_info(
             )
 
     await session.commit()
+    await mark_user_write(user_auth.user_id)
 
     return dict(message=f'image {image_id} updated')
 
 
-@app.get('/images/', tags=['image_info'])
+@app.get('/images/', tags=['image_info'], response_model=ImageInfoListDto)
 async def list_images(
+    request: Request,
     user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
-    session: AsyncSession = Depends(get_session),
+    session: AsyncSession = Depends(get_read_session),
     next_key: str | None = None,
     size: int = 100,
-):
-    if user_auth.is_admin:
-        base_query = get_admin_base_image_query(user_auth.user_id, next_key)
-    else:
-        base_query = get_user_base_image_query(user_auth.user_id, next_key)
-
+) -> Response:
     result = await session.exec(
-        base_query.limit(size)
+        get_base_image_query(user_auth, size, next_key)
     )
+    image_rows = list(result)
 
-    images = [
-        ImageInfoDto(
-            id=image_info.id,
-            file_name=image_info.file_name,
-            image_url=get_original_image_file_url(image_info.id, image_info.file_name),
-            thumbnail_url=get_thumbnail_image_file_url(image_info.id),
-            description=image_info.description,
-            uploader_id=image_info.uploader_id or image_info.uploader_admin_id,
-            created_at=image_info.created_at.isoformat()
-        )
-        for image_info in result
-    ]
-
-    if len(images) < size:
-        next_key = None
-    elif user_auth.is_admin:
-        if images[-1].uploader_id == user_auth.user_id:
-            next_key = f'a-{images[-1].id}'
-        else:
-            next_key = f'-{images[-1].id}'
-
-    else:
-        next_key = str(images[-1].id)
+    images = [get_image_list_item(image_row) for image_row in image_rows]
 
-    return ImageInfoListDto(
-        images=images,
-        next_key=next_key
+    return json_response(
+        request,
+        dict(
+            images=images,
+            next_key=get_next_key(user_auth, image_rows, size)
+        )
     )
 
 
-@app.post('/images/', tags=['image_info'])
+@app.post('/images/', tags=['image_info'], dependencies=[Depends(admit_upload)])
 async def upload_image(
     user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
     image: UploadFile,
@@ -495,6 +955,12 @@ async def upload_image(
                    f'but {len(category_ids)} categories are received: {category_ids} '
         )
 
+    if not is_safe_file_name(image.filename or ''):
+        raise HTTPException(
+            status_code=400,
+            detail=f'File name "{image.filename}" must be a file name without directories'
+        )
+
     settings = get_settings()
     if image.size > settings.image_file_size_limit_mb * 1024 * 1024:
         raise HTTPException(
@@ -502,52 +968,154 @@ async def upload_image(
             detail=f'Image exceeds size limit of {settings.image_file_size_limit_mb}MB'
         )
 
-    if user_auth.is_admin:
-        uploader_id = None
-        uploader_admin_id = user_auth.user_id
-    else:
-        uploader_id = user_auth.user_id
-        uploader_admin_id = None
-
-    image_info = ImageInfo(
-        file_name=image.filename,
-        description=description,
-        uploader_id=uploader_id,
-        uploader_admin_id=uploader_admin_id
+    return await create_image(
+        session,
+        user_auth,
+        image.filename,
+        await image.read(),
+        category_ids,
+        description
     )
-    session.add(image_info)
 
-    await session.flush()
 
-    image_id = image_info.id
-    for category_id in category_ids:
-        session.add(
-            ImageCategoryMapping(
-                category_id=category_id,
-                image_info_id=image_info.id
-            )
+@app.post('/uploads/', status_code=status.HTTP_201_CREATED, tags=['upload'])
+async def create_upload(
+    upload_info: UploadSessionCreationDto,
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_session)
+) -> UploadSessionDto:
+    settings = get_settings()
+    if upload_info.size > settings.resumable_upload_size_limit_mb * 1024 * 1024:
+        raise HTTPException(
+            status_code=413,
+            detail=f'Image exceeds size limit of {settings.resumable_upload_size_limit_mb}MB'
         )
 
-    try:
-        await upload_image_files(image_id, image)
-    except Exception as error:
-        raise HTTPException(status_code=500, detail=str(error))
+    # checked again at the finalization, with the usage of that time
+    await check_storage_quota(session, user_auth, upload_info.size)
+
+    upload_session = UploadSession(
+        id=create_upload_id(),
+        user_id=user_auth.user_id,
+        file_name=upload_info.file_name,
+        description=upload_info.description,
+        category_ids=sorted(set(upload_info.categories)),
+        size=upload_info.size,
+        expires_at=get_upload_expiry()
+    )
+    await run_in_threadpool(create_upload_file, upload_session.id)
+    session.add(upload_session)
+    upload_session_dto = get_upload_session_dto(upload_session)
+    await session.commit()
+
+    return upload_session_dto
+
+
+@app.get('/uploads/{upload_id}', tags=['upload'])
+async def get_upload(
+    upload_id: str,
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_session)
+) -> UploadSessionDto:
+    upload_session = await get_upload_session(upload_id, user_auth.user_id, session)
+    return get_upload_session_dto(upload_session)
+
+
+@app.patch('/uploads/{upload_id}', tags=['upload'])
+async def append_upload(
+    upload_id: str,
+    request: Request,
+    upload_offset: Annotated[int, Header(ge=0)],
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_session)
+) -> UploadSessionDto:
+    """
+    Append the raw request body to the upload at the `Upload-Offset` header,
+    which must be the current offset of the upload.
+
+    Appends of an upload are serialized by the lock of its file, the row is only read and updated
+    in short transactions around the transfer, a slow client does not hold a database connection.
+    """
+    async with lock_upload_file(upload_id):
+        upload_session = await get_upload_session(upload_id, user_auth.user_id, session)
+        received_size = upload_session.received_size
+        size = upload_session.size
+        if upload_offset != received_size:
+            content_length = request.headers.get('content-length')
+            if (
+                upload_offset < received_size
+                and content_length is not None
+                and upload_offset + int(content_length) <= received_size
+            ):
+                # a retry of a chunk that is already stored
+                return get_upload_session_dto(upload_session)
+
+            raise HTTPException(
+                status_code=409,
+                detail=f'Upload offset is {received_size}, but the chunk starts at {upload_offset}'
+            )
 
-    try:
         await session.commit()
-    except IntegrityError as error:
-        delete_image_files(image_id)
-        if 'is not present in table "image_category"' in str(error):
+
+        received_size = await append_upload_chunks(upload_id, received_size, size, request.stream())
+
+        # the upload may have been deleted or expired meanwhile
+        upload_session = await get_upload_session(upload_id, user_auth.user_id, session)
+        upload_session.received_size = received_size
+        upload_session.expires_at = get_upload_expiry()
+        upload_session_dto = get_upload_session_dto(upload_session)
+        await session.commit()
+
+    return upload_session_dto
+
+
+@app.post('/uploads/{upload_id}/finalize', tags=['upload'], dependencies=[Depends(admit_upload)])
+async def finalize_upload(
+    upload_id: str,
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_session)
+) -> ImageCreationResultDto:
+    """
+    Create the image from the received file. The file is decoded by a worker and stored from its path,
+    it is never read into memory as a whole.
+    """
+    async with lock_upload_file(upload_id):
+        upload_session = await get_upload_session(upload_id, user_auth.user_id, session, for_update=True)
+        if upload_session.received_size != upload_session.size:
             raise HTTPException(
-                status_code=400,
-                detail=f'Some of the input category ids({category_ids}) do not exist!'
+                status_code=409,
+                detail=f'Upload is incomplete, {upload_session.received_size} of {upload_session.size} bytes are received'
             )
 
-    return ImageCreationResultDto(
-        id=image_id,
-        file_name=image.filename,
-        description=description,
-        image_url=get_original_image_file_url(image_id, image.filename),
-        thumbnail_url=get_thumbnail_image_file_url(image_id),
-        categories=category_ids,
-    )
+        file_name = upload_session.file_name
+        category_ids = list(upload_session.category_ids)
+        description = upload_session.description
+
+        # deleted in the transaction of the image, so a failed finalization can be retried
+        await session.delete(upload_session)
+        image_creation_result = await create_image(
+            session,
+            user_auth,
+            file_name,
+            get_upload_file_path(upload_id),
+            category_ids,
+            description
+        )
+
+    await run_in_threadpool(delete_upload_file, upload_id)
+
+    return image_creation_result
+
+
+@app.delete('/uploads/{upload_id}', tags=['upload'])
+async def delete_upload(
+    upload_id: str,
+    user_auth: Annotated[UserAuthDto, Depends(get_user_auth)],
+    session: AsyncSession = Depends(get_session)
+) -> dict[str, str]:
+    upload_session = await get_upload_session(upload_id, user_auth.user_id, session, for_update=True)
+    await session.delete(upload_session)
+    await session.commit()
+    await run_in_threadpool(delete_upload_file, upload_id)
+
+    return dict(message=f'Upload {upload_id} is deleted')
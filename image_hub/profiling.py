@@ -0,0 +1,178 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import random
+import re
+import time
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from image_hub.auth.errors import AuthTokenError
+from image_hub.auth.services import get_user_id_and_is_admin_from_token
+from image_hub.config import get_settings
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'x-profile'
+
+# ASGI scope of the request being handled, the router adds the matched route to it
+_request_scope: ContextVar[Scope | None] = ContextVar('request_scope', default=None)
+# cProfile can only run one profiler at a time
+_profiling_in_progress = False
+_requests_in_flight = 0
+
+
+def get_current_route() -> str | None:
+    """
+    Return the method and the route path of the request being handled, or its raw path
+    before it is routed. None outside of a request.
+    """
+    scope = _request_scope.get()
+    if scope is None:
+        return None
+
+    route = scope.get('route')
+    path = getattr(route, 'path', None) or scope['path']
+    return f'{scope["method"]} {path}'
+
+
+def get_requests_in_flight() -> int:
+    """
+    Number of requests being handled by this worker, background jobs yield to them.
+    """
+    return _requests_in_flight
+
+
+def is_admin_profile_requested(headers: Headers) -> bool:
+    if headers.get(PROFILE_HEADER) != '1':
+        return False
+
+    token_type, _, token = headers.get('authorization', '').partition(' ')
+    if token_type != 'Bearer':
+        return False
+
+    try:
+        _, is_admin = get_user_id_and_is_admin_from_token(token)
+    except AuthTokenError:
+        return False
+
+    return bool(is_admin)
+
+
+def should_profile(scope: Scope) -> bool:
+    settings = get_settings()
+    if settings.profile_directory is None or _profiling_in_progress:
+        return False
+
+    if random.random() < settings.profile_sample_rate:
+        return True
+
+    return is_admin_profile_requested(Headers(scope=scope))
+
+
+def get_profile_file_prefix(route: str, status_code: int | None, elapsed: float) -> str:
+    created_at = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    route_name = re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_')
+    return f'{created_at}-{route_name}-{status_code}-{elapsed * 1000:.0f}ms'
+
+
+def write_profile(profiler: cProfile.Profile, file_prefix: str) -> str:
+    """
+    Write the raw stats of `profiler`, loadable with `pstats` or snakeviz,
+    and a text summary of the top functions by cumulative and by own time.
+    """
+    settings = get_settings()
+    os.makedirs(settings.profile_directory, exist_ok=True)
+    path = os.path.join(settings.profile_directory, file_prefix)
+
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(f'{path}.prof')
+
+    summary = io.StringIO()
+    stats.stream = summary
+    for sort_key in (pstats.SortKey.CUMULATIVE, pstats.SortKey.TIME):
+        stats.sort_stats(sort_key).print_stats(settings.profile_top_n)
+
+    with open(f'{path}.txt', 'w') as summary_file:
+        summary_file.write(summary.getvalue())
+
+    return path
+
+
+class RequestProfilingMiddleware:
+    """
+    Keep the request being handled in a context variable, for `get_current_route`,
+    count the requests in flight, and profile the requests opted in by the `profile_sample_rate` setting,
+    or by an admin sending the `X-Profile: 1` header.
+
+    Profiling is off unless the `profile_directory` setting is set. A profile covers the request
+    until its response body is sent, and is written to that directory as a `.prof` file
+    with a `.txt` summary of the top `profile_top_n` functions.
+    The profiler sees everything run on the event loop meanwhile, including other requests,
+    but not the work handed to the thread pool.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        global _requests_in_flight
+
+        token = _request_scope.set(scope)
+        _requests_in_flight += 1
+        try:
+            if should_profile(scope):
+                await self.profile(scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            _requests_in_flight -= 1
+            _request_scope.reset(token)
+
+    async def profile(self, scope: Scope, receive: Receive, send: Send):
+        global _profiling_in_progress
+
+        status_code = None
+
+        async def send_with_status(message: Message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+
+            await send(message)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is already active in this process
+            await self.app(scope, receive, send)
+            return
+
+        _profiling_in_progress = True
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            profiler.disable()
+            _profiling_in_progress = False
+
+        elapsed = time.perf_counter() - started_at
+        route = get_current_route()
+        path = await run_in_threadpool(
+            write_profile,
+            profiler,
+            get_profile_file_prefix(route, status_code, elapsed)
+        )
+        logger.info('profiled %s in %.1fms: %s.prof', route, elapsed * 1000, path)
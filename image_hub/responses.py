@@ -0,0 +1,82 @@
+import gzip
+import json
+from typing import Any
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from image_hub.config import get_settings
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def dumps_json(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+
+    return json.dumps(content, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def get_accepted_encodings(request: Request) -> set[str]:
+    return {
+        encoding.split(';')[0].strip()
+        for encoding in request.headers.get('accept-encoding', '').split(',')
+    }
+
+
+def compress_body(request: Request, body: bytes) -> tuple[bytes, str | None]:
+    settings = get_settings()
+    if len(body) < settings.response_compression_min_bytes:
+        return body, None
+
+    accepted_encodings = get_accepted_encodings(request)
+    if brotli is not None and 'br' in accepted_encodings:
+        return brotli.compress(body, quality=4), 'br'
+
+    if 'gzip' in accepted_encodings:
+        return gzip.compress(body, compresslevel=5), 'gzip'
+
+    return body, None
+
+
+def json_response(request: Request, content: Any, status_code: int = 200) -> Response:
+    """
+    Serialize plain python data straight to a JSON response,
+    skipping the pydantic validation and serialization done for a returned model.
+    Bodies above the `response_compression_min_bytes` setting are compressed
+    when the client accepts it.
+    """
+    body, content_encoding = compress_body(request, dumps_json(content))
+
+    headers = {'Vary': 'Accept-Encoding'}
+    if content_encoding:
+        headers['Content-Encoding'] = content_encoding
+
+    return Response(
+        body,
+        status_code=status_code,
+        media_type='application/json',
+        headers=headers
+    )
+
+
+def is_etag_matched(request: Request, etag: str) -> bool:
+    """
+    Whether the `If-None-Match` header of the request matches `etag`, so 304 can be returned.
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+
+    return any(
+        tag.strip().removeprefix('W/') in (etag, '*')
+        for tag in if_none_match.split(',')
+    )
@@ -0,0 +1,53 @@
+import argparse
+import copy
+import os
+import time
+
+import uvicorn
+from uvicorn.config import LOGGING_CONFIG
+
+from image_hub.config import get_settings
+from image_hub.warmup import SERVE_STARTED_AT_ENV
+
+
+def get_log_config() -> dict:
+    log_config = copy.deepcopy(LOGGING_CONFIG)
+    log_config['loggers']['image_hub'] = dict(handlers=['default'], level='INFO', propagate=False)
+    return log_config
+
+
+def serve():
+    """
+    Run the app in worker processes sized to the available cores.
+
+    Each worker warms up in the lifespan of the app before it accepts connections.
+    On SIGTERM or SIGINT the workers stop accepting, finish the requests in flight
+    for up to the `shutdown_grace_seconds` setting, then shut down.
+    """
+    settings = get_settings()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=settings.serve_workers or os.process_cpu_count() or 1
+    )
+    args = parser.parse_args()
+
+    os.environ[SERVE_STARTED_AT_ENV] = str(time.time())
+    # the workers split the decode processes by the worker count, also when it is given by `--workers`
+    os.environ['HUB_SERVE_WORKERS'] = str(args.workers)
+    uvicorn.run(
+        'image_hub.main:app',
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=settings.shutdown_grace_seconds,
+        log_config=get_log_config(),
+    )
+
+
+if __name__ == '__main__':
+    serve()
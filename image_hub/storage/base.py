@@ -0,0 +1,62 @@
+from abc import ABC, abstractmethod
+from typing import Iterator
+
+
+DEFAULT_STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class StorageBackend(ABC):
+    """
+    Blob storage for the image files, addressed by `/` separated keys such as `12/thumbnail/thumbnail.jpg`.
+
+    Methods do blocking I/O. Call them from a threadpool, or a process, when on the event loop.
+    """
+
+    @abstractmethod
+    def put(self, key: str, data: bytes):
+        """Store `data` under `key`, atomically replacing the previous value."""
+
+    @abstractmethod
+    def put_file(self, key: str, path: str):
+        """
+        Store the content of the file at `path` under `key` without reading it into memory as a whole,
+        atomically replacing the previous value. The file at `path` is left in place.
+        """
+
+    @abstractmethod
+    def get(self, key: str) -> bytes:
+        """Return the value of `key`, raising `FileNotFoundError` when it does not exist."""
+
+    @abstractmethod
+    def stream(self, key: str, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        """Yield the value of `key` in chunks, raising `FileNotFoundError` when it does not exist."""
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Delete `key`. Deleting a missing key is not an error."""
+
+    @abstractmethod
+    def delete_prefix(self, prefix: str):
+        """Delete every key starting with `prefix`, which must end with `/`."""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def size(self, key: str) -> int:
+        """Return the byte size of `key`, raising `FileNotFoundError` when it does not exist."""
+
+    @abstractmethod
+    def iterate_directories(self) -> Iterator[str]:
+        """Yield the first segment of the stored keys, once each and in no particular order."""
+
+    def local_path(self, key: str) -> str | None:
+        """
+        Path of the regular file holding exactly the value of `key`, if the backend stores it that way.
+        The file may not exist. Lets callers hand the file to `sendfile` or to libraries expecting a path.
+        """
+        return None
+
+    def compact(self):
+        """Reclaim the space of deleted values, for backends that need it."""
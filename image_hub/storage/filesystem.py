@@ -0,0 +1,88 @@
+import os
+import shutil
+import threading
+from typing import Iterator
+
+from image_hub.storage.base import DEFAULT_STREAM_CHUNK_SIZE, StorageBackend
+from image_hub.utils import delete_directory
+
+
+def read_chunks(file, chunk_size: int) -> Iterator[bytes]:
+    with file:
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+
+class FileSystemStorage(StorageBackend):
+    """
+    One regular file per key, keys are paths relative to `root`.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split('/'))
+
+    def put(self, key: str, data: bytes):
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # write next to the target and rename, so readers never see a partial file
+        temp_path = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+        with open(temp_path, 'wb') as temp_file:
+            temp_file.write(data)
+
+        os.replace(temp_path, path)
+
+    def put_file(self, key: str, path: str):
+        target_path = self._get_path(key)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+
+        temp_path = f'{target_path}.tmp-{os.getpid()}-{threading.get_ident()}'
+        try:
+            # a hard link shares the data without copying it, when both paths are on the same file system
+            os.link(path, temp_path)
+        except OSError:
+            shutil.copyfile(path, temp_path)
+
+        os.replace(temp_path, target_path)
+
+    def get(self, key: str) -> bytes:
+        with open(self._get_path(key), 'rb') as file:
+            return file.read()
+
+    def stream(self, key: str, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        # opened before the generator starts, so a missing key fails on the call
+        file = open(self._get_path(key), 'rb')
+        return read_chunks(file, chunk_size)
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._get_path(key))
+        except FileNotFoundError:
+            pass
+
+    def delete_prefix(self, prefix: str):
+        delete_directory(self._get_path(prefix.rstrip('/')))
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self._get_path(key))
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self._get_path(key))
+
+    def iterate_directories(self) -> Iterator[str]:
+        try:
+            entries = os.scandir(self.root)
+        except FileNotFoundError:
+            return
+
+        with entries:
+            for entry in entries:
+                # dot directories hold the data of the backends and the uploads, not keys
+                if not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False):
+                    yield entry.name
+
+    def local_path(self, key: str) -> str | None:
+        return self._get_path(key)
@@ -0,0 +1,395 @@
+import fcntl
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Iterator
+
+from image_hub.storage.base import DEFAULT_STREAM_CHUNK_SIZE, StorageBackend
+from image_hub.storage.filesystem import FileSystemStorage
+
+
+logger = logging.getLogger(__name__)
+
+PACK_DIRECTORY_NAME = '.packs'
+INDEX_FILE_NAME = 'index.jsonl'
+LOCK_FILE_NAME = 'lock'
+PACK_FILE_PATTERN = re.compile(r'^pack-(\d+)\.dat$')
+
+RECORD_MAGIC = b'IHP1'
+# magic, key length, data length, crc32 of the data
+RECORD_HEADER = struct.Struct('<4sHII')
+
+
+class PackEntry:
+    __slots__ = ('pack_number', 'offset', 'length')
+
+    def __init__(self, pack_number: int, offset: int, length: int):
+        self.pack_number = pack_number
+        self.offset = offset
+        self.length = length
+
+
+class PackedStorage(StorageBackend):
+    """
+    Values up to `small_file_limit` bytes are appended to shared pack files instead of
+    getting a file each. Larger values are delegated to a `FileSystemStorage` on the same root.
+
+    Each record of a pack file is a header, the key and the value. The location of the live
+    records is kept in an append-only JSON lines index, which every process tails to see
+    the writes of the others. Writers serialize on an exclusive `flock`. Values are read
+    through read-only memory maps of the pack files.
+
+    Deletes only append to the index. `compact` copies the live records out of packs
+    with too many dead bytes, removes those packs and rewrites the index.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        small_file_limit: int,
+        max_pack_size: int,
+        compaction_dead_ratio: float = 0.5
+    ):
+        self.files = FileSystemStorage(root)
+        self.small_file_limit = small_file_limit
+        self.max_pack_size = max_pack_size
+        self.compaction_dead_ratio = compaction_dead_ratio
+        self.pack_directory = os.path.join(root, PACK_DIRECTORY_NAME)
+        os.makedirs(self.pack_directory, exist_ok=True)
+
+        self._index_path = os.path.join(self.pack_directory, INDEX_FILE_NAME)
+        self._lock_path = os.path.join(self.pack_directory, LOCK_FILE_NAME)
+        self._thread_lock = threading.RLock()
+
+        self._index: dict[str, PackEntry] = {}
+        # first key segment, which is the image id -> keys, for `delete_prefix`
+        self._keys_by_directory: dict[str, set[str]] = {}
+        self._live_bytes: dict[int, int] = {}
+        self._index_inode: int | None = None
+        self._index_offset = 0
+        # pack number -> inode of the mapped file and its map
+        self._maps: dict[int, tuple[int, mmap.mmap]] = {}
+
+    # index
+
+    def _reset_index(self):
+        self._index.clear()
+        self._keys_by_directory.clear()
+        self._live_bytes.clear()
+        self._index_offset = 0
+
+    def _apply_index_entry(self, entry: dict):
+        key = entry['key']
+        previous = self._index.pop(key, None)
+        if previous is not None:
+            self._live_bytes[previous.pack_number] -= previous.length
+
+        directory = key.split('/', 1)[0]
+        if entry.get('deleted'):
+            keys = self._keys_by_directory.get(directory)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_directory[directory]
+            return
+
+        pack_entry = PackEntry(entry['pack'], entry['offset'], entry['length'])
+        self._index[key] = pack_entry
+        self._keys_by_directory.setdefault(directory, set()).add(key)
+        self._live_bytes[pack_entry.pack_number] = (
+            self._live_bytes.get(pack_entry.pack_number, 0) + pack_entry.length
+        )
+
+    def _refresh_index(self):
+        """
+        Apply the index lines appended since the last refresh, by this or other processes.
+        """
+        with self._thread_lock:
+            try:
+                index_file = open(self._index_path, 'rb')
+            except FileNotFoundError:
+                self._reset_index()
+                self._index_inode = None
+                return
+
+            with index_file:
+                # the size is taken from the open file, a compaction may replace the index path meanwhile
+                index_stat = os.fstat(index_file.fileno())
+                rewritten = index_stat.st_ino != self._index_inode
+                if rewritten:
+                    self._reset_index()
+                    self._index_inode = index_stat.st_ino
+
+                if index_stat.st_size <= self._index_offset:
+                    return
+
+                index_file.seek(self._index_offset)
+                data = index_file.read(index_stat.st_size - self._index_offset)
+
+            # a line being written by another process is picked up on the next refresh
+            complete_size = data.rfind(b'\n') + 1
+            for line in data[:complete_size].splitlines():
+                if line:
+                    self._apply_index_entry(json.loads(line))
+
+            self._index_offset += complete_size
+            if rewritten:
+                self._close_unused_maps()
+
+    def _append_index_entries(self, entries: list[dict]):
+        lines = b''.join(
+            json.dumps(entry, ensure_ascii=False).encode('utf-8') + b'\n'
+            for entry in entries
+        )
+        with open(self._index_path, 'ab') as index_file:
+            index_file.write(lines)
+
+        self._refresh_index()
+
+    @contextmanager
+    def _write_lock(self):
+        with self._thread_lock, open(self._lock_path, 'wb') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._refresh_index()
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _lookup(self, key: str) -> PackEntry | None:
+        self._refresh_index()
+        return self._index.get(key)
+
+    # pack files
+
+    def _get_pack_path(self, pack_number: int) -> str:
+        return os.path.join(self.pack_directory, f'pack-{pack_number:06d}.dat')
+
+    def _get_pack_numbers(self) -> list[int]:
+        pack_numbers = []
+        for file_name in os.listdir(self.pack_directory):
+            match = PACK_FILE_PATTERN.match(file_name)
+            if match:
+                pack_numbers.append(int(match.group(1)))
+
+        return sorted(pack_numbers)
+
+    def _get_active_pack_number(self, pack_numbers: list[int] | None = None) -> int:
+        pack_numbers = pack_numbers if pack_numbers is not None else self._get_pack_numbers()
+        if not pack_numbers:
+            return 1
+
+        last_pack_number = pack_numbers[-1]
+        if os.path.getsize(self._get_pack_path(last_pack_number)) >= self.max_pack_size:
+            return last_pack_number + 1
+
+        return last_pack_number
+
+    def _append_record(self, key: str, data: bytes) -> dict:
+        """
+        Append a record to the active pack, the write lock must be held.
+        """
+        pack_number = self._get_active_pack_number()
+        key_bytes = key.encode('utf-8')
+        header = RECORD_HEADER.pack(RECORD_MAGIC, len(key_bytes), len(data), zlib.crc32(data))
+
+        with open(self._get_pack_path(pack_number), 'ab') as pack_file:
+            record_offset = pack_file.tell()
+            pack_file.write(header + key_bytes + data)
+
+        return dict(
+            key=key,
+            pack=pack_number,
+            offset=record_offset + RECORD_HEADER.size + len(key_bytes),
+            length=len(data)
+        )
+
+    def _get_map(self, pack_number: int, end: int) -> mmap.mmap:
+        with self._thread_lock:
+            pack_path = self._get_pack_path(pack_number)
+            inode, old_map = self._maps.get(pack_number, (None, None))
+            # a map of a removed file with the same number must never be read
+            if old_map is not None and os.stat(pack_path).st_ino == inode and len(old_map) >= end:
+                return old_map
+
+            # the pack grew, or is another file, since it was mapped.
+            # Reads copy under the lock so the old map can be closed
+            with open(pack_path, 'rb') as pack_file:
+                inode = os.fstat(pack_file.fileno()).st_ino
+                pack_map = mmap.mmap(pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+            if old_map is not None:
+                old_map.close()
+
+            self._maps[pack_number] = (inode, pack_map)
+            return pack_map
+
+    def _close_unused_maps(self):
+        """
+        Close the maps of the packs without live records, e.g. removed by a compaction in any process,
+        so their disk space is given back.
+        """
+        for pack_number in [pack_number for pack_number in self._maps if pack_number not in self._live_bytes]:
+            self._maps.pop(pack_number)[1].close()
+
+    def _read_entry(self, entry: PackEntry) -> bytes:
+        # copied under the lock, a refresh in another thread may close the map
+        with self._thread_lock:
+            pack_map = self._get_map(entry.pack_number, entry.offset + entry.length)
+            return pack_map[entry.offset:entry.offset + entry.length]
+
+    # StorageBackend
+
+    def put(self, key: str, data: bytes):
+        if len(data) > self.small_file_limit:
+            self.files.put(key, data)
+            if self._lookup(key) is not None:
+                with self._write_lock():
+                    self._append_index_entries([dict(key=key, deleted=True)])
+            return
+
+        with self._write_lock():
+            self._append_index_entries([self._append_record(key, data)])
+
+        self.files.delete(key)
+
+    def put_file(self, key: str, path: str):
+        if os.path.getsize(path) > self.small_file_limit:
+            self.files.put_file(key, path)
+            if self._lookup(key) is not None:
+                with self._write_lock():
+                    self._append_index_entries([dict(key=key, deleted=True)])
+            return
+
+        with open(path, 'rb') as source_file:
+            self.put(key, source_file.read())
+
+    def get(self, key: str) -> bytes:
+        entry = self._lookup(key)
+        if entry is None:
+            return self.files.get(key)
+
+        try:
+            return self._read_entry(entry)
+        except FileNotFoundError:
+            # the pack was compacted away after the last refresh
+            self._refresh_index()
+            entry = self._index.get(key)
+            if entry is None:
+                raise
+
+            return self._read_entry(entry)
+
+    def stream(self, key: str, chunk_size: int = DEFAULT_STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        if self._lookup(key) is None:
+            return self.files.stream(key, chunk_size)
+
+        data = self.get(key)
+        return iter([data[index:index + chunk_size] for index in range(0, len(data), chunk_size)])
+
+    def delete(self, key: str):
+        if self._lookup(key) is not None:
+            with self._write_lock():
+                if key in self._index:
+                    self._append_index_entries([dict(key=key, deleted=True)])
+
+        self.files.delete(key)
+
+    def delete_prefix(self, prefix: str):
+        directory = prefix.split('/', 1)[0]
+        self._refresh_index()
+        if self._keys_by_directory.get(directory):
+            with self._write_lock():
+                keys = [
+                    key for key in self._keys_by_directory.get(directory, ())
+                    if key.startswith(prefix)
+                ]
+                if keys:
+                    self._append_index_entries([dict(key=key, deleted=True) for key in keys])
+
+        self.files.delete_prefix(prefix)
+
+    def exists(self, key: str) -> bool:
+        return self._lookup(key) is not None or self.files.exists(key)
+
+    def size(self, key: str) -> int:
+        entry = self._lookup(key)
+        if entry is None:
+            return self.files.size(key)
+
+        return entry.length
+
+    def iterate_directories(self) -> Iterator[str]:
+        self._refresh_index()
+        with self._thread_lock:
+            packed_directories = set(self._keys_by_directory)
+
+        for directory in self.files.iterate_directories():
+            if directory not in packed_directories:
+                yield directory
+
+        yield from packed_directories
+
+    def local_path(self, key: str) -> str | None:
+        if self._lookup(key) is not None:
+            return None
+
+        return self.files.local_path(key)
+
+    def compact(self):
+        """
+        Rewrite the live records of the sealed packs whose dead bytes exceed `compaction_dead_ratio`
+        into the active pack, then remove those packs and rewrite the index with the live entries only.
+        """
+        with self._write_lock():
+            pack_numbers = self._get_pack_numbers()
+            active_pack_number = self._get_active_pack_number(pack_numbers)
+
+            compacting_pack_numbers = []
+            for pack_number in pack_numbers:
+                if pack_number >= active_pack_number:
+                    continue
+
+                pack_size = os.path.getsize(self._get_pack_path(pack_number))
+                live_bytes = self._live_bytes.get(pack_number, 0)
+                if pack_size and 1 - live_bytes / pack_size >= self.compaction_dead_ratio:
+                    compacting_pack_numbers.append(pack_number)
+
+            if not compacting_pack_numbers:
+                return
+
+            for pack_number in compacting_pack_numbers:
+                moving_entries = [
+                    (key, entry) for key, entry in self._index.items()
+                    if entry.pack_number == pack_number
+                ]
+                new_entries = [
+                    self._append_record(key, self._read_entry(entry))
+                    for key, entry in moving_entries
+                ]
+                self._append_index_entries(new_entries)
+
+            temp_index_path = f'{self._index_path}.tmp'
+            with open(temp_index_path, 'wb') as temp_index_file:
+                for key, entry in self._index.items():
+                    line = dict(key=key, pack=entry.pack_number, offset=entry.offset, length=entry.length)
+                    temp_index_file.write(json.dumps(line, ensure_ascii=False).encode('utf-8') + b'\n')
+
+            os.replace(temp_index_path, self._index_path)
+            self._refresh_index()
+
+            # pack numbers are taken from the existing files, creating the active pack before the removal
+            # keeps a removed number from being given to a new pack that other processes would read
+            # through their map of the removed one
+            with open(self._get_pack_path(active_pack_number), 'ab'):
+                pass
+
+            for pack_number in compacting_pack_numbers:
+                os.remove(self._get_pack_path(pack_number))
+                logger.info('pack %s is compacted', pack_number)
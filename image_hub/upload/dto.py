@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from pydantic import BaseModel, Field, field_validator
+
+from image_hub.utils import is_safe_file_name
+
+
+class UploadSessionCreationDto(BaseModel):
+    file_name: str = Field(min_length=1, max_length=511)
+    size: int = Field(gt=0)
+    categories: list[int] = Field(default_factory=list, max_length=5)
+    description: str | None = Field(None, max_length=511)
+
+    @field_validator('file_name')
+    @classmethod
+    def check_file_name(cls, file_name: str) -> str:
+        if not is_safe_file_name(file_name):
+            raise ValueError('file_name must be a file name without directories')
+
+        return file_name
+
+
+class UploadSessionDto(BaseModel):
+    id: str
+    file_name: str
+    size: int
+    offset: int
+    expires_at: datetime
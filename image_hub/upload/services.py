@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import uuid
+from datetime import timedelta
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlmodel import delete, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from image_hub.config import get_settings
+from image_hub.database.models import UploadSession
+from image_hub.database.session import get_engine
+from image_hub.upload.dto import UploadSessionDto
+from image_hub.upload.upload_file import delete_upload_file
+from image_hub.utils import time_now
+
+
+logger = logging.getLogger(__name__)
+
+
+def create_upload_id() -> str:
+    return uuid.uuid4().hex
+
+
+def get_upload_expiry():
+    return time_now() + timedelta(seconds=get_settings().upload_session_ttl_seconds)
+
+
+def get_upload_session_dto(upload_session: UploadSession) -> UploadSessionDto:
+    return UploadSessionDto(
+        id=upload_session.id,
+        file_name=upload_session.file_name,
+        size=upload_session.size,
+        offset=upload_session.received_size,
+        expires_at=upload_session.expires_at
+    )
+
+
+async def get_upload_session(
+    upload_id: str,
+    user_id: int,
+    session: AsyncSession,
+    for_update: bool = False
+) -> UploadSession:
+    """
+    Return the unexpired upload session of the user. With `for_update` the row stays locked
+    until the transaction ends, which serializes the finalization and the delete of an upload.
+    """
+    query = select(UploadSession).where(
+        UploadSession.id == upload_id,
+        UploadSession.user_id == user_id,
+        UploadSession.expires_at > time_now()
+    )
+    if for_update:
+        query = query.with_for_update()
+
+    result = await session.exec(query)
+    upload_session = result.first()
+    if upload_session is None:
+        raise HTTPException(
+            status_code=404,
+            detail=f'Upload {upload_id} does not exist or has expired'
+        )
+
+    return upload_session
+
+
+async def purge_expired_upload_sessions():
+    async with AsyncSession(get_engine()) as session:
+        result = await session.exec(
+            delete(UploadSession).where(
+                UploadSession.expires_at <= time_now()
+            ).returning(UploadSession.id)
+        )
+        upload_ids = list(result.scalars())
+        await session.commit()
+
+    for upload_id in upload_ids:
+        await run_in_threadpool(delete_upload_file, upload_id)
+
+    if upload_ids:
+        logger.info('%s expired uploads are purged', len(upload_ids))
+
+
+async def purge_expired_upload_sessions_periodically():
+    while True:
+        await asyncio.sleep(get_settings().upload_session_cleanup_interval_seconds)
+        try:
+            await purge_expired_upload_sessions()
+        except Exception:
+            logger.exception('failed to purge the expired uploads')
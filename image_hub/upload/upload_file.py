@@ -0,0 +1,118 @@
+import fcntl
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, BinaryIO
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+
+from image_hub.config import get_settings
+
+
+UPLOAD_DIRECTORY_NAME = '.uploads'
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+
+def get_upload_directory() -> str:
+    return os.path.join(get_settings().image_path, UPLOAD_DIRECTORY_NAME)
+
+
+def get_upload_file_path(upload_id: str) -> str:
+    return os.path.join(get_upload_directory(), f'{upload_id}.part')
+
+
+def create_upload_file(upload_id: str):
+    os.makedirs(get_upload_directory(), exist_ok=True)
+    with open(get_upload_file_path(upload_id), 'wb'):
+        pass
+
+
+@asynccontextmanager
+async def lock_upload_file(upload_id: str) -> AsyncIterator[None]:
+    """
+    Hold an exclusive lock of the upload file, taken by the appends and the finalization of the upload
+    in any process, raising 409 when another request holds it.
+    The lock goes away with its process, an append killed midway does not block the upload.
+    """
+    try:
+        lock_file = await run_in_threadpool(open, get_upload_file_path(upload_id), 'rb')
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail='Upload file not found')
+
+    try:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise HTTPException(
+                status_code=409,
+                detail=f'Upload {upload_id} is being appended or finalized by another request'
+            )
+
+        yield
+    finally:
+        lock_file.close()
+
+
+def delete_upload_file(upload_id: str):
+    try:
+        os.remove(get_upload_file_path(upload_id))
+    except FileNotFoundError:
+        pass
+
+
+def _open_at(upload_id: str, offset: int) -> BinaryIO:
+    upload_file = open(get_upload_file_path(upload_id), 'r+b')
+    # drop whatever an interrupted append wrote after the last recorded offset
+    upload_file.truncate(offset)
+    upload_file.seek(offset)
+    return upload_file
+
+
+def _write_and_sync(upload_file: BinaryIO, data: bytes):
+    upload_file.write(data)
+    upload_file.flush()
+    os.fsync(upload_file.fileno())
+
+
+async def append_upload_chunks(
+    upload_id: str,
+    offset: int,
+    size: int,
+    chunks: AsyncIterator[bytes]
+) -> int:
+    """
+    Write `chunks` to the upload file starting at `offset` and return the offset after them.
+    When the client disconnects, the bytes received until then are kept, so the upload resumes from there.
+    Every returned offset is synced to the disk, the caller can record it safely.
+    """
+    try:
+        upload_file = await run_in_threadpool(_open_at, upload_id, offset)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail='Upload file not found')
+
+    try:
+        buffer = bytearray()
+        try:
+            async for chunk in chunks:
+                if offset + len(buffer) + len(chunk) > size:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f'Chunk exceeds the declared upload size of {size} bytes'
+                    )
+
+                buffer += chunk
+                if len(buffer) >= WRITE_BUFFER_SIZE:
+                    await run_in_threadpool(_write_and_sync, upload_file, bytes(buffer))
+                    offset += len(buffer)
+                    buffer.clear()
+        except ClientDisconnect:
+            pass
+
+        if buffer:
+            await run_in_threadpool(_write_and_sync, upload_file, bytes(buffer))
+            offset += len(buffer)
+    finally:
+        await run_in_threadpool(upload_file.close)
+
+    return offset
@@ -1,3 +1,4 @@
+import os
 import shutil
 from datetime import datetime, timezone
 
@@ -8,3 +9,16 @@ def time_now():
 
 def delete_directory(directory_path):
     shutil.rmtree(directory_path, ignore_errors=True)
+
+
+def is_safe_file_name(file_name: str) -> bool:
+    """
+    Whether `file_name` is a single path segment, it becomes part of a storage key and of a file path.
+    """
+    return (
+        file_name not in ('', '.', '..')
+        and '/' not in file_name
+        and '\\' not in file_name
+        and '\x00' not in file_name
+        and os.path.basename(file_name) == file_name
+    )
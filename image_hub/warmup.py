@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import time
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from image_hub.auth.dto import UserAuthDto
+from image_hub.config import get_settings
+from image_hub.database.session import get_engine, get_read_engine
+from image_hub.image.cursor import encode_cursor
+from image_hub.image.decode_pool import start_decode_pool
+from image_hub.image.query import (
+    ADMIN_CURSOR_KIND,
+    ADMIN_OWN_IMAGES_SEGMENT,
+    ADMIN_USER_IMAGES_SEGMENT,
+    USER_CURSOR_KIND,
+    check_image_access,
+    get_accessible_image_ids,
+    get_base_image_query,
+    get_image_mime_type,
+)
+
+
+logger = logging.getLogger(__name__)
+
+# set by `image_hub.serve` so every worker can report its startup time from the launch
+SERVE_STARTED_AT_ENV = 'IMAGE_HUB_SERVE_STARTED_AT'
+# no user or image has this id, the warm-up queries return nothing
+WARM_UP_ID = 0
+
+
+async def warm_up_queries(session: AsyncSession):
+    """
+    Run the hot queries of `image_hub.image.query` once in each of their shapes,
+    filling the compiled statement cache of the engine and the prepared statements of the connection.
+    """
+    admin_auth = UserAuthDto(user_id=WARM_UP_ID, is_admin=True)
+    user_auth = UserAuthDto(user_id=WARM_UP_ID, is_admin=False)
+    list_queries = [
+        get_base_image_query(admin_auth, 1),
+        get_base_image_query(
+            admin_auth, 1, encode_cursor(ADMIN_CURSOR_KIND, (ADMIN_OWN_IMAGES_SEGMENT, WARM_UP_ID))
+        ),
+        get_base_image_query(
+            admin_auth, 1, encode_cursor(ADMIN_CURSOR_KIND, (ADMIN_USER_IMAGES_SEGMENT, WARM_UP_ID))
+        ),
+        get_base_image_query(user_auth, 1),
+        get_base_image_query(user_auth, 1, encode_cursor(USER_CURSOR_KIND, (WARM_UP_ID,))),
+    ]
+    for query in list_queries:
+        await session.exec(query)
+
+    for user_auth_dto in (admin_auth, user_auth):
+        await get_accessible_image_ids([WARM_UP_ID], user_auth_dto, session)
+        for access_check in (check_image_access, get_image_mime_type):
+            try:
+                await access_check(WARM_UP_ID, user_auth_dto, session)
+            except HTTPException:
+                pass
+
+
+async def warm_up_engine(engine: AsyncEngine):
+    """
+    Open the connections of the pool at once and warm up the queries on each of them.
+    """
+    connections = await asyncio.gather(
+        *(engine.connect().start() for _ in range(engine.pool.size()))
+    )
+    try:
+        for connection in connections:
+            async with AsyncSession(connection) as session:
+                await warm_up_queries(session)
+    finally:
+        await asyncio.gather(*(connection.close() for connection in connections))
+
+
+async def warm_up():
+    get_settings()
+    await start_decode_pool()
+    await warm_up_engine(get_engine())
+
+    read_engine = get_read_engine()
+    if read_engine is not None:
+        try:
+            await warm_up_engine(read_engine)
+        except Exception:
+            # the replica is optional, reads fall back to the primary while it is down
+            logger.exception('failed to warm up the read replica')
+
+
+def report_startup_time(started_at: float):
+    elapsed = time.perf_counter() - started_at
+    serve_started_at = os.environ.get(SERVE_STARTED_AT_ENV)
+    if serve_started_at is None:
+        logger.info('worker %s is ready, startup took %.2fs', os.getpid(), elapsed)
+        return
+
+    logger.info(
+        'worker %s is ready, startup took %.2fs, %.2fs since the server was launched',
+        os.getpid(),
+        elapsed,
+        time.time() - float(serve_started_at)
+    )
@@ -0,0 +1,57 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from image_hub.config import get_settings
+from image_hub.image.decode_pool import get_decode_worker_count, process_image_source
+from image_hub.image.errors import InvalidImage
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch, tmp_path):
+    monkeypatch.setenv('HUB_DATABASE_URL', 'postgresql+asyncpg://hub@localhost/hub')
+    monkeypatch.setenv('HUB_DATABASE_SYNC_URL', 'postgresql://hub@localhost/hub')
+    monkeypatch.setenv('HUB_AUTH_SECRET_KEY', 'secret')
+    monkeypatch.setenv('HUB_IMAGE_PATH', str(tmp_path))
+    get_settings.cache_clear()
+    yield
+    get_settings.cache_clear()
+
+
+def save_image(image_format: str) -> bytes:
+    source = BytesIO()
+    Image.effect_noise((600, 400), 64).convert('RGB').save(source, format=image_format)
+    return source.getvalue()
+
+
+@pytest.mark.parametrize(
+    ('decode_workers', 'serve_workers', 'expected'),
+    [(4, None, 4), (8, 4, 2), (4, 8, 1)]
+)
+def test_decode_workers_are_shared_by_serve_workers(monkeypatch, decode_workers, serve_workers, expected):
+    monkeypatch.setenv('HUB_IMAGE_DECODE_WORKERS', str(decode_workers))
+    if serve_workers is not None:
+        monkeypatch.setenv('HUB_SERVE_WORKERS', str(serve_workers))
+
+    assert get_decode_worker_count() == expected
+
+
+def test_process_image_source():
+    processed = process_image_source(save_image('PNG'))
+
+    assert processed.metadata.width == 600
+    assert processed.metadata.height == 400
+
+
+@pytest.mark.parametrize('image_format', ['JPEG', 'PNG'])
+def test_truncated_image_is_invalid(image_format):
+    content = save_image(image_format)
+
+    with pytest.raises(InvalidImage):
+        process_image_source(content[:len(content) // 2])
+
+
+def test_missing_file_is_not_invalid_image(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        process_image_source(str(tmp_path / 'missing'))
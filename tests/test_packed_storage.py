@@ -0,0 +1,77 @@
+import os
+
+import pytest
+
+from image_hub.storage.packed import PackedStorage
+
+
+@pytest.fixture
+def root(tmp_path) -> str:
+    return str(tmp_path)
+
+
+def create_storage(root: str, compaction_dead_ratio: float = 0.5) -> PackedStorage:
+    # every record fills its pack, the next one starts a new pack
+    return PackedStorage(root, small_file_limit=1024, max_pack_size=16, compaction_dead_ratio=compaction_dead_ratio)
+
+
+def test_put_get_delete(root):
+    storage = create_storage(root)
+    storage.put('1/a', b'aaaaa')
+    storage.put('2/thumbnail/b', b'b' * 2048)
+
+    assert storage.get('1/a') == b'aaaaa'
+    assert storage.get('2/thumbnail/b') == b'b' * 2048
+    assert sorted(storage.iterate_directories()) == ['1', '2']
+
+    storage.delete_prefix('1/')
+    storage.delete('2/thumbnail/b')
+
+    assert not storage.exists('1/a')
+    assert not storage.exists('2/thumbnail/b')
+    with pytest.raises(FileNotFoundError):
+        storage.get('1/a')
+
+
+def test_other_process_sees_compaction(root):
+    writer = create_storage(root)
+    reader = create_storage(root)
+    for image_id in range(10):
+        writer.put(f'{image_id}/x', bytes([image_id]) * 100)
+
+    for image_id in range(10):
+        assert reader.get(f'{image_id}/x') == bytes([image_id]) * 100
+
+    for image_id in range(8):
+        writer.delete(f'{image_id}/x')
+
+    writer.compact()
+
+    for image_id in range(8, 10):
+        assert reader.get(f'{image_id}/x') == bytes([image_id]) * 100
+
+    pack_numbers = {
+        int(file_name[len('pack-'):-len('.dat')])
+        for file_name in os.listdir(writer.pack_directory)
+        if file_name.endswith('.dat')
+    }
+    # the maps of the removed packs are closed, their disk space is given back
+    assert set(reader._maps) <= pack_numbers
+
+
+def test_compacted_pack_number_is_not_reused(root):
+    # the first pack keeps enough live bytes not to be compacted
+    writer = create_storage(root, compaction_dead_ratio=0.9)
+    reader = create_storage(root, compaction_dead_ratio=0.9)
+    writer.put('1/a', b'aaaaa')
+    writer.put('9/secret', b'zzzzz')
+    assert reader.get('9/secret') == b'zzzzz'
+
+    # the last sealed pack only holds dead records, the compaction removes it without writing anything
+    writer.delete('9/secret')
+    writer.compact()
+    writer.put('5/new', b'xxxxx')
+
+    assert reader.get('5/new') == b'xxxxx'
+    with pytest.raises(FileNotFoundError):
+        reader.get('9/secret')
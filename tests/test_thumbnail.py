@@ -0,0 +1,31 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from image_hub.image.thumbnail import create_thumbnail
+
+
+def open_saved_image(img: Image.Image, image_format: str) -> Image.Image:
+    source = BytesIO()
+    img.save(source, format=image_format)
+    source.seek(0)
+    return Image.open(source)
+
+
+@pytest.mark.parametrize('mode', ['I;16', 'I', 'F', '1', 'P', 'L', 'LA', 'RGB', 'RGBA', 'CMYK'])
+def test_create_thumbnail_of_every_mode(mode):
+    thumbnail = create_thumbnail(Image.new(mode, (600, 400)), 128)
+
+    assert thumbnail.mode == 'RGB'
+    assert thumbnail.size == (128, 85)
+
+
+def test_create_thumbnail_of_16_bit_grayscale_png():
+    img = open_saved_image(Image.new('I;16', (600, 400), 1000), 'PNG')
+    assert img.mode.startswith('I;16')
+
+    thumbnail = create_thumbnail(img, 128)
+
+    assert thumbnail.mode == 'RGB'
+    assert thumbnail.size == (128, 85)